@@ -0,0 +1,363 @@
+"""
+ASRバックエンド
+transcribe.pyから使う共通インターフェースと実装
+
+  mlx      Parakeet MLX（Apple Silicon、既定）
+  cpu      faster-whisper（CTranslate2、Linux等のCPUのみの環境向け）
+  fixture  既存のASR結果のトークン時刻を再生する（音声は見ない。下流処理の計測用）
+
+MLX・faster-whisperはload()で初めてimportするので、使わないバックエンドの起動は軽い
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+# 重複とみなすトークン開始時刻の差（秒）
+DEDUP_TOLERANCE = 0.3
+
+
+@dataclass
+class Token:
+    """バックエンド共通のトークン（parakeet_mlxのAlignedTokenと同じ属性）"""
+    id: int
+    text: str
+    start: float
+    duration: float
+    confidence: float = 1.0
+    end: float = 0.0
+
+    def __post_init__(self) -> None:
+        self.end = self.start + self.duration
+
+
+def token_to_record(token) -> dict:
+    """ジャーナル保存用にトークンを辞書化"""
+    return {
+        "id": token.id,
+        "text": token.text,
+        "start": token.start,
+        "duration": token.duration,
+        "confidence": token.confidence,
+    }
+
+
+def stitch_chunk_tokens(chunks: list[tuple[float, float, list]]) -> list:
+    """
+    チャンクごとのトークンを1本にまとめる
+    chunks: (チャンク開始秒, チャンク終了秒, トークン) を開始順に並べたもの
+
+    隣接チャンクのオーバーラップ区間は中点で切り分け（チャンク端は認識が不安定なため）、
+    切れ目の前後 DEDUP_TOLERANCE のトークンは両側に残す（同じ単語でもチャンクごとに時刻が揺れ、
+    両側から落ちることがあるため）。同じテキスト・近い時刻のトークンが両側に残った場合は
+    confidenceの高い方だけを残す
+    """
+    merged = []
+    for i, (chunk_start, chunk_end, tokens) in enumerate(chunks):
+        lo = float("-inf")
+        hi = float("inf")
+        if i > 0 and chunks[i - 1][1] > chunk_start:
+            lo = (chunk_start + chunks[i - 1][1]) / 2
+        if i < len(chunks) - 1 and chunks[i + 1][0] < chunk_end:
+            hi = (chunks[i + 1][0] + chunk_end) / 2
+
+        kept = [t for t in tokens if lo - DEDUP_TOLERANCE <= (t.start + t.end) / 2 < hi + DEDUP_TOLERANCE]
+
+        # 切れ目付近の重複除去（前のチャンクのトークンは中点が lo + DEDUP_TOLERANCE より前）
+        matched = set()
+        first = min((t.start for t in kept), default=lo)
+        tail = [j for j in range(len(merged)) if merged[j].start >= first - DEDUP_TOLERANCE]
+        for token in kept:
+            if token.start >= lo + 2 * DEDUP_TOLERANCE:
+                merged.append(token)
+                continue
+            duplicate = next(
+                (j for j in tail
+                 if j not in matched
+                 and merged[j].text == token.text
+                 and abs(merged[j].start - token.start) < DEDUP_TOLERANCE),
+                None
+            )
+            if duplicate is None:
+                merged.append(token)
+                continue
+            matched.add(duplicate)
+            if token.confidence > merged[duplicate].confidence:
+                merged[duplicate] = token
+
+    merged.sort(key=lambda t: t.start)
+    return merged
+
+
+# 文末とみなす文字
+SENTENCE_END = ("。", "？", "！", "?", "!")
+
+
+def tokens_to_result_dict(tokens: list) -> dict:
+    """トークンを文末記号で文に区切り、出力用の辞書（transcribe.pyのJSON形式）にする"""
+    groups = []
+    current = []
+    for token in tokens:
+        current.append(token)
+        if any(mark in token.text for mark in SENTENCE_END):
+            groups.append(current)
+            current = []
+    if current:
+        groups.append(current)
+
+    sentences = []
+    for group in groups:
+        start = group[0].start
+        end = group[-1].end
+        # 文のconfidenceはトークンの幾何平均（parakeet_mlxと同じ）
+        confidence = float(np.exp(np.mean(np.log(np.array([t.confidence for t in group]) + 1e-10))))
+        sentences.append({
+            "text": "".join(t.text for t in group),
+            "start": start,
+            "end": end,
+            "duration": end - start,
+            "confidence": round(confidence, 3),
+            "tokens": [
+                {
+                    "text": t.text,
+                    "start": t.start,
+                    "end": t.end,
+                    "duration": t.duration,
+                    "confidence": round(t.confidence, 3),
+                }
+                for t in group
+            ],
+        })
+    return {"text": "".join(s["text"] for s in sentences).strip(), "sentences": sentences}
+
+
+class ASRBackend:
+    """
+    ASRバックエンドの共通インターフェース
+    load: モデルをロード（何度呼んでもよい）
+    transcribe_chunk: 1窓を認識し、元音声の絶対時刻のトークンを返す
+    merge_chunks: チャンクごとのトークンを1本にまとめる
+    build_result: トークンから出力用の辞書（text / sentences / tokens）を作る
+    """
+    name = ""
+    default_model = None
+    sample_rate = SAMPLE_RATE
+    # これより短い窓は認識しない
+    min_samples = 1
+
+    def __init__(self, model_id: str | None = None, memory_limit_gb: float | None = None):
+        self.model_id = model_id or self.default_model
+        self.memory_limit_gb = memory_limit_gb
+        self.model = None
+
+    def load(self) -> None:
+        raise NotImplementedError
+
+    def unload(self) -> None:
+        self.model = None
+
+    def transcribe_chunk(self, window: np.ndarray, start: int) -> list:
+        raise NotImplementedError
+
+    def merge_chunks(self, chunks: list[tuple[float, float, list]], overlap_duration: float) -> list:
+        return stitch_chunk_tokens(chunks)
+
+    def build_result(self, tokens: list) -> dict:
+        return tokens_to_result_dict(tokens)
+
+    def token_from_record(self, record: dict):
+        return Token(**record)
+
+    def clear_cache(self) -> None:
+        """チャンク処理後のメモリ解放（MLX以外は何もしない）"""
+
+
+class ParakeetMLXBackend(ASRBackend):
+    name = "mlx"
+    default_model = "mlx-community/parakeet-tdt_ctc-0.6b-ja"
+
+    def load(self) -> None:
+        if self.model is not None:
+            return
+        import mlx.core as mx
+        from parakeet_mlx import from_pretrained
+
+        if self.memory_limit_gb:
+            mx.set_memory_limit(int(self.memory_limit_gb * 1024 ** 3))
+        print(f"=== モデルロード中: {self.model_id} ===")
+        self.model = from_pretrained(self.model_id)
+        self.sample_rate = self.model.preprocessor_config.sample_rate
+        self.min_samples = self.model.preprocessor_config.hop_length  # 長さ0のlog melを防ぐ
+        print("モデルロード完了")
+
+    def unload(self) -> None:
+        self.model = None
+        self.clear_cache()
+
+    def transcribe_chunk(self, window: np.ndarray, start: int) -> list:
+        import mlx.core as mx
+        from parakeet_mlx.audio import get_logmel
+
+        config = self.model.preprocessor_config
+        mel = get_logmel(mx.array(window), config)
+        chunk_result = self.model.generate(mel)[0]
+
+        chunk_offset = start / config.sample_rate
+        tokens = chunk_result.tokens
+        for token in tokens:
+            token.start += chunk_offset
+            token.end = token.start + token.duration
+        return tokens
+
+    def merge_chunks(self, chunks: list[tuple[float, float, list]], overlap_duration: float) -> list:
+        """parakeet_mlxのtranscribeと同じマージ方法"""
+        from parakeet_mlx.alignment import merge_longest_common_subsequence, merge_longest_contiguous
+
+        all_tokens = []
+        for _, _, chunk_tokens in chunks:
+            if not all_tokens:
+                all_tokens = chunk_tokens
+                continue
+            try:
+                all_tokens = merge_longest_contiguous(
+                    all_tokens, chunk_tokens, overlap_duration=overlap_duration
+                )
+            except RuntimeError:
+                all_tokens = merge_longest_common_subsequence(
+                    all_tokens, chunk_tokens, overlap_duration=overlap_duration
+                )
+        return all_tokens
+
+    def build_result(self, tokens: list) -> dict:
+        from parakeet_mlx.alignment import sentences_to_result, tokens_to_sentences
+
+        result = sentences_to_result(tokens_to_sentences(tokens))
+        return {
+            "text": result.text,
+            "sentences": [
+                {
+                    "text": s.text,
+                    "start": s.start,
+                    "end": s.end,
+                    "duration": s.duration,
+                    "confidence": round(s.confidence, 3),
+                    "tokens": [
+                        {
+                            "text": t.text,
+                            "start": t.start,
+                            "end": t.end,
+                            "duration": t.duration,
+                            "confidence": round(t.confidence, 3),
+                        }
+                        for t in s.tokens
+                    ]
+                }
+                for s in result.sentences
+            ]
+        }
+
+    def token_from_record(self, record: dict):
+        from parakeet_mlx.alignment import AlignedToken
+
+        return AlignedToken(**record)
+
+    def clear_cache(self) -> None:
+        import mlx.core as mx
+
+        mx.clear_cache()
+
+
+class WhisperCPUBackend(ASRBackend):
+    """faster-whisperの単語タイムスタンプをトークンとして使う"""
+    name = "cpu"
+    default_model = "large-v3"
+    language = "ja"
+
+    def load(self) -> None:
+        if self.model is not None:
+            return
+        from faster_whisper import WhisperModel
+
+        print(f"=== モデルロード中: {self.model_id} (cpu, int8) ===")
+        self.model = WhisperModel(self.model_id, device="cpu", compute_type="int8")
+        print("モデルロード完了")
+
+    def transcribe_chunk(self, window: np.ndarray, start: int) -> list:
+        segments, _ = self.model.transcribe(
+            np.asarray(window, dtype=np.float32),
+            language=self.language,
+            word_timestamps=True,
+            condition_on_previous_text=False,
+        )
+        chunk_offset = start / self.sample_rate
+        tokens = []
+        for segment in segments:
+            for word in segment.words or []:
+                tokens.append(Token(
+                    id=-1,  # 語彙IDは使わない
+                    text=word.word,
+                    start=word.start + chunk_offset,
+                    duration=word.end - word.start,
+                    confidence=word.probability,
+                ))
+        return tokens
+
+
+class FixtureBackend(ASRBackend):
+    """
+    既存のASR結果（JSON / .asr）のトークンを、窓の区間に合わせてそのまま返す
+    音声の内容に依存しない決定的な結果になるので、モデルのない環境で下流処理を計測できる
+    model_id: 再生するASR結果のパス
+    """
+    name = "fixture"
+
+    def load(self) -> None:
+        if self.model is not None:
+            return
+        if not self.model_id:
+            raise ValueError("fixtureバックエンドには再生するASR結果のパスを --model で指定してください")
+        from asr_store import load_asr
+
+        transcript = load_asr(self.model_id)
+        texts, starts, ends = transcript.tokens()
+        order = np.argsort(starts, kind="stable")
+        conf = np.nan_to_num(np.asarray(transcript.tok_conf, dtype=np.float64), nan=1.0)
+        self.model = {
+            "text": [texts[i] for i in order],
+            "start": np.asarray(starts)[order],
+            "duration": (np.asarray(ends) - np.asarray(starts))[order],
+            "confidence": conf[order],
+        }
+        print(f"=== フィクスチャ読み込み: {self.model_id} ({len(order)} tokens) ===")
+
+    def transcribe_chunk(self, window: np.ndarray, start: int) -> list:
+        fixture = self.model
+        t0 = start / self.sample_rate
+        t1 = (start + len(window)) / self.sample_rate
+        lo, hi = np.searchsorted(fixture["start"], [t0, t1])
+        return [
+            Token(
+                id=i,
+                text=fixture["text"][i],
+                start=float(fixture["start"][i]),
+                duration=float(fixture["duration"][i]),
+                confidence=float(fixture["confidence"][i]),
+            )
+            for i in range(lo, hi)
+        ]
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (ParakeetMLXBackend, WhisperCPUBackend, FixtureBackend)
+}
+DEFAULT_BACKEND = ParakeetMLXBackend.name
+
+
+def create_backend(name: str, model_id: str | None = None, memory_limit_gb: float | None = None) -> ASRBackend:
+    """名前からバックエンドを作る（モデルのロードはload()で行う）"""
+    if name not in BACKENDS:
+        raise ValueError(f"未知のASRバックエンド: {name}（{', '.join(BACKENDS)}）")
+    return BACKENDS[name](model_id, memory_limit_gb=memory_limit_gb)
@@ -0,0 +1,96 @@
+"""
+ASR結果キャッシュ
+デコード後の音声（16kHzモノラルPCM）のハッシュ + モデル・チャンク設定をキーにASR結果JSONを保存
+ファイル名が違っても音声が同じなら再利用し、動画の再書き出しや設定変更時は再計算する
+容量上限を超えたら最終利用が古いものから削除（LRU）
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import wave
+from pathlib import Path
+
+DEFAULT_CACHE_DIR = Path(
+    os.environ.get("KIRINUKI_CACHE_DIR", Path.home() / ".cache" / "kirinuki")
+) / "asr"
+DEFAULT_MAX_GB = 2.0
+
+# PCMを読む単位（バイト）
+_READ_SIZE = 1 << 20
+
+
+def hash_wav(audio_path: Path) -> str:
+    """WAVのPCMデータ部分のSHA-256（ヘッダの差異は無視）"""
+    digest = hashlib.sha256()
+    with wave.open(str(audio_path), "rb") as w:
+        frames_per_read = _READ_SIZE // (w.getsampwidth() * w.getnchannels())
+        while True:
+            data = w.readframes(frames_per_read)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def cache_key(audio_hash: str, model_id: str, chunk_duration: float,
+              overlap_duration: float, **options) -> str:
+    """結果に影響するパラメータすべてからキーを作る"""
+    parts = {
+        "audio": audio_hash,
+        "model": model_id,
+        "chunk_duration": float(chunk_duration),
+        "overlap_duration": float(overlap_duration),
+        **options,
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ASRCache:
+    """キャッシュディレクトリ: {dir}/{key[:2]}/{key}.json"""
+
+    def __init__(self, cache_dir: Path = DEFAULT_CACHE_DIR, max_gb: float = DEFAULT_MAX_GB):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = int(max_gb * 1024 ** 3)
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Path | None:
+        """ヒットしたらキャッシュファイルのパスを返し、最終利用時刻を更新"""
+        path = self._path(key)
+        if not path.exists():
+            return None
+        os.utime(path)
+        return path
+
+    def put(self, key: str, data: dict) -> None:
+        """ASR結果をキャッシュに登録（一時ファイル経由で原子的に配置）"""
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self) -> int:
+        """容量上限まで最終利用が古いものから削除。削除件数を返す"""
+        entries = []
+        for path in self.cache_dir.glob("*/*.json"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        return removed
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+ASR結果の列指向バイナリ形式（{stem}.asr/）と共通ローダー
+
+JSON（トークンごとの辞書）は長尺動画だと読み込みが重いため、
+文・トークンの開始/終了/confidenceをnumpy配列、テキストをUTF-8文字列テーブル＋オフセットで保存し、
+memory-mapで読み込む
+
+{stem}.asr/
+  meta.json          バージョン・件数
+  strings.bin        文・トークンのテキストを連結したUTF-8
+  sent_start.npy     文の開始秒 (float64)
+  sent_end.npy       文の終了秒 (float64)
+  sent_conf.npy      文のconfidence (float32, なしはNaN)
+  sent_text.npy      文テキストのstrings.bin内バイトオフセット (int64, 文数+1)
+  sent_tokens.npy    文ごとのトークン範囲 (int64, 文数+1)
+  tok_start.npy / tok_end.npy / tok_conf.npy / tok_text.npy  トークン版
+
+Usage:
+    uv run python scripts/asr_store.py convert output/video.json   # JSON → .asr
+    uv run python scripts/asr_store.py export output/video.asr     # .asr → JSON
+"""
+
+import argparse
+import json
+import mmap
+import os
+from pathlib import Path
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+
+def asr_dir_for(path: Path) -> Path:
+    """video.json → video.asr"""
+    path = Path(path)
+    return path if path.suffix == ".asr" else path.with_suffix(".asr")
+
+
+def save_asr(data: dict, path: Path) -> Path:
+    """ASR結果の辞書を列指向形式で保存。保存先ディレクトリを返す"""
+    out_dir = asr_dir_for(path)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    sentences = data["sentences"]
+    n_sent = len(sentences)
+    n_tok = sum(len(s.get("tokens") or []) for s in sentences)
+
+    sent_start = np.empty(n_sent, dtype=np.float64)
+    sent_end = np.empty(n_sent, dtype=np.float64)
+    sent_conf = np.empty(n_sent, dtype=np.float32)
+    sent_text = np.zeros(n_sent + 1, dtype=np.int64)
+    sent_tokens = np.zeros(n_sent + 1, dtype=np.int64)
+    tok_start = np.empty(n_tok, dtype=np.float64)
+    tok_end = np.empty(n_tok, dtype=np.float64)
+    tok_conf = np.empty(n_tok, dtype=np.float32)
+    tok_text = np.zeros(n_tok + 1, dtype=np.int64)
+
+    # 文テキストを先に、トークンテキストを後ろに連結
+    sent_bytes = [s["text"].encode("utf-8") for s in sentences]
+    tok_bytes = []
+    j = 0
+    for i, s in enumerate(sentences):
+        sent_start[i] = s["start"]
+        sent_end[i] = s["end"]
+        sent_conf[i] = np.nan if s.get("confidence") is None else s["confidence"]
+        for t in s.get("tokens") or []:
+            tok_start[j] = t["start"]
+            tok_end[j] = t["end"]
+            tok_conf[j] = np.nan if t.get("confidence") is None else t["confidence"]
+            tok_bytes.append(t["text"].encode("utf-8"))
+            j += 1
+        sent_tokens[i + 1] = j
+
+    sent_text[1:] = np.cumsum([len(b) for b in sent_bytes], dtype=np.int64)
+    tok_text[1:] = np.cumsum([len(b) for b in tok_bytes], dtype=np.int64)
+    tok_text += sent_text[-1]
+
+    with open(out_dir / "strings.bin", "wb") as f:
+        f.write(b"".join(sent_bytes))
+        f.write(b"".join(tok_bytes))
+
+    arrays = {
+        "sent_start": sent_start, "sent_end": sent_end, "sent_conf": sent_conf,
+        "sent_text": sent_text, "sent_tokens": sent_tokens,
+        "tok_start": tok_start, "tok_end": tok_end, "tok_conf": tok_conf,
+        "tok_text": tok_text,
+    }
+    for name, arr in arrays.items():
+        np.save(out_dir / f"{name}.npy", arr)
+
+    # meta.jsonは最後に書く（存在すれば書き込み完了とみなす）
+    meta = {"version": FORMAT_VERSION, "sentences": n_sent, "tokens": n_tok}
+    with open(out_dir / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+    return out_dir
+
+
+class ASRTranscript:
+    """列指向ASR結果。配列はmemory-mapされ、テキストは必要な分だけデコードする"""
+
+    def __init__(self, asr_dir: Path):
+        self.path = Path(asr_dir)
+        with open(self.path / "meta.json") as f:
+            self.meta = json.load(f)
+
+        def load(name):
+            return np.load(self.path / f"{name}.npy", mmap_mode="r")
+
+        self.sent_start = load("sent_start")
+        self.sent_end = load("sent_end")
+        self.sent_conf = load("sent_conf")
+        self.sent_text = load("sent_text")
+        self.sent_tokens = load("sent_tokens")
+        self.tok_start = load("tok_start")
+        self.tok_end = load("tok_end")
+        self.tok_conf = load("tok_conf")
+        self.tok_text = load("tok_text")
+
+        size = os.path.getsize(self.path / "strings.bin")
+        if size:
+            with open(self.path / "strings.bin", "rb") as f:
+                self.strings = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.strings = b""
+
+    def __len__(self) -> int:
+        return len(self.sent_start)
+
+    def _decode(self, offsets: np.ndarray, start: int, end: int) -> list[str]:
+        """offsets[start:end+1] で区切られたテキストをまとめてデコード"""
+        if end <= start:
+            return []
+        base = int(offsets[start])
+        blob = self.strings[base:int(offsets[end])]
+        bounds = (np.asarray(offsets[start:end + 1]) - base).tolist()
+        return [blob[bounds[k]:bounds[k + 1]].decode("utf-8") for k in range(end - start)]
+
+    def sentence_text(self, i: int) -> str:
+        return self._decode(self.sent_text, i, i + 1)[0]
+
+    def sentence_texts(self, start: int = 0, end: int | None = None) -> list[str]:
+        return self._decode(self.sent_text, start, len(self) if end is None else end)
+
+    def token_texts(self, start: int = 0, end: int | None = None) -> list[str]:
+        return self._decode(self.tok_text, start, len(self.tok_start) if end is None else end)
+
+    @property
+    def text(self) -> str:
+        return "".join(self.sentence_texts()).strip()
+
+    def sentence_dicts(self) -> list[dict]:
+        """トークンを含まない文の辞書リスト（segment系スクリプト向け）"""
+        texts = self.sentence_texts()
+        starts = self.sent_start.tolist()
+        ends = self.sent_end.tolist()
+        return [
+            {"text": text, "start": s, "end": e, "duration": e - s}
+            for text, s, e in zip(texts, starts, ends)
+        ]
+
+    def text_between(self, start_sec: float, end_sec: float) -> str:
+        """指定区間と重なる文のテキストを連結"""
+        mask = (self.sent_end > start_sec) & (self.sent_start < end_sec)
+        idx = np.flatnonzero(mask)
+        if len(idx) == 0:
+            return ""
+        # 文は時刻順なので重なる文は連続区間
+        texts = self.sentence_texts(int(idx[0]), int(idx[-1]) + 1)
+        return "".join(texts[k - idx[0]] for k in idx).strip()
+
+    def tokens(self) -> tuple[list[str], np.ndarray, np.ndarray]:
+        """全トークンの (テキスト, 開始秒, 終了秒)"""
+        return self.token_texts(), self.tok_start, self.tok_end
+
+    def to_dict(self) -> dict:
+        """transcribe.pyのJSONと同じ形式の辞書に戻す（エクスポート用）"""
+        sent_texts = self.sentence_texts()
+        tok_texts = self.token_texts()
+
+        def conf(x):
+            return None if np.isnan(x) else round(float(x), 3)
+
+        sentences = []
+        for i, text in enumerate(sent_texts):
+            t0, t1 = int(self.sent_tokens[i]), int(self.sent_tokens[i + 1])
+            start, end = float(self.sent_start[i]), float(self.sent_end[i])
+            sentences.append({
+                "text": text,
+                "start": start,
+                "end": end,
+                "duration": end - start,
+                "confidence": conf(self.sent_conf[i]),
+                "tokens": [
+                    {
+                        "text": tok_texts[j],
+                        "start": float(self.tok_start[j]),
+                        "end": float(self.tok_end[j]),
+                        "duration": float(self.tok_end[j] - self.tok_start[j]),
+                        "confidence": conf(self.tok_conf[j]),
+                    }
+                    for j in range(t0, t1)
+                ],
+            })
+        return {"text": "".join(sent_texts).strip(), "sentences": sentences}
+
+
+def load_asr(path: str | Path) -> ASRTranscript:
+    """
+    ASR結果を読み込む
+    path: {stem}.json または {stem}.asr
+    JSONを指定しても、同名の.asrが存在し新しければそちらを使う
+    .asrがなければJSONから変換して保存（次回から高速）
+    """
+    path = Path(path)
+    asr_dir = asr_dir_for(path)
+    json_path = path if path.suffix != ".asr" else path.with_suffix(".json")
+
+    meta = asr_dir / "meta.json"
+    if meta.exists() and (
+        not json_path.exists() or meta.stat().st_mtime >= json_path.stat().st_mtime
+    ):
+        return ASRTranscript(asr_dir)
+
+    with open(json_path, encoding="utf-8") as f:
+        data = json.load(f)
+    return ASRTranscript(save_asr(data, asr_dir))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ASR結果の列指向形式（.asr）変換")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_convert = sub.add_parser("convert", help="JSON → .asr")
+    p_convert.add_argument("input", type=Path, help="ASR結果JSON")
+    p_export = sub.add_parser("export", help=".asr → JSON")
+    p_export.add_argument("input", type=Path, help="ASR結果ディレクトリ（.asr）")
+    p_export.add_argument("-o", "--output", type=Path, help="出力JSON（省略時は同名.json）")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        with open(args.input, encoding="utf-8") as f:
+            data = json.load(f)
+        out_dir = save_asr(data, args.input)
+        print(f"保存: {out_dir}")
+    else:
+        transcript = ASRTranscript(asr_dir_for(args.input))
+        output = args.output or asr_dir_for(args.input).with_suffix(".json")
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(transcript.to_dict(), f, ensure_ascii=False, indent=2)
+        print(f"保存: {output}")
+
+
+if __name__ == "__main__":
+    main()
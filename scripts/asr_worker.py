@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+常駐ASRワーカー
+ASRモデルをロードしたまま待機し、Unixソケット経由でASRジョブを受け付ける
+transcribe.py --use-worker から利用（動画ごとのモデルロードを省略）
+
+Usage:
+    uv run python scripts/asr_worker.py &
+    uv run python scripts/transcribe.py video.mp4 --use-worker
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import time
+from pathlib import Path
+
+from asr_backends import BACKENDS, DEFAULT_BACKEND, create_backend
+from transcribe import DEFAULT_WORKER_SOCKET, transcribe_with_memory_clear
+
+
+class _LogForwarder(io.TextIOBase):
+    """ジョブ中のprint出力を1行ずつクライアントへ転送"""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self._pending = ""
+
+    def write(self, s: str) -> int:
+        self._pending += s
+        while "\n" in self._pending:
+            line, self._pending = self._pending.split("\n", 1)
+            sys.__stdout__.write(line + "\n")
+            try:
+                self.wfile.write(json.dumps({"log": line}, ensure_ascii=False).encode("utf-8") + b"\n")
+                self.wfile.flush()
+            except OSError:
+                pass  # クライアント切断後もジョブは継続
+        return len(s)
+
+
+class ASRJobHandler(socketserver.StreamRequestHandler):
+    """1接続 = 1ジョブ。サーバーはシングルスレッドなのでジョブは順番に処理される"""
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+
+        try:
+            job = json.loads(line)
+            response = self.server.run_job(job, _LogForwarder(self.wfile))
+        except Exception as e:
+            print(f"  [ERROR] {e}", file=sys.stderr)
+            response = {"ok": False, "error": str(e)}
+
+        try:
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+        except OSError:
+            pass
+
+
+class ASRWorkerServer(socketserver.UnixStreamServer):
+    def __init__(self, socket_path: str, backend_name: str, model_id: str | None):
+        self.backend = create_backend(backend_name, model_id)
+        self.backend.load()
+        self.jobs_done = 0
+        super().__init__(socket_path, ASRJobHandler)
+
+    def run_job(self, job: dict, log) -> dict:
+        if job.get("backend", self.backend.name) != self.backend.name:
+            return {"ok": False, "error": f"ワーカーのバックエンドは {self.backend.name} です"}
+        if job.get("model", self.backend.model_id) != self.backend.model_id:
+            return {"ok": False, "error": f"ワーカーのモデルは {self.backend.model_id} です"}
+
+        source = Path(job["source"])
+        output = Path(job["output"])
+        chunk_duration = job.get("chunk_duration", 180.0)
+        overlap_duration = job.get("overlap_duration", 15.0)
+
+        started = time.time()
+        with contextlib.redirect_stdout(log):
+            print(f"=== ジョブ受付: {source} ===")
+            transcribe_with_memory_clear(
+                source, output,
+                model_id=self.backend.model_id,
+                chunk_duration=chunk_duration,
+                overlap_duration=overlap_duration,
+                stream=job.get("stream", False),
+                vad=job.get("vad", False),
+                backend=self.backend,
+                journal_path=Path(job["journal"]) if job.get("journal") else None,
+                resume=job.get("resume", False),
+                output_format=job.get("format", "both"),
+                input_path=Path(job["input"]) if job.get("input") else None,
+            )
+
+        # ジョブ間でメモリクリア
+        self.backend.clear_cache()
+        self.jobs_done += 1
+        elapsed = time.time() - started
+        print(f"ジョブ完了 #{self.jobs_done}: {output} ({elapsed:.1f}s)")
+        return {"ok": True, "output": str(output), "elapsed": elapsed}
+
+
+def request_worker_alive(socket_path: str) -> bool:
+    """ソケットの先でワーカーが応答するか"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常駐ASRワーカー（モデルを保持したままジョブを処理）")
+    parser.add_argument("--socket", default=DEFAULT_WORKER_SOCKET,
+                        help=f"待ち受けるUnixソケット (default: {DEFAULT_WORKER_SOCKET})")
+    parser.add_argument("--backend", choices=list(BACKENDS), default=DEFAULT_BACKEND,
+                        help=f"ASRバックエンド (default: {DEFAULT_BACKEND})")
+    parser.add_argument("--model", type=str, default=None, help="モデルID（省略時はバックエンドの既定）")
+    args = parser.parse_args()
+
+    if os.path.exists(args.socket):
+        if request_worker_alive(args.socket):
+            print(f"[ERROR] ワーカーは既に起動しています: {args.socket}", file=sys.stderr)
+            sys.exit(1)
+        # 前回の異常終了で残ったソケットを削除
+        os.unlink(args.socket)
+
+    server = ASRWorkerServer(args.socket, args.backend, args.model)
+    print(f"=== 待機中: {args.socket} ===")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
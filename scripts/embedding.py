@@ -0,0 +1,260 @@
+"""
+文embedding（segment.py / segment-with-claude.py 共通）
+文をトークン長でソートし、パディング込みのトークン数が予算内に収まるようにバッチを組む
+短い文は大きなバッチ、長い文は小さなバッチになり、パディングの無駄とバッチ数が減る
+
+バックエンド:
+  mlx  mlx-embeddings（Apple Silicon、既定）
+  cpu  sentence-transformers（PyTorch CPU、Linux等のMLXのない環境向け）
+MLX・sentence-transformersはload()で初めてimportする
+
+embeddingは行ごとのスケールつきint8で扱う（キャッシュ容量がfloat32の約1/4）
+類似度はコサインなのでスケールは不要で、segment_coreはint8行列のまま計算する
+"""
+
+import gc
+import time
+
+import numpy as np
+
+# 1バッチのトークン数上限（文数 × バッチ内最長トークン数）
+DEFAULT_TOKEN_BUDGET = 2048
+# MLXキャッシュがこれを超えたらクリア（MB）
+DEFAULT_CACHE_LIMIT_MB = 1024
+MAX_LENGTH = 128
+
+
+def quantize_rows(embeddings: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    行ごとのスケールでint8に量子化
+    戻り値: (int8行列, スケール)。元の行 ≈ int8行 × スケール
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    scales = np.abs(embeddings).max(axis=1) / 127
+    scales[scales == 0] = 1
+    quantized = np.rint(embeddings / scales[:, None]).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+class EmbeddingBackend:
+    """
+    embeddingバックエンドの共通インターフェース
+    load: モデルとHuggingFaceトークナイザをロード（self.model / self.tokenizer）
+    encode_batch: パディング済みのトークン列からL2正規化済みのembeddingを返す
+    """
+    name = ""
+    default_model = None
+
+    def __init__(self, model_path: str | None = None):
+        self.model_path = model_path or self.default_model
+        self.model = None
+        self.tokenizer = None
+
+    def load(self) -> None:
+        raise NotImplementedError
+
+    def unload(self) -> None:
+        self.model = None
+        self.tokenizer = None
+        gc.collect()
+
+    def encode_batch(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def cache_memory(self) -> int:
+        """ライブラリが保持しているキャッシュのバイト数（MLX以外は0）"""
+        return 0
+
+    def clear_cache(self) -> None:
+        """キャッシュ解放（MLX以外は何もしない）"""
+
+
+class MLXEmbeddingBackend(EmbeddingBackend):
+    name = "mlx"
+    default_model = "./models/paraphrase-multilingual-MiniLM-L12-v2-mlx"
+
+    def load(self) -> None:
+        if self.model is not None:
+            return
+        from mlx_embeddings.utils import load
+
+        self.model, tokenizer = load(self.model_path)
+        self.tokenizer = tokenizer._tokenizer
+
+    def unload(self) -> None:
+        super().unload()
+        self.clear_cache()
+
+    def encode_batch(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        import mlx.core as mx
+
+        outputs = self.model(input_ids=mx.array(input_ids), attention_mask=mx.array(attention_mask))
+        return np.array(outputs.text_embeds)
+
+    def cache_memory(self) -> int:
+        import mlx.core as mx
+
+        return mx.get_cache_memory()
+
+    def clear_cache(self) -> None:
+        import mlx.core as mx
+
+        mx.clear_cache()
+
+
+class CPUEmbeddingBackend(EmbeddingBackend):
+    """sentence-transformersのモデルをCPUで実行（MLX版の変換元と同じモデル）"""
+    name = "cpu"
+    default_model = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+    def load(self) -> None:
+        if self.model is not None:
+            return
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(self.model_path, device="cpu")
+        self.tokenizer = self.model.tokenizer
+
+    def encode_batch(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        import torch
+
+        features = {
+            "input_ids": torch.from_numpy(input_ids.astype(np.int64)),
+            "attention_mask": torch.from_numpy(attention_mask.astype(np.int64)),
+        }
+        with torch.inference_mode():
+            embeddings = self.model(features)["sentence_embedding"].numpy()
+        # MLX版（text_embeds）と同じくL2正規化
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.where(norms == 0, 1, norms)
+
+
+EMBEDDING_BACKENDS = {
+    backend.name: backend
+    for backend in (MLXEmbeddingBackend, CPUEmbeddingBackend)
+}
+DEFAULT_EMBEDDING_BACKEND = MLXEmbeddingBackend.name
+
+
+def create_embedding_backend(name: str, model_path: str | None = None) -> EmbeddingBackend:
+    """名前からバックエンドを作る（モデルのロードはload()で行う）"""
+    if name not in EMBEDDING_BACKENDS:
+        raise ValueError(f"未知のembeddingバックエンド: {name}（{', '.join(EMBEDDING_BACKENDS)}）")
+    return EMBEDDING_BACKENDS[name](model_path)
+
+
+def plan_batches(lengths: list[int], token_budget: int) -> list[np.ndarray]:
+    """
+    トークン長でソートした文をバッチに分ける
+    各バッチは 文数 × 最長トークン数 <= token_budget（1文で超える場合は単独）
+    戻り値: 元の文インデックスの配列のリスト
+    """
+    order = np.argsort(lengths, kind="stable")
+    batches = []
+    current = []
+    for idx in order:
+        # ソート済みなので、追加する文がバッチ内の最長
+        if current and (len(current) + 1) * lengths[idx] > token_budget:
+            batches.append(np.array(current))
+            current = []
+        current.append(idx)
+    if current:
+        batches.append(np.array(current))
+    return batches
+
+
+def encode_texts(
+    backend: EmbeddingBackend,
+    texts: list[str],
+    token_budget: int = DEFAULT_TOKEN_BUDGET,
+    cache_limit_mb: float = DEFAULT_CACHE_LIMIT_MB,
+) -> np.ndarray:
+    """
+    テキストをembeddingに変換（戻り値は入力と同じ順、float32）
+    バッチはtoken_budgetで動的に決め、MLXキャッシュはcache_limit_mbを超えたときだけクリア
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    tokenizer = backend.tokenizer
+    encoded = tokenizer(texts, truncation=True, max_length=MAX_LENGTH)["input_ids"]
+    lengths = [len(ids) for ids in encoded]
+    pad_id = tokenizer.pad_token_id or 0
+    cache_limit = cache_limit_mb * 1024 ** 2
+
+    batches = plan_batches(lengths, token_budget)
+    embeddings = None
+    clears = 0
+    started = time.time()
+
+    for batch in batches:
+        width = max(lengths[i] for i in batch)
+        input_ids = np.full((len(batch), width), pad_id, dtype=np.int32)
+        attention_mask = np.zeros((len(batch), width), dtype=np.int32)
+        for row, i in enumerate(batch):
+            input_ids[row, :lengths[i]] = encoded[i]
+            attention_mask[row, :lengths[i]] = 1
+
+        batch_embeddings = backend.encode_batch(input_ids, attention_mask)
+        if embeddings is None:
+            embeddings = np.empty((len(texts), batch_embeddings.shape[1]), dtype=np.float32)
+        # 元の順に戻す
+        embeddings[batch] = batch_embeddings
+        del batch_embeddings
+
+        if backend.cache_memory() > cache_limit:
+            backend.clear_cache()
+            gc.collect()
+            clears += 1
+
+    elapsed = time.time() - started
+    rate = len(texts) / elapsed if elapsed > 0 else float("inf")
+    print(f"  {len(texts)}文 / {len(batches)}バッチ / {elapsed:.1f}s（{rate:.0f}文/秒, キャッシュクリア{clears}回）")
+    return embeddings
+
+
+def embed_sentences(
+    backend: EmbeddingBackend,
+    texts: list[str],
+    token_budget: int = DEFAULT_TOKEN_BUDGET,
+    cache_limit_mb: float = DEFAULT_CACHE_LIMIT_MB,
+    cache=None,
+    unload: bool = True,
+) -> np.ndarray:
+    """
+    文のembeddingをint8行列で返す（行ごとのスケールはコサイン類似度に不要なので返さない）
+    cache（EmbeddingCache）にある文は再利用し、残りの文（重複は1回だけ）をモデルで計算して登録
+    新しく計算した文も同じ量子化を通すので、キャッシュの有無で結果は変わらない
+    全文ヒットした場合はモデルをロードしない
+    unload=False: 計算後もモデルを保持する（繰り返し呼ぶsegment_online.py用）
+    """
+    if cache is not None:
+        embeddings, missing = cache.lookup(texts)
+        print(f"  キャッシュ: {len(texts) - len(missing)}/{len(texts)}文ヒット")
+    else:
+        embeddings, missing = None, list(range(len(texts)))
+
+    if missing:
+        unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+        if backend.model is None:
+            print(f"  モデル読み込み: {backend.model_path} ({backend.name})")
+        backend.load()
+        computed, scales = quantize_rows(encode_texts(
+            backend, unique_texts,
+            token_budget=token_budget,
+            cache_limit_mb=cache_limit_mb
+        ))
+        # モデル解放
+        if unload:
+            backend.unload()
+
+        if embeddings is None:
+            embeddings = np.empty((len(texts), computed.shape[1]), dtype=np.int8)
+        row_of = {text: row for row, text in enumerate(unique_texts)}
+        embeddings[missing] = computed[[row_of[texts[i]] for i in missing]]
+        if cache is not None:
+            cache.put(unique_texts, computed, scales)
+    elif cache is not None:
+        cache.save()
+
+    return embeddings
@@ -0,0 +1,205 @@
+"""
+文embeddingキャッシュ
+（モデルパス, 正規化した文テキストのハッシュ）をキーに、embeddingをディスクに保存して再利用する
+閾値を変えての再実行や、同じ番組で繰り返し出てくる言い回しではモデルを動かさずに済む
+
+{cache_dir}/{モデルパスのハッシュ}/
+  index.json        キー → (行番号, 最終利用時刻)、次元数、現在のベクトルファイル名
+  vectors-{n}.q8    1行 = float32のスケール + int8×次元数（memory-mapで読み込み、追記で増やす）
+容量上限を超えたら最終利用が古い行から上限の EVICT_TO まで捨てて、新しいベクトルファイルに詰め直す
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_EMBEDDING_CACHE_DIR = Path(
+    os.environ.get("KIRINUKI_CACHE_DIR", Path.home() / ".cache" / "kirinuki")
+) / "embeddings"
+DEFAULT_MAX_MB = 512.0
+# 詰め直すときは上限のこの割合まで減らす（上限ちょうどだと次の追記のたびに詰め直しになる）
+EVICT_TO = 0.8
+# ベクトルファイルの形式（変わったら既存のキャッシュは作り直す）
+STORE_FORMAT = "int8-row-scale"
+
+
+def normalize_text(text: str) -> str:
+    """キー用の正規化（前後の空白除去・連続空白を1つに）"""
+    return " ".join(text.split())
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def row_dtype(dim: int) -> np.dtype:
+    """ベクトルファイルの1行"""
+    return np.dtype([("scale", "<f4"), ("q", "i1", (dim,))])
+
+
+class EmbeddingCache:
+    """モデル1つ分のembeddingストア（容量上限もモデルごと）"""
+
+    def __init__(self, model_path: str, cache_dir: Path = DEFAULT_EMBEDDING_CACHE_DIR,
+                 max_mb: float = DEFAULT_MAX_MB):
+        model_path = str(Path(model_path).resolve()) if Path(model_path).exists() else str(model_path)
+        self.model_path = model_path
+        self.dir = Path(cache_dir) / hashlib.sha1(model_path.encode("utf-8")).hexdigest()[:16]
+        self.max_bytes = int(max_mb * 1024 ** 2)
+        self.index = self._read_index()
+
+    def _read_index(self) -> dict:
+        try:
+            with open(self.dir / "index.json", encoding="utf-8") as f:
+                index = json.load(f)
+            if index.get("format") == STORE_FORMAT:
+                return index
+            # 旧形式（float32）は読まずに次の世代から作り直す
+            generation = index.get("generation", 0) + 1
+        except (FileNotFoundError, json.JSONDecodeError):
+            generation = 0
+        return {"model": self.model_path, "format": STORE_FORMAT, "dim": None, "vectors": None,
+                "generation": generation, "entries": {}}
+
+    def _write_index(self) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self.dir / "index.json")
+
+    @contextmanager
+    def _lock(self):
+        """複数プロセスからの同時追記を防ぐ"""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with open(self.dir / "lock", "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _vectors(self) -> np.ndarray | None:
+        if not self.index["vectors"]:
+            return None
+        path = self.dir / self.index["vectors"]
+        dtype = row_dtype(self.index["dim"])
+        rows = path.stat().st_size // dtype.itemsize
+        if rows == 0:
+            return None
+        return np.memmap(path, dtype=dtype, mode="r", shape=(rows,))
+
+    def __len__(self) -> int:
+        return len(self.index["entries"])
+
+    def lookup(self, texts: list[str]) -> tuple[np.ndarray | None, list[int]]:
+        """
+        戻り値: (ヒットした行を埋めた (len(texts), dim) のint8行列, ヒットしなかったインデックス)
+        ストアが空（または読めない）なら行列はNone。スケールはコサイン類似度に不要なので返さない
+        """
+        try:
+            vectors = self._vectors()
+        except FileNotFoundError:
+            # 他のプロセスが詰め直して古いベクトルファイルが消えた。ディスクのインデックスを読み直す
+            self.index = self._read_index()
+            try:
+                vectors = self._vectors()
+            except FileNotFoundError:
+                vectors = None
+        entries = self.index["entries"]
+        if vectors is None:
+            return None, list(range(len(texts)))
+
+        now = time.time()
+        quantized = np.zeros((len(texts), self.index["dim"]), dtype=np.int8)
+        missing = []
+        for i, text in enumerate(texts):
+            entry = entries.get(text_key(text))
+            if entry is None or entry[0] >= len(vectors):
+                missing.append(i)
+                continue
+            quantized[i] = vectors[entry[0]]["q"]
+            entry[1] = now
+        return quantized, missing
+
+    def _merge_stored(self) -> None:
+        """
+        ディスク上のインデックス（他プロセスの追記を含む）を基準にし、こちらの最終利用時刻を反映
+        他プロセスが詰め直していた場合は行番号が変わっているので利用時刻は捨てる
+        """
+        stored = self._read_index()
+        if stored["vectors"] == self.index["vectors"]:
+            for key, entry in self.index["entries"].items():
+                current = stored["entries"].get(key)
+                if current is not None and current[0] == entry[0]:
+                    current[1] = max(current[1], entry[1])
+        self.index = stored
+
+    def put(self, texts: list[str], quantized: np.ndarray, scales: np.ndarray) -> None:
+        """
+        量子化済みembedding（embedding.quantize_rows の戻り値）を追記し、インデックスを保存
+        容量上限を超えたら詰め直す
+        """
+        with self._lock():
+            self._merge_stored()
+            if self.index["dim"] is None:
+                # 旧形式のファイルは不要
+                for old in self.dir.glob("vectors-*.f32"):
+                    old.unlink()
+                self.index["dim"] = quantized.shape[1]
+                self.index["vectors"] = f"vectors-{self.index['generation']}.q8"
+            if quantized.shape[1] != self.index["dim"]:
+                raise ValueError(f"embeddingの次元がキャッシュと異なります: {quantized.shape[1]} != {self.index['dim']}")
+
+            rows = np.empty(len(quantized), dtype=row_dtype(self.index["dim"]))
+            rows["scale"] = scales
+            rows["q"] = quantized
+            path = self.dir / self.index["vectors"]
+            row = path.stat().st_size // rows.dtype.itemsize if path.exists() else 0
+            with open(path, "ab") as f:
+                f.write(rows.tobytes())
+
+            now = time.time()
+            for i, text in enumerate(texts):
+                self.index["entries"][text_key(text)] = [row + i, now]
+            self._write_index()
+            self._evict()
+
+    def save(self) -> None:
+        """最終利用時刻を保存"""
+        if not self.index["vectors"]:
+            return
+        with self._lock():
+            self._merge_stored()
+            self._write_index()
+
+    def _evict(self) -> int:
+        """容量上限を超えていたら最終利用が新しい行だけを上限の EVICT_TO まで新しいファイルに詰め直す。捨てた件数を返す"""
+        path = self.dir / self.index["vectors"]
+        row_bytes = row_dtype(self.index["dim"]).itemsize
+        if path.stat().st_size <= self.max_bytes:
+            return 0
+
+        vectors = self._vectors()
+        entries = sorted(self.index["entries"].items(), key=lambda kv: kv[1][1], reverse=True)
+        entries = [(k, e) for k, e in entries if e[0] < len(vectors)]
+        keep = entries[:int(self.max_bytes * EVICT_TO) // row_bytes]
+
+        generation = self.index["generation"] + 1
+        new_name = f"vectors-{generation}.q8"
+        with open(self.dir / new_name, "wb") as f:
+            vectors[[row for _, (row, _) in keep]].tofile(f)
+        del vectors
+
+        self.index["entries"] = {key: [i, used] for i, (key, (_, used)) in enumerate(keep)}
+        self.index["vectors"] = new_name
+        self.index["generation"] = generation
+        self._write_index()
+        path.unlink(missing_ok=True)
+        return len(entries) - len(keep)
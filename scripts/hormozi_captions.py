@@ -10,7 +10,6 @@ Hormozi Captions スタイルの字幕を動画に焼き込む
 """
 
 import argparse
-import json
 import math
 from pathlib import Path
 
@@ -19,25 +18,24 @@ from PIL import Image, ImageDraw, ImageFont
 import numpy as np
 import MeCab
 
+from asr_store import load_asr
+
 
 def get_char_tokens(asr_path: str) -> list[dict]:
     """ASRデータから文字単位のトークンを取得"""
-    with open(asr_path) as f:
-        data = json.load(f)
+    transcript = load_asr(asr_path)
+    texts, starts, ends = transcript.tokens()
 
     tokens = []
-    for sent in data['sentences']:
-        if 'tokens' not in sent:
+    for text, start, end in zip(texts, starts.tolist(), ends.tolist()):
+        text = text.strip()
+        if not text:
             continue
-        for tok in sent['tokens']:
-            text = tok['text'].strip()
-            if not text:
-                continue
-            tokens.append({
-                'text': text,
-                'start': tok['start'],
-                'end': tok['end'],
-            })
+        tokens.append({
+            'text': text,
+            'start': start,
+            'end': end,
+        })
     return tokens
 
 
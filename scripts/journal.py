@@ -0,0 +1,77 @@
+"""
+追記専用JSONLジャーナル
+長時間処理の途中結果を1件1行で追記し、異常終了後の再開（--resume）に使う
+書き込み途中で落ちた最終行は読み込み時に無視する
+"""
+
+import json
+import os
+from pathlib import Path
+
+
+class Journal:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def read(self) -> list[dict]:
+        """記録済みのレコードを順に返す（壊れた行は無視）"""
+        if not self.path.exists():
+            return []
+        records = []
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return records
+
+    def read_from(self, offset: int = 0) -> tuple[list[dict], int]:
+        """
+        offsetバイト目以降の完結した行を読み、(レコード, 次のoffset) を返す（追記中のジャーナルの追従用）
+        書きかけの最終行は次回に回す
+        """
+        if not self.path.exists():
+            return [], offset
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        records = []
+        for line in data[:end].splitlines():
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        return records, offset + end
+
+    def append(self, record: dict) -> None:
+        """1レコード追記し、ディスクまで書き出す"""
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def reset(self, header: dict | None = None) -> None:
+        """ジャーナルを空にし、必要ならヘッダレコードを書く"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            if header is not None:
+                f.write(json.dumps(header, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def open(self, header: dict, resume: bool) -> list[dict]:
+        """
+        ジャーナルを開始する
+        resume=Trueかつ既存ジャーナルのヘッダが一致すれば、記録済みレコード（ヘッダ以外）を返す
+        それ以外は新しく作り直して空リストを返す
+        """
+        if resume:
+            records = self.read()
+            if records and records[0] == header:
+                return records[1:]
+            if records:
+                print(f"  ジャーナルの設定が異なるため最初から処理: {self.path}")
+        self.reset(header)
+        return []
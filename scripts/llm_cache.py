@@ -0,0 +1,111 @@
+"""
+LLM応答キャッシュ（segment-with-claude.py / score.py / score-with-claude.py）
+（プロンプトの種類・版, モデル, 書き起こしテキストのハッシュ, 時刻範囲）をキーに、パース済みの応答をSQLiteに保存する
+--min-score を変えての再実行や、中断後のやり直しでは判定済みのセグメントにclaude -pを呼ばない
+失敗（タイムアウト・パースエラーなど）は保存しない
+古いもの（最終利用から ttl_days 日）と、容量上限を超えた分（最終利用が古いものから）は削除
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+DEFAULT_LLM_CACHE_DIR = Path(
+    os.environ.get("KIRINUKI_CACHE_DIR", Path.home() / ".cache" / "kirinuki")
+) / "llm"
+DEFAULT_LLM_CACHE_MAX_MB = 64.0
+DEFAULT_LLM_CACHE_TTL_DAYS = 30.0
+
+
+def cache_key(kind: str, version: int, model: str, text: str, start: float, end: float) -> str:
+    """
+    kind: プロンプトの種類（"score" / "split" など）
+    version: プロンプトの版（プロンプトを変えたら呼び出し側で上げる）
+    """
+    parts = {
+        "kind": kind,
+        "version": version,
+        "model": model,
+        "text": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+        "start": round(float(start), 3),
+        "end": round(float(end), 3),
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    {cache_dir}/responses.sqlite3 の responses テーブル（key → JSON, 作成・最終利用時刻, バイト数）
+    スレッド間で1接続を共有（LLMExecutorのワーカーから呼ばれる）。hits / misses は統計用
+    """
+
+    def __init__(self, cache_dir: Path = DEFAULT_LLM_CACHE_DIR, max_mb: float = DEFAULT_LLM_CACHE_MAX_MB,
+                 ttl_days: float = DEFAULT_LLM_CACHE_TTL_DAYS):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_mb * 1024 ** 2)
+        self.ttl = ttl_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            self.cache_dir / "responses.sqlite3", timeout=30, check_same_thread=False
+        )
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created REAL NOT NULL, used REAL NOT NULL, size INTEGER NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses(used)")
+        self.evict()
+
+    def get(self, key: str):
+        """ヒットしたらパース済みの応答を返し、最終利用時刻を更新。なければNone"""
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT value, used FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value) -> None:
+        value = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, used, size) VALUES (?, ?, ?, ?, ?)",
+                (key, value, now, now, len(value.encode("utf-8")))
+            )
+
+    def evict(self) -> int:
+        """期限切れと、容量上限を超えた分を最終利用が古いものから削除。削除件数を返す"""
+        with self.lock, self.conn:
+            removed = self.conn.execute(
+                "DELETE FROM responses WHERE used < ?", (time.time() - self.ttl,)
+            ).rowcount
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                stale = []
+                for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY used"):
+                    if total <= self.max_bytes:
+                        break
+                    stale.append((key,))
+                    total -= size
+                self.conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+                removed += len(stale)
+        return removed
+
+    def close(self) -> None:
+        self.evict()
+        self.conn.close()
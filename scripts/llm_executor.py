@@ -0,0 +1,224 @@
+"""
+claude -p 呼び出しの共通実行部（score.py / score-with-claude.py / segment-with-claude.py）
+最大 concurrency 件を同時に実行し、開始間隔は1分あたり rpm 件のトークンバケットで抑える
+各呼び出しは独立したプロセスグループで起動し、タイムアウト・中断時はグループごとkillする
+"""
+
+import gc
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_RPM = 30
+DEFAULT_TIMEOUT = 90
+
+# 実行中のclaudeプロセス（中断時にまとめてkillする）。kill_running後は新しく起動しない
+_running = set()
+_running_lock = threading.Lock()
+_stopped = False
+# このプロセスで起動したclaudeの数（統計用）
+_launched = 0
+# LLMExecutorのワーカーが使うトークンバケット（run_claudeの起動直前に取る。キャッシュヒットは消費しない）
+_local = threading.local()
+
+
+class ClaudeError(Exception):
+    """claude -p が失敗した（reason: "timeout" / "error"）"""
+
+    def __init__(self, reason: str, message: str = ""):
+        super().__init__(message or reason)
+        self.reason = reason
+
+
+def _kill(proc: subprocess.Popen) -> None:
+    """プロセスグループごとkill（子プロセスも残さない）"""
+    try:
+        if proc.poll() is None:
+            os.killpg(os.getpgid(proc.pid), signal.SIGKILL)
+        proc.wait()
+    except Exception:
+        pass
+
+
+def run_claude(prompt: str, model: str, timeout: float = DEFAULT_TIMEOUT) -> str:
+    """
+    claude -p を実行して標準出力を返す
+    タイムアウトは ClaudeError("timeout")、終了コード0以外は ClaudeError("error")
+    LLMExecutorの中から呼ばれたときは、起動前にそのレート制限を待つ
+    """
+    cmd = [
+        'claude', '-p', prompt,
+        '--allowedTools', '[]',
+        '--model', model,
+        '--output-format', 'text'
+    ]
+
+    bucket = getattr(_local, "bucket", None)
+    if bucket is not None:
+        bucket.acquire()
+
+    global _launched
+    with _running_lock:
+        if _stopped:
+            raise ClaudeError("error", "中断済み")
+        _launched += 1
+        # 新しいプロセスグループで起動（子プロセスも一括kill可能に）
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            start_new_session=True
+        )
+        _running.add(proc)
+    try:
+        try:
+            stdout, stderr = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            raise ClaudeError("timeout")
+        if proc.returncode != 0:
+            raise ClaudeError("error", stderr.strip()[:200])
+        return stdout
+    finally:
+        # 確実にプロセスを終了
+        _kill(proc)
+        with _running_lock:
+            _running.discard(proc)
+        gc.collect()
+
+
+def claude_calls() -> int:
+    """このプロセスで起動したclaudeの数"""
+    with _running_lock:
+        return _launched
+
+
+def kill_running() -> None:
+    """実行中のclaudeプロセスをすべてkillし、以降の起動も止める"""
+    global _stopped
+    with _running_lock:
+        _stopped = True
+        procs = list(_running)
+    for proc in procs:
+        _kill(proc)
+
+
+class TokenBucket:
+    """
+    1分あたり rpm 件のトークンバケット（スレッドセーフ）
+    容量 burst 件まではまとめて開始でき、それ以降は 60 / rpm 秒ごとに1件
+    """
+
+    def __init__(self, rpm: float, burst: int = 1):
+        self.rate = rpm / 60.0
+        self.capacity = float(burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class LLMExecutor:
+    """
+    LLM呼び出しを並行実行する
+    map(fn, items): fn(item) を最大 concurrency 件同時に実行し、結果を items と同じ順で返す
+    rpm は fn の中の run_claude の起動数に掛かる（rpm <= 0 ならレート制限なし）
+    """
+
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY, rpm: float = DEFAULT_RPM):
+        self.concurrency = max(1, concurrency)
+        self.bucket = TokenBucket(rpm, burst=self.concurrency) if rpm > 0 else None
+
+    def _call(self, fn, item):
+        _local.bucket = self.bucket
+        try:
+            return fn(item)
+        finally:
+            _local.bucket = None
+
+    def map(self, fn, items: list, on_done=None) -> list:
+        """
+        on_done(インデックス, 結果): 完了した順に呼ばれる（進捗表示用、呼び出し元のスレッドで実行）
+        Ctrl-Cなどで中断したら、実行中のclaudeプロセスをkillしてから例外を伝える
+        """
+        results = [None] * len(items)
+        pool = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            futures = {pool.submit(self._call, fn, item): i for i, item in enumerate(items)}
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i] = future.result()
+                if on_done is not None:
+                    on_done(i, results[i])
+        except BaseException:
+            pool.shutdown(wait=False, cancel_futures=True)
+            kill_running()
+            raise
+        pool.shutdown()
+        return results
+
+
+def pack_batches(sizes: list[int], budget: int) -> list[list[int]]:
+    """
+    先頭から順に、サイズ（文字数など）の合計が budget 以内になるようインデックスをまとめる
+    1件で budget を超える場合はその1件だけのバッチにする
+    """
+    batches = []
+    current, total = [], 0
+    for i, size in enumerate(sizes):
+        if current and total + size > budget:
+            batches.append(current)
+            current, total = [], 0
+        current.append(i)
+        total += size
+    if current:
+        batches.append(current)
+    return batches
+
+
+def bisect_batch(call_batch, call_one, items: list) -> list:
+    """
+    items を call_batch でまとめて処理し、返ってこなかった分だけやり直す
+    call_batch(items) -> {items内の位置: 結果}（応答が壊れていれば空dictか例外）
+    一部だけ返ってきたら残りをまとめてやり直し、1件も返ってこなければ半分に分けてやり直す
+    1件になったら call_one(item)（単独のプロンプト）で処理する
+    戻り値: items と同じ順の結果
+    """
+    if len(items) == 1:
+        return [call_one(items[0])]
+    try:
+        answered = call_batch(items)
+    except Exception as e:
+        print(f"  [WARN] バッチ失敗（{len(items)}件）: {e}", file=sys.stderr)
+        answered = {}
+
+    results = [answered.get(k) for k in range(len(items))]
+    missing = [k for k, result in enumerate(results) if result is None]
+    if not missing:
+        return results
+    rest = [items[k] for k in missing]
+    if len(missing) < len(items):
+        retried = bisect_batch(call_batch, call_one, rest)
+    else:
+        mid = len(rest) // 2
+        retried = (bisect_batch(call_batch, call_one, rest[:mid])
+                   + bisect_batch(call_batch, call_one, rest[mid:]))
+    for k, result in zip(missing, retried):
+        results[k] = result
+    return results
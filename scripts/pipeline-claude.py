@@ -5,16 +5,19 @@
 
 Usage:
     uv run python scripts/pipeline-claude.py video.mp4
-    uv run python scripts/pipeline-claude.py video.mp4 --skip-asr  # ASRスキップ
+    # ASR結果はキャッシュされ、同じ音声・設定なら自動で再利用
 """
 
 import argparse
 import json
+import os
 import subprocess
 import sys
 from datetime import datetime
 from pathlib import Path
 
+from llm_executor import DEFAULT_CONCURRENCY, DEFAULT_RPM
+
 
 def run_command(cmd: list[str], description: str, timeout: int = 600) -> bool:
     """コマンドを実行して結果を表示"""
@@ -85,8 +88,8 @@ Examples:
     # フル実行
     uv run python scripts/pipeline-claude.py video.mp4
 
-    # ASRスキップ（既存のASR結果を使用）
-    uv run python scripts/pipeline-claude.py video.mp4 --skip-asr
+    # ASRは常駐ワーカーで処理（asr_worker.pyを起動しておく）
+    uv run python scripts/pipeline-claude.py video.mp4 --asr-worker
 
     # 閾値とスコア調整
     uv run python scripts/pipeline-claude.py video.mp4 --threshold 0.4 --min-score 6
@@ -94,7 +97,12 @@ Examples:
     )
     parser.add_argument('video', help='入力動画ファイル')
     parser.add_argument('-o', '--output', default='output', help='出力ディレクトリ')
-    parser.add_argument('--skip-asr', action='store_true', help='ASR処理をスキップ')
+    parser.add_argument('--no-asr-cache', action='store_true',
+                        help='ASR結果キャッシュを使わず必ず再計算')
+    parser.add_argument('--no-llm-cache', action='store_true',
+                        help='LLM応答キャッシュを使わず必ずclaude -pを呼ぶ')
+    parser.add_argument('--asr-worker', action='store_true',
+                        help='常駐ASRワーカー（asr_worker.py）が起動していればそちらでASR処理')
     parser.add_argument('--threshold', type=float, default=0.3,
                         help='大セグメント検出の類似度閾値 (default: 0.3)')
     parser.add_argument('--min-score', type=int, default=5,
@@ -103,8 +111,18 @@ Examples:
                         help='セグメント分割のClaudeモデル (default: sonnet)')
     parser.add_argument('--score-model', default='claude-opus-4-5-20251101',
                         help='スコアリングのClaudeモデル (default: claude-opus-4-5-20251101)')
-    parser.add_argument('--delay', type=float, default=2.0,
-                        help='API呼び出し間の遅延秒 (default: 2.0)')
+    parser.add_argument('--screen-model',
+                        help='指定すると、このモデル（haikuなど）で先に全件をスコアリングし、残ったものだけ--score-modelで評価')
+    parser.add_argument('--screen-min-score', type=int, default=5,
+                        help='--screen-modelでこの点以上なら--score-modelで評価 (default: 5)')
+    parser.add_argument('--screen-top-k', type=int, default=0,
+                        help='--screen-modelの上位K件は点数によらず--score-modelで評価。0で使わない (default: 0)')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'claude -p の同時実行数 (default: {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--rpm', type=float, default=DEFAULT_RPM,
+                        help=f'claude -p の1分あたりの開始数上限。0で無制限 (default: {DEFAULT_RPM})')
+    parser.add_argument('--batch-chars', type=int, default=0,
+                        help='スコアリングで複数セグメントを1回のclaude -pにまとめる書き起こし文字数の上限。0で1セグメントずつ (default: 0)')
     args = parser.parse_args()
 
     video_path = Path(args.video)
@@ -125,24 +143,28 @@ Examples:
 入力: {video_path}
 出力: {output_dir}/
 セグメント分割モデル: {args.segment_model}
-スコアリングモデル: {args.score_model}
+スコアリングモデル: {args.score_model}{f" （スクリーニング: {args.screen_model}）" if args.screen_model else ""}
 """)
 
-    # Step 1: ASR処理
-    if args.skip_asr:
-        print(f"[SKIP] ASR処理をスキップ（既存ファイル使用: {asr_json}）")
-        if not asr_json.exists():
-            print(f"  [ERROR] ASR結果が見つかりません: {asr_json}")
-            sys.exit(1)
+    # Step 1: ASR処理（同じ音声・設定の結果がキャッシュにあれば再利用、
+    #         タイムアウト等で中断していれば完了済みチャンクから再開）
+    cmd = [
+        'uv', 'run', 'python', 'scripts/transcribe.py',
+        str(video_path),
+        '-o', str(output_dir),
+        '-c', '180',
+        # 長尺動画の音声抽出はコア数分のffmpegで並列に
+        '--extract-jobs', str(os.cpu_count() or 1)
+    ]
+    if args.asr_worker:
+        cmd.append('--use-worker')
+    if args.no_asr_cache:
+        cmd.append('--no-cache')
     else:
-        cmd = [
-            'uv', 'run', 'python', 'scripts/transcribe.py',
-            str(video_path),
-            '-o', str(output_dir),
-            '-c', '180'
-        ]
-        if not run_command(cmd, "ASR処理（音声認識）", timeout=1800):
-            sys.exit(1)
+        # 中断していれば完了済みチャンクから再開（--no-asr-cacheのときはジャーナルも使わず全体を再計算）
+        cmd.append('--resume')
+    if not run_command(cmd, "ASR処理（音声認識）", timeout=1800):
+        sys.exit(1)
 
     # Step 2: 話題区切り検出（Claude版）
     cmd = [
@@ -151,8 +173,14 @@ Examples:
         '-o', str(output_dir),
         '-t', str(args.threshold),
         '--claude-model', args.segment_model,
-        '--delay', str(args.delay)
+        '--concurrency', str(args.concurrency),
+        '--rpm', str(args.rpm)
     ]
+    if args.no_llm_cache:
+        cmd.append('--no-llm-cache')
+    else:
+        # 中断していればジャーナルの記録済み分から再開
+        cmd.append('--resume')
     if not run_command(cmd, "話題区切り検出（Claude版）", timeout=1800):
         sys.exit(1)
 
@@ -163,8 +191,22 @@ Examples:
         '-a', str(asr_json),
         '-o', str(output_dir),
         '-m', args.score_model,
-        '--delay', str(args.delay)
+        '--concurrency', str(args.concurrency),
+        '--rpm', str(args.rpm)
     ]
+    if args.no_llm_cache:
+        cmd.append('--no-llm-cache')
+    else:
+        # 中断していればジャーナルの記録済み分から再開
+        cmd.append('--resume')
+    if args.batch_chars > 0:
+        cmd.extend(['--batch-chars', str(args.batch_chars)])
+    if args.screen_model:
+        cmd.extend([
+            '--screen-model', args.screen_model,
+            '--screen-min-score', str(args.screen_min_score),
+            '--screen-top-k', str(args.screen_top_k)
+        ])
     if not run_command(cmd, "ショート適性スコアリング（Claude版）", timeout=1800):
         sys.exit(1)
 
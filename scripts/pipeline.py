@@ -5,16 +5,19 @@
 
 Usage:
     uv run python scripts/pipeline.py video.mp4
-    uv run python scripts/pipeline.py video.mp4 --skip-asr  # ASRスキップ
+    # ASR結果はキャッシュされ、同じ音声・設定なら自動で再利用
 """
 
 import argparse
 import json
+import os
 import subprocess
 import sys
 from datetime import datetime
 from pathlib import Path
 
+from llm_executor import DEFAULT_CONCURRENCY, DEFAULT_RPM
+
 
 def run_command(cmd: list[str], description: str, timeout: int = 600) -> bool:
     """コマンドを実行して結果を表示"""
@@ -85,8 +88,8 @@ Examples:
     # フル実行
     uv run python scripts/pipeline.py video.mp4
 
-    # ASRスキップ（既存のASR結果を使用）
-    uv run python scripts/pipeline.py video.mp4 --skip-asr
+    # ASRは常駐ワーカーで処理（asr_worker.pyを起動しておく）
+    uv run python scripts/pipeline.py video.mp4 --asr-worker
 
     # 閾値とスコア調整
     uv run python scripts/pipeline.py video.mp4 --threshold 0.4 --min-score 6
@@ -94,15 +97,24 @@ Examples:
     )
     parser.add_argument('video', help='入力動画ファイル')
     parser.add_argument('-o', '--output', default='output', help='出力ディレクトリ')
-    parser.add_argument('--skip-asr', action='store_true', help='ASR処理をスキップ')
+    parser.add_argument('--no-asr-cache', action='store_true',
+                        help='ASR結果キャッシュを使わず必ず再計算')
+    parser.add_argument('--no-llm-cache', action='store_true',
+                        help='LLM応答キャッシュを使わず必ずclaude -pを呼ぶ')
+    parser.add_argument('--asr-worker', action='store_true',
+                        help='常駐ASRワーカー（asr_worker.py）が起動していればそちらでASR処理')
     parser.add_argument('--threshold', type=float, default=0.3,
                         help='話題区切りの類似度閾値 (default: 0.3)')
     parser.add_argument('--min-score', type=int, default=5,
                         help='最終出力の最小スコア (default: 5)')
     parser.add_argument('--model', default='sonnet',
                         help='スコアリングのClaudeモデル (default: sonnet)')
-    parser.add_argument('--delay', type=float, default=2.0,
-                        help='API呼び出し間の遅延秒 (default: 2.0)')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'claude -p の同時実行数 (default: {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--rpm', type=float, default=DEFAULT_RPM,
+                        help=f'claude -p の1分あたりの開始数上限。0で無制限 (default: {DEFAULT_RPM})')
+    parser.add_argument('--batch-chars', type=int, default=0,
+                        help='スコアリングで複数セグメントを1回のclaude -pにまとめる書き起こし文字数の上限。0で1セグメントずつ (default: 0)')
     args = parser.parse_args()
 
     video_path = Path(args.video)
@@ -124,21 +136,25 @@ Examples:
 出力: {output_dir}/
 """)
 
-    # Step 1: ASR処理
-    if args.skip_asr:
-        print(f"[SKIP] ASR処理をスキップ（既存ファイル使用: {asr_json}）")
-        if not asr_json.exists():
-            print(f"  [ERROR] ASR結果が見つかりません: {asr_json}")
-            sys.exit(1)
+    # Step 1: ASR処理（同じ音声・設定の結果がキャッシュにあれば再利用、
+    #         タイムアウト等で中断していれば完了済みチャンクから再開）
+    cmd = [
+        'uv', 'run', 'python', 'scripts/transcribe.py',
+        str(video_path),
+        '-o', str(output_dir),
+        '-c', '180',
+        # 長尺動画の音声抽出はコア数分のffmpegで並列に
+        '--extract-jobs', str(os.cpu_count() or 1)
+    ]
+    if args.asr_worker:
+        cmd.append('--use-worker')
+    if args.no_asr_cache:
+        cmd.append('--no-cache')
     else:
-        cmd = [
-            'uv', 'run', 'python', 'scripts/transcribe.py',
-            str(video_path),
-            '-o', str(output_dir),
-            '-c', '180'
-        ]
-        if not run_command(cmd, "ASR処理（音声認識）", timeout=1800):
-            sys.exit(1)
+        # 中断していれば完了済みチャンクから再開（--no-asr-cacheのときはジャーナルも使わず全体を再計算）
+        cmd.append('--resume')
+    if not run_command(cmd, "ASR処理（音声認識）", timeout=1800):
+        sys.exit(1)
 
     # Step 2: 話題区切り検出
     cmd = [
@@ -157,8 +173,13 @@ Examples:
         '-s', str(segments_json),
         '-o', str(output_dir),
         '-m', args.model,
-        '--delay', str(args.delay)
+        '--concurrency', str(args.concurrency),
+        '--rpm', str(args.rpm)
     ]
+    if args.no_llm_cache:
+        cmd.append('--no-llm-cache')
+    if args.batch_chars > 0:
+        cmd.extend(['--batch-chars', str(args.batch_chars)])
     if not run_command(cmd, "ショート適性スコアリング", timeout=600):
         sys.exit(1)
 
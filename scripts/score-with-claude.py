@@ -5,15 +5,28 @@ segment-with-claude.pyの出力を評価
 """
 
 import argparse
-import gc
 import json
-import os
-import signal
-import subprocess
 import sys
-import time
 from pathlib import Path
 
+from asr_store import ASRTranscript, load_asr
+from embedding import DEFAULT_EMBEDDING_BACKEND, EMBEDDING_BACKENDS, create_embedding_backend
+from embedding_cache import DEFAULT_EMBEDDING_CACHE_DIR, DEFAULT_MAX_MB, EmbeddingCache
+from journal import Journal
+from llm_cache import DEFAULT_LLM_CACHE_DIR, DEFAULT_LLM_CACHE_MAX_MB, DEFAULT_LLM_CACHE_TTL_DAYS, LLMCache, cache_key
+from llm_executor import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_RPM,
+    DEFAULT_TIMEOUT,
+    ClaudeError,
+    LLMExecutor,
+    bisect_batch,
+    claude_calls,
+    pack_batches,
+    run_claude,
+)
+from segment_dedup import DEFAULT_COSINE, DEFAULT_JACCARD, copy_duplicate_result, find_duplicate_segments
+
 
 def format_time(seconds: float) -> str:
     """秒をMM:SS形式に変換"""
@@ -33,25 +46,48 @@ def parse_time(time_str: str) -> float:
         return 0
 
 
-def get_segment_text(asr_data: dict, start_sec: float, end_sec: float) -> str:
-    """ASRデータから指定区間のテキストを抽出"""
-    texts = []
-    for sent in asr_data['sentences']:
-        # セグメントが区間と重なっていれば含める
-        if sent['end'] > start_sec and sent['start'] < end_sec:
-            texts.append(sent['text'])
-    return ''.join(texts).strip()
+def get_segment_text(transcript: ASRTranscript, start_sec: float, end_sec: float) -> str:
+    """ASRデータから指定区間のテキストを抽出（区間と重なる文を連結）"""
+    return transcript.text_between(start_sec, end_sec)
+
+
+# プロンプトを変えたら上げる（LLM応答キャッシュを無効化）
+PROMPT_VERSION = 1
+# プロンプトに入れる1セグメントの書き起こしの上限（文字）
+MAX_TEXT_CHARS = 2000
+# 評価が返らなかったときの reason（score_segment のフォールバック）
+FAILURE_REASONS = ('Parse error', 'タイムアウト', 'API error', 'エラー')
+
+
+def score_cache_key(segment: dict, text: str, model: str) -> str:
+    """LLM応答キャッシュのキー（単独・バッチどちらの評価も同じキー）"""
+    topic = segment.get('topic', '')
+    return cache_key('score-claude', PROMPT_VERSION, model, f"{topic}\n{text}", segment['start'], segment['end'])
+
+
+def score_failed(score_result: dict) -> bool:
+    """評価が返らなかったか（タイムアウト・パースエラーなど。score・切り抜き区間が欠けたものも含む）"""
+    if any(field not in score_result for field in ('score', 'clip_start', 'clip_end')):
+        return True
+    return score_result.get('reason') in FAILURE_REASONS
 
 
-def score_segment(segment: dict, text: str, model: str = "sonnet") -> dict:
+def score_segment(segment: dict, text: str, model: str = "sonnet", cache: LLMCache | None = None) -> dict:
     """
     Claude Codeでセグメントをスコアリング
-    Popenで明示的にプロセス管理・kill
+    プロセス管理・killはllm_executor.run_claude
+    cacheがあれば同じテキスト・区間・話題・モデルの評価を再利用し、成功した評価を保存
     """
     seg_start = segment['start']
     seg_end = segment['end']
     topic = segment.get('topic', '')
 
+    key = score_cache_key(segment, text, model)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
     prompt = f'''以下はYouTube動画の書き起こし（{format_time(seg_start)}〜{format_time(seg_end)}）です。
 話題: {topic}
 
@@ -65,7 +101,7 @@ def score_segment(segment: dict, text: str, model: str = "sonnet") -> dict:
 
 書き起こし:
 ---
-{text[:2000]}
+{text[:MAX_TEXT_CHARS]}
 ---
 
 以下のJSON形式のみで回答（説明不要）:
@@ -79,53 +115,206 @@ def score_segment(segment: dict, text: str, model: str = "sonnet") -> dict:
 
 切り抜き価値が低い場合はscore=1-3。'''
 
-    cmd = [
-        'claude', '-p', prompt,
-        '--allowedTools', '[]',
-        '--model', model,
-        '--output-format', 'text'
-    ]
-
-    proc = None
     try:
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            start_new_session=True
-        )
-
-        try:
-            stdout, stderr = proc.communicate(timeout=90)
-        except subprocess.TimeoutExpired:
-            os.killpg(os.getpgid(proc.pid), signal.SIGKILL)
-            proc.wait()
-            return {'score': 0, 'reason': 'タイムアウト'}
-
-        if proc.returncode != 0:
-            return {'score': 0, 'reason': 'API error'}
-
-        output = stdout.strip()
+        output = run_claude(prompt, model).strip()
         start = output.find('{')
         end = output.rfind('}') + 1
         if start >= 0 and end > start:
-            return json.loads(output[start:end])
+            result = json.loads(output[start:end])
+            if cache is not None and not score_failed(result):
+                cache.put(key, result)
+            return result
         else:
             return {'score': 0, 'reason': 'Parse error'}
 
+    except ClaudeError as e:
+        return {'score': 0, 'reason': 'タイムアウト' if e.reason == 'timeout' else 'API error'}
     except Exception as e:
         print(f"  [ERROR] {e}", file=sys.stderr)
         return {'score': 0, 'reason': 'エラー'}
-    finally:
-        if proc is not None:
-            try:
-                if proc.poll() is None:
-                    os.killpg(os.getpgid(proc.pid), signal.SIGKILL)
-                proc.wait()
-            except:
-                pass
-        gc.collect()
+
+
+def score_batch(segments: list[dict], texts: list[str], model: str = "sonnet",
+                cache: LLMCache | None = None) -> dict[int, dict]:
+    """
+    複数セグメントを1回のClaude Code呼び出しでまとめてスコアリング（区間番号つきのJSON配列で回答させる）
+    戻り値: {segments内の位置: 評価}。番号が欠けた・壊れた・項目が足りない要素は含めない（llm_executor.bisect_batchでやり直す）
+    """
+    blocks = "\n\n".join(
+        f"[区間{k + 1}] {format_time(seg['start'])}〜{format_time(seg['end'])} 話題: {seg.get('topic', '')}\n"
+        f"---\n{text[:MAX_TEXT_CHARS]}\n---"
+        for k, (seg, text) in enumerate(zip(segments, texts))
+    )
+    prompt = f'''以下はYouTube動画の書き起こしを{len(segments)}個の区間に分けたものです。
+
+区間ごとに、YouTubeショート（15〜60秒）として切り抜く価値を評価してください。
+
+評価基準:
+- 話題の完結性（単独で理解できるか）
+- エンタメ性・興味深さ・意外性
+- 視聴者の関心を引く要素
+- 冒頭で興味を引けるか
+
+{blocks}
+
+以下のJSON配列のみで回答（説明不要）。全区間について1要素ずつ、idは区間番号:
+[
+  {{
+    "id": 区間番号,
+    "score": 1-10の整数,
+    "clip_start": 推奨開始時刻（MM:SS形式）,
+    "clip_end": 推奨終了時刻（MM:SS形式）,
+    "hook": "冒頭の引きとなるポイント（20字以内）",
+    "reason": "30字以内の評価理由"
+  }}
+]
+
+切り抜き価値が低い場合はscore=1-3。'''
+
+    output = run_claude(prompt, model, timeout=DEFAULT_TIMEOUT + 30 * len(segments)).strip()
+    start = output.find('[')
+    end = output.rfind(']') + 1
+    if start < 0 or end <= start:
+        return {}
+    answers = json.loads(output[start:end])
+    if not isinstance(answers, list):
+        return {}
+
+    results = {}
+    for answer in answers:
+        if not isinstance(answer, dict) or score_failed(answer):
+            continue
+        try:
+            k = int(answer.pop('id')) - 1
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 0 <= k < len(segments) and k not in results:
+            results[k] = answer
+            if cache is not None:
+                cache.put(score_cache_key(segments[k], texts[k], model), answer)
+    return results
+
+
+def score_segments(
+    segments: list[dict],
+    texts: list[str],
+    indices: list[int],
+    model: str,
+    cache: LLMCache | None = None,
+    batch_chars: int = 0,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    rpm: float = DEFAULT_RPM,
+    journal: Journal | None = None,
+    journaled: dict | None = None
+) -> tuple[dict[int, dict], int]:
+    """
+    segments[i]（i in indices）を model で評価（batch_chars > 0 なら書き起こしの文字数でまとめて評価）
+    journal: 評価が終わるたびに結果をキャッシュと同じキー（モデル・話題・テキスト・区間）で追記（失敗は追記しない）
+    journaled: 前回のジャーナルの {キー: 評価}。あれば評価し直さない（--resume）
+    戻り値: ({i: 評価}, ジャーナルから復元した件数)
+    """
+    scored = {}
+    if journaled:
+        for i in indices:
+            key = score_cache_key(segments[i], texts[i], model)
+            if key in journaled:
+                scored[i] = journaled[key]
+        if scored:
+            print(f"  再開: {len(scored)}件をジャーナルから復元")
+    restored = len(scored)
+    remaining = [i for i in indices if i not in scored]
+
+    if batch_chars > 0:
+        # キャッシュにあるものを先に埋め、残りを書き起こしの文字数でまとめる
+        pending = []
+        for i in remaining:
+            hit = cache.get(score_cache_key(segments[i], texts[i], model)) if cache is not None else None
+            if hit is None:
+                pending.append(i)
+            else:
+                scored[i] = hit
+        sizes = [len(texts[i][:MAX_TEXT_CHARS]) for i in pending]
+        units = [[pending[k] for k in batch] for batch in pack_batches(sizes, batch_chars)]
+        print(f"  バッチ: {len(pending)}件を{len(units)}回に（上限{batch_chars}文字）")
+
+        def run_unit(unit: list[int]) -> list[dict]:
+            return bisect_batch(
+                lambda batch: score_batch(
+                    [segments[i] for i in batch], [texts[i] for i in batch], model=model, cache=cache
+                ),
+                lambda i: score_segment(segments[i], texts[i], model=model, cache=cache),
+                unit
+            )
+    else:
+        units = [[i] for i in remaining]
+
+        def run_unit(unit: list[int]) -> list[dict]:
+            i = unit[0]
+            return [score_segment(segments[i], texts[i], model=model, cache=cache)]
+
+    done = len(scored)
+
+    def on_done(k: int, unit_results: list[dict]) -> None:
+        nonlocal done
+        for i, score_result in zip(units[k], unit_results):
+            done += 1
+            seg = segments[i]
+            # LLM応答キャッシュと同じく、成功した評価だけ記録（失敗は --resume で呼び直す）
+            if journal is not None and not score_failed(score_result):
+                journal.append({
+                    "type": "score",
+                    "key": score_cache_key(seg, texts[i], model),
+                    "model": model,
+                    "start": seg['start'],
+                    "end": seg['end'],
+                    "result": score_result,
+                })
+            time_str = f"{format_time(seg['start'])}-{format_time(seg['end'])}"
+            topic = seg.get('topic', '')[:10]
+            print(f"  [{done}/{len(indices)}] {time_str} ({seg['duration']:.0f}s) {topic}... score={score_result.get('score', 0)}")
+
+    unit_results = LLMExecutor(concurrency, rpm).map(run_unit, units, on_done)
+    for unit, results_of_unit in zip(units, unit_results):
+        scored.update(zip(unit, results_of_unit))
+    return scored, restored
+
+
+def select_for_confirmation(screened: dict[int, dict], min_score: int, top_k: int = 0) -> list[int]:
+    """
+    スクリーニングの結果から本評価に回すものを選ぶ
+    min_score点以上、上位top_k件、評価が返らなかったもの（タイムアウト等、clip_startがない）
+    """
+    ranked = sorted(screened, key=lambda i: screened[i].get('score', 0), reverse=True)
+    selected = set(ranked[:top_k]) if top_k > 0 else set()
+    for i, score_result in screened.items():
+        if score_failed(score_result) or score_result.get('score', 0) >= min_score:
+            selected.add(i)
+    return sorted(selected)
+
+
+def to_result(seg: dict, score_result: dict) -> dict:
+    """claudeの評価を出力用の結果に変換"""
+    result = {
+        'large_segment_index': seg.get('large_segment_index', 0),
+        'segment_index': seg['index'],
+        'segment_start': seg['start'],
+        'segment_end': seg['end'],
+        'segment_duration': seg['duration'],
+        'topic': seg.get('topic', ''),
+        'score': score_result.get('score', 0),
+        'clip_start': score_result.get('clip_start', ''),
+        'clip_end': score_result.get('clip_end', ''),
+        'clip_start_sec': parse_time(score_result.get('clip_start', '')),
+        'clip_end_sec': parse_time(score_result.get('clip_end', '')),
+        'hook': score_result.get('hook', ''),
+        'reason': score_result.get('reason', '')
+    }
+
+    if result['clip_start_sec'] and result['clip_end_sec']:
+        result['clip_duration'] = result['clip_end_sec'] - result['clip_start_sec']
+    else:
+        result['clip_duration'] = 0
+    return result
 
 
 def main():
@@ -137,8 +326,44 @@ def main():
                         help='Claudeモデル (default: claude-opus-4-5-20251101)')
     parser.add_argument('--min-duration', type=float, default=15,
                         help='最小セグメント長（秒） (default: 15)')
-    parser.add_argument('--delay', type=float, default=2.0,
-                        help='API呼び出し間の遅延（秒） (default: 2.0)')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'claude -p の同時実行数 (default: {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--rpm', type=float, default=DEFAULT_RPM,
+                        help=f'claude -p の1分あたりの開始数上限。0で無制限 (default: {DEFAULT_RPM})')
+    parser.add_argument('--batch-chars', type=int, default=0,
+                        help='複数セグメントを1回のclaude -pで評価するときの書き起こし文字数の上限。0で1セグメントずつ (default: 0)')
+    parser.add_argument('--resume', action='store_true',
+                        help='前回中断した評価をジャーナル（{stem}.score-journal.jsonl）から再開')
+    parser.add_argument('--screen-model',
+                        help='指定すると、このモデル（haikuなど）で全件を先に評価し、残ったものだけ -m のモデルで評価し直す')
+    parser.add_argument('--screen-min-score', type=int, default=5,
+                        help='--screen-modelでこの点以上なら本評価に回す (default: 5)')
+    parser.add_argument('--screen-top-k', type=int, default=0,
+                        help='--screen-modelの上位K件は点数によらず本評価に回す。0で使わない (default: 0)')
+    parser.add_argument('--dedup', action='store_true',
+                        help='ほぼ同じ内容のセグメントは代表1件だけ評価し、スコアをコピー')
+    parser.add_argument('--dedup-jaccard', type=float, default=DEFAULT_JACCARD,
+                        help=f'重複とみなす文字3-gramの推定Jaccard係数 (default: {DEFAULT_JACCARD})')
+    parser.add_argument('--dedup-cosine', type=float, default=DEFAULT_COSINE,
+                        help=f'重複とみなすembedding重心のコサイン類似度。0でembeddingを使わない (default: {DEFAULT_COSINE})')
+    parser.add_argument('--embedding-backend', choices=list(EMBEDDING_BACKENDS), default=DEFAULT_EMBEDDING_BACKEND,
+                        help=f'--dedupで使うembeddingバックエンド (default: {DEFAULT_EMBEDDING_BACKEND})')
+    parser.add_argument('--embedding-model',
+                        help='--dedupで使うembeddingモデル（省略時はバックエンドの既定。segment.pyと同じならキャッシュを再利用）')
+    parser.add_argument('--no-embedding-cache', action='store_true',
+                        help='--dedupでembeddingキャッシュを使わない')
+    parser.add_argument('--embedding-cache-dir', type=Path, default=DEFAULT_EMBEDDING_CACHE_DIR,
+                        help=f'embeddingキャッシュの場所 (default: {DEFAULT_EMBEDDING_CACHE_DIR})')
+    parser.add_argument('--embedding-cache-max-mb', type=float, default=DEFAULT_MAX_MB,
+                        help=f'モデルごとのembeddingキャッシュ容量上限（MB） (default: {DEFAULT_MAX_MB})')
+    parser.add_argument('--no-llm-cache', action='store_true',
+                        help='LLM応答キャッシュを使わず必ずclaude -pを呼ぶ')
+    parser.add_argument('--llm-cache-dir', type=Path, default=DEFAULT_LLM_CACHE_DIR,
+                        help=f'LLM応答キャッシュの場所 (default: {DEFAULT_LLM_CACHE_DIR})')
+    parser.add_argument('--llm-cache-max-mb', type=float, default=DEFAULT_LLM_CACHE_MAX_MB,
+                        help=f'LLM応答キャッシュの容量上限（MB）。超えたら古いものから削除 (default: {DEFAULT_LLM_CACHE_MAX_MB})')
+    parser.add_argument('--llm-cache-ttl-days', type=float, default=DEFAULT_LLM_CACHE_TTL_DAYS,
+                        help=f'LLM応答キャッシュの有効期間（最終利用からの日数） (default: {DEFAULT_LLM_CACHE_TTL_DAYS})')
     args = parser.parse_args()
 
     segments_path = Path(args.segments_json)
@@ -156,62 +381,125 @@ def main():
     # ASR結果読み込み（テキスト取得用）
     asr_path = args.asr or seg_data.get('source', '')
     print(f"[2/4] ASR結果を読み込み: {asr_path}")
-    with open(asr_path) as f:
-        asr_data = json.load(f)
+    transcript = load_asr(asr_path)
 
     # フィルタリング
     filtered = [s for s in segments if s['duration'] >= args.min_duration]
     print(f"  評価対象（{args.min_duration}秒以上）: {len(filtered)}")
 
-    # スコアリング
-    print(f"\n[3/4] スコアリング中 (model={args.model})...")
+    # テキスト取得
+    texts = [get_segment_text(transcript, seg['start'], seg['end']) for seg in filtered]
+
+    # 重複セグメント（代表だけLLMで評価する）
+    representatives = list(range(len(filtered)))
+    if args.dedup:
+        use_embedding = args.dedup_cosine > 0
+        embedding_backend = None
+        embedding_cache = None
+        if use_embedding:
+            embedding_backend = create_embedding_backend(args.embedding_backend, args.embedding_model)
+            if not args.no_embedding_cache:
+                embedding_cache = EmbeddingCache(
+                    embedding_backend.model_path, args.embedding_cache_dir, args.embedding_cache_max_mb
+                )
+        representatives = find_duplicate_segments(
+            filtered, texts,
+            transcript=transcript if use_embedding else None,
+            jaccard_threshold=args.dedup_jaccard,
+            cosine_threshold=args.dedup_cosine,
+            embedding_backend=embedding_backend,
+            cache=embedding_cache
+        )
+        duplicates = sum(r != i for i, r in enumerate(representatives))
+        print(f"  重複: {duplicates}件（代表のスコアをコピー）")
+
+    # スコアリング（テキストのないセグメントは除外、重複は代表だけ claude -p で評価）
+    skipped = sum(not text for text in texts)
+    if skipped:
+        print(f"  skip (テキストなし): {skipped}件")
+    jobs = [i for i, r in enumerate(representatives) if texts[i] and r == i]
+    cache = None if args.no_llm_cache else LLMCache(
+        args.llm_cache_dir, args.llm_cache_max_mb, args.llm_cache_ttl_days
+    )
+    # 評価ごとのジャーナル（異常終了からの再開用）
+    stem = segments_path.stem.replace('-segments-claude', '')
+    journal = Journal(output_dir / f"{stem}.score-journal.jsonl")
+    header = {
+        "type": "header",
+        "segments": str(segments_path.resolve()),
+        "prompt_version": PROMPT_VERSION,
+    }
+    # 失敗（タイムアウトなど）は記録しないが、古いジャーナルに残っていても呼び直す
+    journaled = {
+        record["key"]: record["result"]
+        for record in journal.open(header, args.resume)
+        if record["type"] == "score" and not score_failed(record["result"])
+    }
+    options = dict(
+        cache=cache, batch_chars=args.batch_chars, concurrency=args.concurrency, rpm=args.rpm,
+        journal=journal, journaled=journaled
+    )
+
+    screened, confirmed = {}, {}
+    if args.screen_model:
+        # 速いモデルで全件を評価し、残ったものだけ本評価のモデルで評価し直す
+        print(f"\n[3/4] スクリーニング中 (model={args.screen_model}, 同時{args.concurrency}件)...")
+        screened, screen_restored = score_segments(filtered, texts, jobs, args.screen_model, **options)
+        confirm = select_for_confirmation(screened, args.screen_min_score, args.screen_top_k)
+        avoided = len(jobs) - len(confirm)
+        print(f"  本評価の対象: {len(confirm)}/{len(jobs)}件（{args.screen_min_score}点以上"
+              + (f" または上位{args.screen_top_k}件" if args.screen_top_k > 0 else "") + "）")
+        print(f"  本評価中 (model={args.model})...")
+        confirmed, confirm_restored = score_segments(filtered, texts, confirm, args.model, **options)
+        print(f"  本評価の省略: {avoided}件（{args.model}の呼び出しを回避）")
+        # 本評価が返らなかったものはスクリーニングの評価を使う
+        confirm_ok = {i for i in confirmed if not score_failed(confirmed[i])}
+        if len(confirm_ok) < len(confirmed):
+            print(f"  本評価の失敗: {len(confirmed) - len(confirm_ok)}件（スクリーニングのスコアを使用）")
+        scored = {i: confirmed[i] if i in confirm_ok else screened[i] for i in jobs}
+        requested = len(jobs) + len(confirm)
+        restored = screen_restored + confirm_restored
+    else:
+        print(f"\n[3/4] スコアリング中 (model={args.model}, 同時{args.concurrency}件)...")
+        scored, restored = score_segments(filtered, texts, jobs, args.model, **options)
+        requested = len(jobs)
+
+    # claude -pで評価した件数（キャッシュヒット・ジャーナルからの復元を除く）
+    calls = claude_calls()
+    evaluated = requested - restored - (cache.hits if cache is not None else 0)
+    if cache is not None:
+        print(f"  LLM応答キャッシュ: {cache.hits}件ヒット")
+        cache.close()
+    if args.batch_chars > 0 and calls:
+        print(f"  バッチ評価: {calls}回で{evaluated}件（平均{evaluated / calls:.1f}件/回）")
+
+    # 元の順に結果を組み立て（重複には代表の結果をコピー）
     results = []
+    by_index = {}
     for i, seg in enumerate(filtered):
-        time_str = f"{format_time(seg['start'])}-{format_time(seg['end'])}"
-        topic = seg.get('topic', '')[:10]
-        print(f"  [{i+1}/{len(filtered)}] {time_str} ({seg['duration']:.0f}s) {topic}...", end=' ', flush=True)
-
-        # テキスト取得
-        text = get_segment_text(asr_data, seg['start'], seg['end'])
-        if not text:
-            print("skip (テキストなし)")
+        if not texts[i]:
             continue
-
-        score_result = score_segment(seg, text, model=args.model)
-
-        result = {
-            'large_segment_index': seg.get('large_segment_index', 0),
-            'segment_index': seg['index'],
-            'segment_start': seg['start'],
-            'segment_end': seg['end'],
-            'segment_duration': seg['duration'],
-            'topic': seg.get('topic', ''),
-            'score': score_result.get('score', 0),
-            'clip_start': score_result.get('clip_start', ''),
-            'clip_end': score_result.get('clip_end', ''),
-            'clip_start_sec': parse_time(score_result.get('clip_start', '')),
-            'clip_end_sec': parse_time(score_result.get('clip_end', '')),
-            'hook': score_result.get('hook', ''),
-            'reason': score_result.get('reason', '')
-        }
-
-        if result['clip_start_sec'] and result['clip_end_sec']:
-            result['clip_duration'] = result['clip_end_sec'] - result['clip_start_sec']
+        if i in scored:
+            result = to_result(seg, scored[i])
+            if args.screen_model:
+                result['screen_score'] = screened[i].get('score', 0)
+                result['confirm_score'] = confirmed[i].get('score', 0) if i in confirm_ok else None
+                result['score_model'] = args.model if i in confirm_ok else args.screen_model
+                if i in confirmed and i not in confirm_ok:
+                    result['confirm_error'] = confirmed[i].get('reason', '')
         else:
-            result['clip_duration'] = 0
-
+            result = copy_duplicate_result(by_index[representatives[i]], seg)
+        by_index[i] = result
         results.append(result)
-        print(f"score={result['score']}")
 
-        if i < len(filtered) - 1:
-            time.sleep(args.delay)
+    if args.dedup:
+        print(f"  LLM呼び出し: {calls}回（重複{duplicates}件を省略）")
 
     # スコア順にソート
     results.sort(key=lambda x: x['score'], reverse=True)
 
     # 結果保存
     print(f"\n[4/4] 結果保存中...")
-    stem = segments_path.stem.replace('-segments-claude', '')
     output_path = output_dir / f"{stem}-scores-claude.json"
 
     output_data = {
@@ -219,8 +507,19 @@ def main():
         'model': args.model,
         'total_segments': len(segments),
         'scored_segments': len(results),
+        'llm_calls': calls,
+        'batch_chars': args.batch_chars,
+        'segments_per_call': round(evaluated / calls, 2) if calls else 0,
         'results': results
     }
+    if args.screen_model:
+        output_data.update({
+            'screen_model': args.screen_model,
+            'screen_min_score': args.screen_min_score,
+            'screen_top_k': args.screen_top_k,
+            'confirmed_segments': len(confirmed),
+            'confirm_calls_avoided': avoided,
+        })
     with open(output_path, 'w', encoding='utf-8') as f:
         json.dump(output_data, f, ensure_ascii=False, indent=2)
     print(f"  保存: {output_path}")
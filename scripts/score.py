@@ -5,15 +5,27 @@
 """
 
 import argparse
-import gc
 import json
-import os
-import signal
-import subprocess
 import sys
-import time
 from pathlib import Path
 
+from asr_store import load_asr
+from embedding import DEFAULT_EMBEDDING_BACKEND, EMBEDDING_BACKENDS, create_embedding_backend
+from embedding_cache import DEFAULT_EMBEDDING_CACHE_DIR, DEFAULT_MAX_MB, EmbeddingCache
+from llm_cache import DEFAULT_LLM_CACHE_DIR, DEFAULT_LLM_CACHE_MAX_MB, DEFAULT_LLM_CACHE_TTL_DAYS, LLMCache, cache_key
+from llm_executor import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_RPM,
+    DEFAULT_TIMEOUT,
+    ClaudeError,
+    LLMExecutor,
+    bisect_batch,
+    claude_calls,
+    pack_batches,
+    run_claude,
+)
+from segment_dedup import DEFAULT_COSINE, DEFAULT_JACCARD, copy_duplicate_result, find_duplicate_segments
+
 
 def format_time(seconds: float) -> str:
     """秒をMM:SS形式に変換"""
@@ -22,14 +34,37 @@ def format_time(seconds: float) -> str:
     return f"{mins:02d}:{secs:02d}"
 
 
-def score_segment(segment: dict, model: str = "sonnet") -> dict:
+# プロンプトを変えたら上げる（LLM応答キャッシュを無効化）
+PROMPT_VERSION = 1
+# プロンプトに入れる1セグメントの書き起こしの上限（文字）
+MAX_TEXT_CHARS = 2000
+
+
+def score_cache_key(segment: dict, model: str) -> str:
+    """LLM応答キャッシュのキー（単独・バッチどちらの評価も同じキー）"""
+    return cache_key('score', PROMPT_VERSION, model, segment['text'], segment['start'], segment['end'])
+
+
+def valid_answer(answer) -> bool:
+    """スコアと切り抜き区間がそろった回答か（欠けたものはキャッシュせず、バッチでは評価し直す）"""
+    return isinstance(answer, dict) and all(field in answer for field in ('score', 'clip_start', 'clip_end'))
+
+
+def score_segment(segment: dict, model: str = "sonnet", cache: LLMCache | None = None) -> dict:
     """
     claude -pでセグメントを評価し、15-60秒の最適切り抜き区間を提案
-    Popenで明示的にプロセス管理・kill
+    プロセス管理・killはllm_executor.run_claude
+    cacheがあれば同じテキスト・区間・モデルの評価を再利用し、成功した評価を保存
     """
     seg_start = segment['start']
     seg_end = segment['end']
 
+    key = score_cache_key(segment, model)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
     prompt = f'''以下はYouTube動画の書き起こしです（{format_time(seg_start)}〜{format_time(seg_end)}）。
 
 この中から **15〜60秒** のYouTubeショート向け切り抜き区間を提案してください。
@@ -42,7 +77,7 @@ def score_segment(segment: dict, model: str = "sonnet") -> dict:
 
 書き起こし:
 ---
-{segment['text'][:2000]}
+{segment['text'][:MAX_TEXT_CHARS]}
 ---
 
 以下のJSON形式のみで回答（説明不要）:
@@ -57,56 +92,86 @@ def score_segment(segment: dict, model: str = "sonnet") -> dict:
 
 切り抜き価値が低い場合はscore=1-3、clip_start/clip_endは最もマシな区間を指定。'''
 
-    cmd = [
-        'claude', '-p', prompt,
-        '--allowedTools', '[]',
-        '--model', model,
-        '--output-format', 'text'
-    ]
-
-    proc = None
     try:
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            start_new_session=True
-        )
-
-        try:
-            stdout, stderr = proc.communicate(timeout=90)
-        except subprocess.TimeoutExpired:
-            os.killpg(os.getpgid(proc.pid), signal.SIGKILL)
-            proc.wait()
-            return {'score': 0, 'reason': 'Timeout'}
-
-        if proc.returncode != 0:
-            return {'score': 0, 'reason': 'API error'}
-
-        output = stdout.strip()
+        output = run_claude(prompt, model).strip()
         start = output.find('{')
         end = output.rfind('}') + 1
         if start >= 0 and end > start:
-            return json.loads(output[start:end])
+            result = json.loads(output[start:end])
+            if cache is not None and valid_answer(result):
+                cache.put(key, result)
+            return result
         else:
             return {'score': 0, 'reason': 'Parse error'}
 
+    except ClaudeError as e:
+        return {'score': 0, 'reason': 'Timeout' if e.reason == 'timeout' else 'API error'}
     except json.JSONDecodeError as e:
         print(f"  [ERROR] JSON parse: {e}", file=sys.stderr)
         return {'score': 0, 'reason': 'JSON error'}
     except Exception as e:
         print(f"  [ERROR] {e}", file=sys.stderr)
         return {'score': 0, 'reason': 'エラー'}
-    finally:
-        if proc is not None:
-            try:
-                if proc.poll() is None:
-                    os.killpg(os.getpgid(proc.pid), signal.SIGKILL)
-                proc.wait()
-            except:
-                pass
-        gc.collect()
+
+
+def score_batch(segments: list[dict], model: str = "sonnet", cache: LLMCache | None = None) -> dict[int, dict]:
+    """
+    複数セグメントを1回のclaude -pでまとめて評価（区間番号つきのJSON配列で回答させる）
+    戻り値: {segments内の位置: 評価}。番号が欠けた・壊れた・項目が足りない要素は含めない（llm_executor.bisect_batchでやり直す）
+    """
+    blocks = "\n\n".join(
+        f"[区間{k + 1}] {format_time(seg['start'])}〜{format_time(seg['end'])}\n---\n{seg['text'][:MAX_TEXT_CHARS]}\n---"
+        for k, seg in enumerate(segments)
+    )
+    prompt = f'''以下はYouTube動画の書き起こしを{len(segments)}個の区間に分けたものです。
+
+区間ごとに、その中から **15〜60秒** のYouTubeショート向け切り抜き区間を1つ提案してください。
+
+評価基準:
+- 話題の完結性（単独で理解できるか）
+- エンタメ性・興味深さ・意外性
+- 視聴者の関心を引く要素
+- 冒頭で興味を引けるか
+
+{blocks}
+
+以下のJSON配列のみで回答（説明不要）。全区間について1要素ずつ、idは区間番号:
+[
+  {{
+    "id": 区間番号,
+    "score": 1-10の整数,
+    "clip_start": 推奨開始時刻（MM:SS形式、元動画の絶対時刻）,
+    "clip_end": 推奨終了時刻（MM:SS形式、元動画の絶対時刻）,
+    "topic": "15字以内の話題",
+    "hook": "冒頭の引きとなるポイント（20字以内）",
+    "reason": "30字以内の評価理由"
+  }}
+]
+
+切り抜き価値が低い場合はscore=1-3、clip_start/clip_endは最もマシな区間を指定。'''
+
+    output = run_claude(prompt, model, timeout=DEFAULT_TIMEOUT + 30 * len(segments)).strip()
+    start = output.find('[')
+    end = output.rfind(']') + 1
+    if start < 0 or end <= start:
+        return {}
+    answers = json.loads(output[start:end])
+    if not isinstance(answers, list):
+        return {}
+
+    results = {}
+    for answer in answers:
+        if not valid_answer(answer):
+            continue
+        try:
+            k = int(answer.pop('id')) - 1
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 0 <= k < len(segments) and k not in results:
+            results[k] = answer
+            if cache is not None:
+                cache.put(score_cache_key(segments[k], model), answer)
+    return results
 
 
 def parse_time(time_str: str) -> float:
@@ -120,6 +185,31 @@ def parse_time(time_str: str) -> float:
         return 0
 
 
+def to_result(seg: dict, score_result: dict) -> dict:
+    """claudeの評価を出力用の結果に変換"""
+    result = {
+        'large_segment_index': seg.get('large_segment_index', 0),
+        'segment_index': seg['index'],
+        'segment_start': seg['start'],
+        'segment_end': seg['end'],
+        'segment_duration': seg['duration'],
+        'score': score_result.get('score', 0),
+        'clip_start': score_result.get('clip_start', ''),
+        'clip_end': score_result.get('clip_end', ''),
+        'clip_start_sec': parse_time(score_result.get('clip_start', '')),
+        'clip_end_sec': parse_time(score_result.get('clip_end', '')),
+        'topic': score_result.get('topic', ''),
+        'hook': score_result.get('hook', ''),
+        'reason': score_result.get('reason', '')
+    }
+
+    if result['clip_start_sec'] and result['clip_end_sec']:
+        result['clip_duration'] = result['clip_end_sec'] - result['clip_start_sec']
+    else:
+        result['clip_duration'] = 0
+    return result
+
+
 def main():
     parser = argparse.ArgumentParser(description='ショート適性スコアリング')
     parser.add_argument('segments_json', help='セグメント情報JSONファイル')
@@ -127,8 +217,36 @@ def main():
     parser.add_argument('-m', '--model', default='sonnet', help='Claudeモデル (default: sonnet)')
     parser.add_argument('--min-duration', type=float, default=15,
                         help='最小セグメント長（秒）。これ未満はスキップ (default: 15)')
-    parser.add_argument('--delay', type=float, default=2.0,
-                        help='API呼び出し間の遅延（秒） (default: 2.0)')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'claude -p の同時実行数 (default: {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--rpm', type=float, default=DEFAULT_RPM,
+                        help=f'claude -p の1分あたりの開始数上限。0で無制限 (default: {DEFAULT_RPM})')
+    parser.add_argument('--batch-chars', type=int, default=0,
+                        help='複数セグメントを1回のclaude -pで評価するときの書き起こし文字数の上限。0で1セグメントずつ (default: 0)')
+    parser.add_argument('--dedup', action='store_true',
+                        help='ほぼ同じ内容のセグメントは代表1件だけ評価し、スコアをコピー')
+    parser.add_argument('--dedup-jaccard', type=float, default=DEFAULT_JACCARD,
+                        help=f'重複とみなす文字3-gramの推定Jaccard係数 (default: {DEFAULT_JACCARD})')
+    parser.add_argument('--dedup-cosine', type=float, default=DEFAULT_COSINE,
+                        help=f'重複とみなすembedding重心のコサイン類似度。0でembeddingを使わない (default: {DEFAULT_COSINE})')
+    parser.add_argument('--embedding-backend', choices=list(EMBEDDING_BACKENDS), default=DEFAULT_EMBEDDING_BACKEND,
+                        help=f'--dedupで使うembeddingバックエンド (default: {DEFAULT_EMBEDDING_BACKEND})')
+    parser.add_argument('--embedding-model',
+                        help='--dedupで使うembeddingモデル（省略時はバックエンドの既定。segment.pyと同じならキャッシュを再利用）')
+    parser.add_argument('--no-embedding-cache', action='store_true',
+                        help='--dedupでembeddingキャッシュを使わない')
+    parser.add_argument('--embedding-cache-dir', type=Path, default=DEFAULT_EMBEDDING_CACHE_DIR,
+                        help=f'embeddingキャッシュの場所 (default: {DEFAULT_EMBEDDING_CACHE_DIR})')
+    parser.add_argument('--embedding-cache-max-mb', type=float, default=DEFAULT_MAX_MB,
+                        help=f'モデルごとのembeddingキャッシュ容量上限（MB） (default: {DEFAULT_MAX_MB})')
+    parser.add_argument('--no-llm-cache', action='store_true',
+                        help='LLM応答キャッシュを使わず必ずclaude -pを呼ぶ')
+    parser.add_argument('--llm-cache-dir', type=Path, default=DEFAULT_LLM_CACHE_DIR,
+                        help=f'LLM応答キャッシュの場所 (default: {DEFAULT_LLM_CACHE_DIR})')
+    parser.add_argument('--llm-cache-max-mb', type=float, default=DEFAULT_LLM_CACHE_MAX_MB,
+                        help=f'LLM応答キャッシュの容量上限（MB）。超えたら古いものから削除 (default: {DEFAULT_LLM_CACHE_MAX_MB})')
+    parser.add_argument('--llm-cache-ttl-days', type=float, default=DEFAULT_LLM_CACHE_TTL_DAYS,
+                        help=f'LLM応答キャッシュの有効期間（最終利用からの日数） (default: {DEFAULT_LLM_CACHE_TTL_DAYS})')
     args = parser.parse_args()
 
     segments_path = Path(args.segments_json)
@@ -147,41 +265,98 @@ def main():
     filtered = [s for s in segments if s['duration'] >= args.min_duration]
     print(f"  評価対象（{args.min_duration}秒以上）: {len(filtered)}")
 
-    # スコアリング
-    print(f"\n[2/3] スコアリング中 (model={args.model})...")
+    # 重複セグメント（代表だけLLMで評価する）
+    representatives = list(range(len(filtered)))
+    if args.dedup:
+        use_embedding = args.dedup_cosine > 0
+        embedding_backend = None
+        embedding_cache = None
+        if use_embedding:
+            embedding_backend = create_embedding_backend(args.embedding_backend, args.embedding_model)
+            if not args.no_embedding_cache:
+                embedding_cache = EmbeddingCache(
+                    embedding_backend.model_path, args.embedding_cache_dir, args.embedding_cache_max_mb
+                )
+        representatives = find_duplicate_segments(
+            filtered, [s['text'] for s in filtered],
+            transcript=load_asr(data['source']) if use_embedding else None,
+            jaccard_threshold=args.dedup_jaccard,
+            cosine_threshold=args.dedup_cosine,
+            embedding_backend=embedding_backend,
+            cache=embedding_cache
+        )
+        duplicates = sum(r != i for i, r in enumerate(representatives))
+        print(f"  重複: {duplicates}件（代表のスコアをコピー）")
+
+    # スコアリング（重複は代表だけ claude -p で評価）
+    print(f"\n[2/3] スコアリング中 (model={args.model}, 同時{args.concurrency}件)...")
+    jobs = [i for i, r in enumerate(representatives) if r == i]
+    cache = None if args.no_llm_cache else LLMCache(
+        args.llm_cache_dir, args.llm_cache_max_mb, args.llm_cache_ttl_days
+    )
+    scored = {}
+
+    if args.batch_chars > 0:
+        # キャッシュにあるものを先に埋め、残りを書き起こしの文字数でまとめる
+        pending = []
+        for i in jobs:
+            hit = cache.get(score_cache_key(filtered[i], args.model)) if cache is not None else None
+            if hit is None:
+                pending.append(i)
+            else:
+                scored[i] = hit
+        sizes = [len(filtered[i]['text'][:MAX_TEXT_CHARS]) for i in pending]
+        units = [[pending[k] for k in batch] for batch in pack_batches(sizes, args.batch_chars)]
+        print(f"  バッチ: {len(pending)}件を{len(units)}回に（上限{args.batch_chars}文字）")
+
+        def run_unit(unit: list[int]) -> list[dict]:
+            return bisect_batch(
+                lambda batch: score_batch([filtered[i] for i in batch], model=args.model, cache=cache),
+                lambda i: score_segment(filtered[i], model=args.model, cache=cache),
+                unit
+            )
+    else:
+        units = [[i] for i in jobs]
+
+        def run_unit(unit: list[int]) -> list[dict]:
+            return [score_segment(filtered[unit[0]], model=args.model, cache=cache)]
+
+    done = len(scored)
+
+    def on_done(k: int, unit_results: list[dict]) -> None:
+        nonlocal done
+        for i, score_result in zip(units[k], unit_results):
+            done += 1
+            seg = filtered[i]
+            time_str = f"{format_time(seg['start'])}-{format_time(seg['end'])}"
+            print(f"  [{done}/{len(jobs)}] {time_str} ({seg['duration']:.0f}s) "
+                  f"score={score_result.get('score', 0)} | {score_result.get('clip_start', '')}-{score_result.get('clip_end', '')} | {score_result.get('topic', '')}")
+
+    unit_results = LLMExecutor(args.concurrency, args.rpm).map(run_unit, units, on_done)
+    for unit, results_of_unit in zip(units, unit_results):
+        scored.update(zip(unit, results_of_unit))
+
+    calls = claude_calls()
+    evaluated = len(jobs) - (cache.hits if cache is not None else 0)
+    if cache is not None:
+        print(f"  LLM応答キャッシュ: {cache.hits}件ヒット")
+        cache.close()
+    if args.batch_chars > 0 and calls:
+        print(f"  バッチ評価: {calls}回で{evaluated}件（平均{evaluated / calls:.1f}件/回）")
+
+    # 元の順に結果を組み立て（重複には代表の結果をコピー）
     results = []
+    by_index = {}
     for i, seg in enumerate(filtered):
-        time_str = f"{format_time(seg['start'])}-{format_time(seg['end'])}"
-        print(f"  [{i+1}/{len(filtered)}] {time_str} ({seg['duration']:.0f}s)...", end=' ', flush=True)
-
-        score_result = score_segment(seg, model=args.model)
-
-        result = {
-            'large_segment_index': seg.get('large_segment_index', 0),
-            'segment_index': seg['index'],
-            'segment_start': seg['start'],
-            'segment_end': seg['end'],
-            'segment_duration': seg['duration'],
-            'score': score_result.get('score', 0),
-            'clip_start': score_result.get('clip_start', ''),
-            'clip_end': score_result.get('clip_end', ''),
-            'clip_start_sec': parse_time(score_result.get('clip_start', '')),
-            'clip_end_sec': parse_time(score_result.get('clip_end', '')),
-            'topic': score_result.get('topic', ''),
-            'hook': score_result.get('hook', ''),
-            'reason': score_result.get('reason', '')
-        }
-
-        if result['clip_start_sec'] and result['clip_end_sec']:
-            result['clip_duration'] = result['clip_end_sec'] - result['clip_start_sec']
+        if i in scored:
+            result = to_result(seg, scored[i])
         else:
-            result['clip_duration'] = 0
-
+            result = copy_duplicate_result(by_index[representatives[i]], seg)
+        by_index[i] = result
         results.append(result)
-        print(f"score={result['score']} | {result['clip_start']}-{result['clip_end']} | {result['topic']}")
 
-        if i < len(filtered) - 1:
-            time.sleep(args.delay)
+    if args.dedup:
+        print(f"  LLM呼び出し: {calls}回（重複{duplicates}件を省略）")
 
     # スコア順にソート
     results.sort(key=lambda x: x['score'], reverse=True)
@@ -199,6 +374,9 @@ def main():
         'small_threshold': data.get('small_threshold', 0),
         'total_segments': len(segments),
         'scored_segments': len(results),
+        'llm_calls': calls,
+        'batch_chars': args.batch_chars,
+        'segments_per_call': round(evaluated / calls, 2) if calls else 0,
         'results': results
     }
     with open(output_path, 'w', encoding='utf-8') as f:
@@ -6,59 +6,42 @@
 """
 
 import argparse
-import gc
 import json
-import subprocess
 import sys
-import time
 from pathlib import Path
 
-import mlx.core as mx
 import numpy as np
 
-
-def load_model(model_path: str):
-    """MLX embeddingモデルを読み込み"""
-    from mlx_embeddings.utils import load
-    return load(model_path)
-
-
-def encode_texts(model, tokenizer, texts: list[str], batch_size: int = 4) -> np.ndarray:
-    """テキストをembeddingに変換"""
-    all_embeddings = []
-    for i in range(0, len(texts), batch_size):
-        batch_texts = texts[i:i + batch_size]
-        inputs = tokenizer._tokenizer(
-            batch_texts, return_tensors='np', padding=True, truncation=True, max_length=128
-        )
-        input_ids = mx.array(inputs['input_ids'])
-        attention_mask = mx.array(inputs['attention_mask'])
-        outputs = model(input_ids=input_ids, attention_mask=attention_mask)
-        all_embeddings.append(np.array(outputs.text_embeds))
-        del input_ids, attention_mask, outputs
-        mx.clear_cache()
-        gc.collect()
-    return np.vstack(all_embeddings)
-
-
-def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
-    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
-
-
-def detect_large_segments(embeddings: np.ndarray, sentences: list[dict], threshold: float = 0.3) -> list[dict]:
-    """大セグメント検出（embedding類似度）"""
-    boundaries = []
-    for i in range(1, len(embeddings)):
-        sim = cosine_similarity(embeddings[i - 1], embeddings[i])
-        if sim < threshold:
-            boundaries.append(i)
-
-    boundary_indices = [0] + boundaries + [len(sentences)]
+from asr_store import load_asr
+from embedding import (
+    DEFAULT_CACHE_LIMIT_MB,
+    DEFAULT_EMBEDDING_BACKEND,
+    DEFAULT_TOKEN_BUDGET,
+    EMBEDDING_BACKENDS,
+    create_embedding_backend,
+    embed_sentences,
+)
+from embedding_cache import DEFAULT_EMBEDDING_CACHE_DIR, DEFAULT_MAX_MB, EmbeddingCache
+from journal import Journal
+from llm_cache import DEFAULT_LLM_CACHE_DIR, DEFAULT_LLM_CACHE_MAX_MB, DEFAULT_LLM_CACHE_TTL_DAYS, LLMCache, cache_key
+from llm_executor import DEFAULT_CONCURRENCY, DEFAULT_RPM, ClaudeError, LLMExecutor, run_claude
+from segment_core import DEFAULT_WINDOWS, boundaries_to_spans, boundary_curve, threshold_boundaries
+
+
+def detect_large_segments(
+    embeddings: np.ndarray,
+    sentences: list[dict],
+    threshold: float = 0.3,
+    similarity: str = 'adjacent',
+    windows=DEFAULT_WINDOWS,
+    min_depth: float = 0.0
+) -> list[dict]:
+    """大セグメント検出（embedding類似度。similarityはsegment_core.boundary_curve参照）"""
+    similarities, _ = boundary_curve(embeddings, similarity, windows=windows, min_depth=min_depth)
+    boundaries = threshold_boundaries(similarities, threshold)
     large_segments = []
 
-    for i in range(len(boundary_indices) - 1):
-        start_idx = boundary_indices[i]
-        end_idx = boundary_indices[i + 1]
+    for i, (start_idx, end_idx) in enumerate(boundaries_to_spans(boundaries, len(sentences))):
         segment_sentences = sentences[start_idx:end_idx]
         if not segment_sentences:
             continue
@@ -93,18 +76,38 @@ def parse_time(time_str: str, base_seconds: float = 0) -> float:
         return base_seconds
 
 
-def split_with_claude(large_segment: dict, model: str = "sonnet") -> list[dict]:
+# プロンプトを変えたら上げる（LLM応答キャッシュを無効化）
+PROMPT_VERSION = 1
+# 分割が返らなかったときの話題（split_with_claude のフォールバック）
+FAILURE_TOPICS = ('パースエラー', 'タイムアウト', '分割失敗', 'エラー')
+
+
+def split_failed(small_segments: list[dict]) -> bool:
+    """分割が返らず、大セグメントをそのまま1区間にしたものか"""
+    return len(small_segments) == 1 and small_segments[0].get('topic') in FAILURE_TOPICS
+
+
+def split_cache_key(large_segment: dict, model: str) -> str:
+    """LLM応答キャッシュ・ジャーナルのキー（モデル・テキスト・区間）"""
+    return cache_key('split', PROMPT_VERSION, model, large_segment['text'], large_segment['start'], large_segment['end'])
+
+
+def split_with_claude(large_segment: dict, model: str = "sonnet", cache: LLMCache | None = None) -> list[dict]:
     """
     Claude Codeで大セグメントを小セグメントに分割
-    メモリ効率化: Popenで明示的にプロセス管理・kill
+    プロセス管理・killはllm_executor.run_claude
+    cacheがあれば同じテキスト・区間・モデルの分割を再利用し、成功した分割を保存
     """
-    import os
-    import signal
-
     seg_start = large_segment['start']
     seg_end = large_segment['end']
     text = large_segment['text'][:3000]
 
+    key = split_cache_key(large_segment, model)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
     prompt = f'''以下はYouTube動画の書き起こし（{format_time(seg_start)}〜{format_time(seg_end)}）です。
 
 この中の話題の切り替わりを検出し、15〜90秒程度の小区間に分割してください。
@@ -128,36 +131,8 @@ def split_with_claude(large_segment: dict, model: str = "sonnet") -> list[dict]:
 - 区間が重複・欠落しないように
 - 分割不要なら1区間のみ返す'''
 
-    cmd = [
-        'claude', '-p', prompt,
-        '--allowedTools', '[]',
-        '--model', model,
-        '--output-format', 'text'
-    ]
-
-    proc = None
     try:
-        # 新しいプロセスグループで起動（子プロセスも一括kill可能に）
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            start_new_session=True
-        )
-
-        try:
-            stdout, stderr = proc.communicate(timeout=90)
-        except subprocess.TimeoutExpired:
-            # タイムアウト時はプロセスグループごとkill
-            os.killpg(os.getpgid(proc.pid), signal.SIGKILL)
-            proc.wait()
-            return [{'start': seg_start, 'end': seg_end, 'topic': 'タイムアウト'}]
-
-        if proc.returncode != 0:
-            return [{'start': seg_start, 'end': seg_end, 'topic': '分割失敗'}]
-
-        output = stdout.strip()
+        output = run_claude(prompt, model).strip()
         start = output.find('{')
         end = output.rfind('}') + 1
         if start >= 0 and end > start:
@@ -169,23 +144,19 @@ def split_with_claude(large_segment: dict, model: str = "sonnet") -> list[dict]:
                     'end': parse_time(s.get('end', ''), seg_end),
                     'topic': s.get('topic', '')
                 })
-            return segments if segments else [{'start': seg_start, 'end': seg_end, 'topic': ''}]
+            segments = segments if segments else [{'start': seg_start, 'end': seg_end, 'topic': ''}]
+            if cache is not None:
+                cache.put(key, segments)
+            return segments
         else:
             return [{'start': seg_start, 'end': seg_end, 'topic': 'パースエラー'}]
 
+    except ClaudeError as e:
+        topic = 'タイムアウト' if e.reason == 'timeout' else '分割失敗'
+        return [{'start': seg_start, 'end': seg_end, 'topic': topic}]
     except Exception as e:
         print(f"  [ERROR] {e}", file=sys.stderr)
         return [{'start': seg_start, 'end': seg_end, 'topic': 'エラー'}]
-    finally:
-        # 確実にプロセスを終了
-        if proc is not None:
-            try:
-                if proc.poll() is None:  # まだ動いてたら
-                    os.killpg(os.getpgid(proc.pid), signal.SIGKILL)
-                proc.wait()
-            except:
-                pass
-        gc.collect()
 
 
 def main():
@@ -193,15 +164,44 @@ def main():
     parser.add_argument('input', help='ASR結果JSONファイル')
     parser.add_argument('-o', '--output', default='output', help='出力ディレクトリ')
     parser.add_argument('-m', '--model-path',
-                        default='./models/paraphrase-multilingual-MiniLM-L12-v2-mlx',
-                        help='MLX embeddingモデルパス')
+                        help=f"embeddingモデル (default: mlx={EMBEDDING_BACKENDS['mlx'].default_model}, "
+                             f"cpu={EMBEDDING_BACKENDS['cpu'].default_model})")
+    parser.add_argument('--embedding-backend', choices=list(EMBEDDING_BACKENDS), default=DEFAULT_EMBEDDING_BACKEND,
+                        help=f'embeddingバックエンド: mlx=Apple Silicon / cpu=sentence-transformers (default: {DEFAULT_EMBEDDING_BACKEND})')
     parser.add_argument('-t', '--threshold', type=float, default=0.3,
                         help='大セグメント検出の類似度閾値 (default: 0.3)')
+    parser.add_argument('--similarity', choices=['adjacent', 'window'], default='adjacent',
+                        help='境界の判定: adjacent=隣接文の類似度 / window=前後の窓平均の類似度の谷（短い相槌に強い） (default: adjacent)')
+    parser.add_argument('--windows', type=int, nargs='+', default=list(DEFAULT_WINDOWS),
+                        help=f"windowで使う窓幅（文数） (default: {' '.join(map(str, DEFAULT_WINDOWS))})")
+    parser.add_argument('--min-depth', type=float, default=0.0,
+                        help='windowで境界候補にする谷の最小depth score (default: 0.0)')
     parser.add_argument('--claude-model', default='sonnet',
                         help='小セグメント分割のClaudeモデル (default: sonnet)')
-    parser.add_argument('--delay', type=float, default=2.0,
-                        help='API呼び出し間の遅延（秒） (default: 2.0)')
-    parser.add_argument('-b', '--batch-size', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'claude -p の同時実行数 (default: {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--rpm', type=float, default=DEFAULT_RPM,
+                        help=f'claude -p の1分あたりの開始数上限。0で無制限 (default: {DEFAULT_RPM})')
+    parser.add_argument('--no-llm-cache', action='store_true',
+                        help='LLM応答キャッシュを使わず必ずclaude -pを呼ぶ')
+    parser.add_argument('--llm-cache-dir', type=Path, default=DEFAULT_LLM_CACHE_DIR,
+                        help=f'LLM応答キャッシュの場所 (default: {DEFAULT_LLM_CACHE_DIR})')
+    parser.add_argument('--llm-cache-max-mb', type=float, default=DEFAULT_LLM_CACHE_MAX_MB,
+                        help=f'LLM応答キャッシュの容量上限（MB）。超えたら古いものから削除 (default: {DEFAULT_LLM_CACHE_MAX_MB})')
+    parser.add_argument('--llm-cache-ttl-days', type=float, default=DEFAULT_LLM_CACHE_TTL_DAYS,
+                        help=f'LLM応答キャッシュの有効期間（最終利用からの日数） (default: {DEFAULT_LLM_CACHE_TTL_DAYS})')
+    parser.add_argument('--resume', action='store_true',
+                        help='前回中断した分割をジャーナル（{stem}.segment-journal.jsonl）から再開')
+    parser.add_argument('--no-embedding-cache', action='store_true',
+                        help='embeddingキャッシュを使わない')
+    parser.add_argument('--embedding-cache-dir', type=Path, default=DEFAULT_EMBEDDING_CACHE_DIR,
+                        help=f'embeddingキャッシュの場所 (default: {DEFAULT_EMBEDDING_CACHE_DIR})')
+    parser.add_argument('--embedding-cache-max-mb', type=float, default=DEFAULT_MAX_MB,
+                        help=f'モデルごとのembeddingキャッシュ容量上限（MB） (default: {DEFAULT_MAX_MB})')
+    parser.add_argument('--token-budget', type=int, default=DEFAULT_TOKEN_BUDGET,
+                        help=f'embeddingの1バッチのトークン数上限（文数×最長トークン数） (default: {DEFAULT_TOKEN_BUDGET})')
+    parser.add_argument('--cache-limit-mb', type=float, default=DEFAULT_CACHE_LIMIT_MB,
+                        help=f'MLXキャッシュがこれを超えたらクリア（MB） (default: {DEFAULT_CACHE_LIMIT_MB})')
     args = parser.parse_args()
 
     input_path = Path(args.input)
@@ -209,46 +209,97 @@ def main():
     output_dir.mkdir(parents=True, exist_ok=True)
 
     # ASR結果読み込み
-    print(f"[1/5] ASR結果を読み込み: {input_path}")
-    with open(input_path) as f:
-        asr_data = json.load(f)
-    sentences = asr_data['sentences']
+    print(f"[1/4] ASR結果を読み込み: {input_path}")
+    transcript = load_asr(input_path)
+    sentences = transcript.sentence_dicts()
     print(f"  ASRセグメント数: {len(sentences)}")
 
-    # モデル読み込み
-    print(f"[2/5] embeddingモデルを読み込み")
-    model, tokenizer = load_model(args.model_path)
-
-    # embedding生成
-    print(f"[3/5] embedding生成中...")
+    # embedding生成（キャッシュにない文だけモデルで計算）
+    backend = create_embedding_backend(args.embedding_backend, args.model_path)
+    print(f"[2/4] embedding生成中: {backend.model_path} ({backend.name})")
     texts = [s['text'] for s in sentences]
-    embeddings = encode_texts(model, tokenizer, texts, batch_size=args.batch_size)
+    cache = None if args.no_embedding_cache else EmbeddingCache(
+        backend.model_path, args.embedding_cache_dir, args.embedding_cache_max_mb
+    )
+    embeddings = embed_sentences(
+        backend, texts,
+        token_budget=args.token_budget,
+        cache_limit_mb=args.cache_limit_mb,
+        cache=cache
+    )
     print(f"  Shape: {embeddings.shape}")
 
-    del model, tokenizer
-    mx.clear_cache()
-    gc.collect()
-
     # 大セグメント検出
-    print(f"[4/5] 大セグメント検出（閾値{args.threshold}）...")
-    large_segments = detect_large_segments(embeddings, sentences, args.threshold)
+    print(f"[3/4] 大セグメント検出（閾値{args.threshold}）...")
+    large_segments = detect_large_segments(
+        embeddings, sentences, args.threshold,
+        similarity=args.similarity,
+        windows=args.windows,
+        min_depth=args.min_depth
+    )
     print(f"  大セグメント: {len(large_segments)}個")
 
-    # Claude で小セグメント分割
-    print(f"[5/5] Claudeで小セグメント分割中 (model={args.claude_model})...")
-    all_small_segments = []
-
-    for i, large_seg in enumerate(large_segments):
+    # Claude で小セグメント分割（30秒未満の大セグメントは分割しない）
+    print(f"[4/4] Claudeで小セグメント分割中 (model={args.claude_model}, 同時{args.concurrency}件)...")
+    jobs = [i for i, seg in enumerate(large_segments) if seg['duration'] >= 30]
+    print(f"  分割対象: {len(jobs)}個（{len(large_segments) - len(jobs)}個は短いのでskip）")
+
+    # 分割ごとのジャーナル（異常終了からの再開用）。大セグメントはキャッシュと同じキーで照合
+    journal = Journal(output_dir / f"{input_path.stem}.segment-journal.jsonl")
+    header = {
+        "type": "header",
+        "source": str(input_path.resolve()),
+        "claude_model": args.claude_model,
+        "prompt_version": PROMPT_VERSION,
+    }
+    # 失敗（タイムアウトなど）は記録しないが、古いジャーナルに残っていても呼び直す
+    journaled = {
+        record["key"]: record["segments"]
+        for record in journal.open(header, args.resume)
+        if record["type"] == "split" and not split_failed(record["segments"])
+    }
+    splits = {}
+    for i in jobs:
+        key = split_cache_key(large_segments[i], args.claude_model)
+        if key in journaled:
+            splits[i] = journaled[key]
+    if splits:
+        print(f"  再開: {len(splits)}個をジャーナルから復元")
+        jobs = [i for i in jobs if i not in splits]
+    done = 0
+    cache = None if args.no_llm_cache else LLMCache(
+        args.llm_cache_dir, args.llm_cache_max_mb, args.llm_cache_ttl_days
+    )
+
+    def on_done(k: int, small_segs: list[dict]) -> None:
+        nonlocal done
+        done += 1
+        large_seg = large_segments[jobs[k]]
+        # LLM応答キャッシュと同じく、成功した分割だけ記録（失敗は --resume で呼び直す）
+        if not split_failed(small_segs):
+            journal.append({
+                "type": "split",
+                "key": split_cache_key(large_seg, args.claude_model),
+                "start": large_seg['start'],
+                "end": large_seg['end'],
+                "segments": small_segs,
+            })
         time_str = f"{format_time(large_seg['start'])}-{format_time(large_seg['end'])}"
-        print(f"  [{i+1}/{len(large_segments)}] {time_str} ({large_seg['duration']:.0f}s)...", end=' ', flush=True)
+        print(f"  [{done}/{len(jobs)}] {time_str} ({large_seg['duration']:.0f}s)... {len(small_segs)}分割")
 
-        if large_seg['duration'] < 30:
-            # 短すぎる場合は分割せず
-            small_segs = [{'start': large_seg['start'], 'end': large_seg['end'], 'topic': '短セグメント'}]
-            print("skip (短い)")
-        else:
-            small_segs = split_with_claude(large_seg, model=args.claude_model)
-            print(f"{len(small_segs)}分割")
+    split_results = LLMExecutor(args.concurrency, args.rpm).map(
+        lambda i: split_with_claude(large_segments[i], model=args.claude_model, cache=cache), jobs, on_done
+    )
+    splits.update(zip(jobs, split_results))
+    if cache is not None:
+        print(f"  LLM応答キャッシュ: {cache.hits}件ヒット")
+        cache.close()
+
+    # 大セグメント順に小セグメントを並べる
+    all_small_segments = []
+    for i, large_seg in enumerate(large_segments):
+        # 短すぎる場合は分割せず
+        small_segs = splits.get(i, [{'start': large_seg['start'], 'end': large_seg['end'], 'topic': '短セグメント'}])
 
         for j, ss in enumerate(small_segs):
             all_small_segments.append({
@@ -263,9 +314,6 @@ def main():
                 'text': ''  # 後でマッピング可能
             })
 
-        if i < len(large_segments) - 1 and large_seg['duration'] >= 30:
-            time.sleep(args.delay)
-
     # 結果保存
     output_name = input_path.stem + '-segments-claude'
     segments_path = output_dir / f"{output_name}.json"
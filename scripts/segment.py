@@ -5,141 +5,145 @@
 """
 
 import argparse
-import gc
 import json
+from bisect import bisect_right
 from pathlib import Path
 
-import mlx.core as mx
 import numpy as np
 
-
-def load_model(model_path: str):
-    """MLX embeddingモデルを読み込み"""
-    from mlx_embeddings.utils import load
-    return load(model_path)
-
-
-def encode_texts(model, tokenizer, texts: list[str], batch_size: int = 4) -> np.ndarray:
-    """
-    テキストをバッチ処理でembeddingに変換
-    メモリ管理のため小バッチで処理し、各バッチ後にキャッシュクリア
-    """
-    all_embeddings = []
-
-    for i in range(0, len(texts), batch_size):
-        batch_texts = texts[i:i + batch_size]
-
-        inputs = tokenizer._tokenizer(
-            batch_texts,
-            return_tensors='np',
-            padding=True,
-            truncation=True,
-            max_length=128
-        )
-
-        input_ids = mx.array(inputs['input_ids'])
-        attention_mask = mx.array(inputs['attention_mask'])
-
-        outputs = model(input_ids=input_ids, attention_mask=attention_mask)
-        embeddings = outputs.text_embeds
-
-        all_embeddings.append(np.array(embeddings))
-
-        del input_ids, attention_mask, outputs, embeddings
-        mx.clear_cache()
-        gc.collect()
-
-    return np.vstack(all_embeddings)
-
-
-def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
-    """コサイン類似度を計算"""
-    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
-
-
-def detect_boundaries_in_range(
-    embeddings: np.ndarray,
-    start_idx: int,
-    end_idx: int,
-    threshold: float
-) -> list[int]:
-    """
-    指定範囲内で境界を検出
-    戻り値: 境界となるインデックスのリスト（絶対インデックス）
-    """
-    boundaries = []
-    for i in range(start_idx + 1, end_idx):
-        sim = cosine_similarity(embeddings[i - 1], embeddings[i])
-        if sim < threshold:
-            boundaries.append(i)
-    return boundaries
+from asr_store import load_asr
+from embedding import (
+    DEFAULT_CACHE_LIMIT_MB,
+    DEFAULT_EMBEDDING_BACKEND,
+    DEFAULT_TOKEN_BUDGET,
+    EMBEDDING_BACKENDS,
+    create_embedding_backend,
+    embed_sentences,
+)
+from embedding_cache import DEFAULT_EMBEDDING_CACHE_DIR, DEFAULT_MAX_MB, EmbeddingCache
+from segment_core import (
+    DEFAULT_WINDOWS,
+    adjacent_similarities,
+    boundaries_to_spans,
+    boundary_curve,
+    hierarchical_boundaries,
+    optimal_boundaries,
+    pack_sentences,
+    packed_sentences,
+    sweep_thresholds,
+)
+
+
+def build_segments(
+    sentences: list[dict],
+    large_boundaries,
+    small_boundaries
+) -> list[dict]:
+    """境界インデックスから小セグメントを作る（所属する大セグメントは開始位置から求める）"""
+    n = len(sentences)
+    large_spans = boundaries_to_spans(large_boundaries, n)
+    large_starts = [start for start, _ in large_spans]
+
+    segments = []
+    for small_start, small_end in boundaries_to_spans(small_boundaries, n):
+        segment_sentences = sentences[small_start:small_end]
+        if not segment_sentences:
+            continue
+
+        i = bisect_right(large_starts, small_start) - 1
+        large_start, large_end = large_spans[i]
+        text = ''.join(s['text'] for s in segment_sentences)
+        start_time = segment_sentences[0]['start']
+        end_time = segment_sentences[-1]['end']
+
+        segments.append({
+            'large_segment_index': i,
+            'large_segment_start': sentences[large_start]['start'],
+            'large_segment_end': sentences[large_end - 1]['end'],
+            'index': len(segments),
+            'start': start_time,
+            'end': end_time,
+            'duration': end_time - start_time,
+            'text': text.strip(),
+            'sentence_start_idx': small_start,
+            'sentence_end_idx': small_end
+        })
+    return segments
 
 
 def hierarchical_segmentation(
     embeddings: np.ndarray,
     sentences: list[dict],
     large_threshold: float = 0.3,
-    small_threshold: float = 0.6
+    small_threshold: float = 0.6,
+    similarities: np.ndarray | None = None
 ) -> list[dict]:
     """
     階層的セグメント検出
     1. 大セグメント検出（話題の大枠）
     2. 各大セグメント内で小セグメント検出
+    類似度は一度だけ計算し、両方の閾値で使い回す（similarities省略時は隣接類似度）
     """
-    n = len(embeddings)
-
-    # Step 1: 大セグメント境界検出
-    large_boundaries = detect_boundaries_in_range(embeddings, 0, n, large_threshold)
-    large_boundary_indices = [0] + large_boundaries + [n]
-
-    print(f"  大セグメント: {len(large_boundary_indices) - 1}個（閾値{large_threshold}）")
-
-    # Step 2: 各大セグメント内で小セグメント検出
-    all_small_segments = []
-
-    for i in range(len(large_boundary_indices) - 1):
-        large_start = large_boundary_indices[i]
-        large_end = large_boundary_indices[i + 1]
-
-        # 大セグメント情報
-        large_start_time = sentences[large_start]['start']
-        large_end_time = sentences[large_end - 1]['end']
-
-        # 大セグメント内で小セグメント検出
-        small_boundaries = detect_boundaries_in_range(
-            embeddings, large_start, large_end, small_threshold
-        )
-        small_boundary_indices = [large_start] + small_boundaries + [large_end]
-
-        # 小セグメント生成
-        for j in range(len(small_boundary_indices) - 1):
-            small_start = small_boundary_indices[j]
-            small_end = small_boundary_indices[j + 1]
-
-            segment_sentences = sentences[small_start:small_end]
-            if not segment_sentences:
-                continue
-
-            text = ''.join(s['text'] for s in segment_sentences)
-            start_time = segment_sentences[0]['start']
-            end_time = segment_sentences[-1]['end']
+    if similarities is None:
+        similarities = adjacent_similarities(embeddings)
+    large_boundaries, small_boundaries = hierarchical_boundaries(
+        similarities, large_threshold, small_threshold
+    )
+    print(f"  大セグメント: {len(large_boundaries) + 1}個（閾値{large_threshold}）")
 
-            all_small_segments.append({
-                'large_segment_index': i,
-                'large_segment_start': large_start_time,
-                'large_segment_end': large_end_time,
-                'index': len(all_small_segments),
-                'start': start_time,
-                'end': end_time,
-                'duration': end_time - start_time,
-                'text': text.strip(),
-                'sentence_start_idx': small_start,
-                'sentence_end_idx': small_end
-            })
+    segments = build_segments(sentences, large_boundaries, small_boundaries)
+    print(f"  小セグメント: {len(segments)}個（閾値{small_threshold}）")
+    return segments
 
-    print(f"  小セグメント: {len(all_small_segments)}個（閾値{small_threshold}）")
 
-    return all_small_segments
+def dp_segmentation(
+    embeddings: np.ndarray,
+    sentences: list[dict],
+    large_threshold: float = 0.3,
+    min_duration: float = 15.0,
+    max_duration: float = 60.0,
+    penalty_scale: float = 1.0,
+    similarities: np.ndarray | None = None
+) -> list[dict]:
+    """
+    長さ制約つき最適分割（動的計画法）
+    小セグメントは min_duration〜max_duration に収まるように決め、
+    そのうち隣接類似度が大セグメント閾値未満の境界で大セグメントを区切る
+    """
+    starts = np.array([s['start'] for s in sentences])
+    ends = np.array([s['end'] for s in sentences])
+    small_boundaries = optimal_boundaries(
+        embeddings, starts, ends,
+        min_duration=min_duration,
+        max_duration=max_duration,
+        penalty_scale=penalty_scale
+    )
+    if similarities is None:
+        similarities = adjacent_similarities(embeddings)
+    large_boundaries = small_boundaries[similarities[small_boundaries - 1] < large_threshold]
+    print(f"  大セグメント: {len(large_boundaries) + 1}個（閾値{large_threshold}）")
+
+    segments = build_segments(sentences, large_boundaries, small_boundaries)
+    durations = np.array([s['duration'] for s in segments])
+    in_range = int(((durations >= min_duration) & (durations <= max_duration)).sum())
+    print(f"  小セグメント: {len(segments)}個（{min_duration:.0f}〜{max_duration:.0f}秒: {in_range}個）")
+    return segments
+
+
+def print_sweep(rows: list[dict], min_duration: float, max_duration: float) -> None:
+    """スイープ結果の表（適正長の件数が最大の組み合わせに*）"""
+    best = max(rows, key=lambda r: r['in_range'])
+    short = f"<{min_duration:.0f}s"
+    ok = f"{min_duration:.0f}-{max_duration:.0f}s"
+    long = f">{max_duration:.0f}s"
+    print(f"\n[閾値スイープ]（適正: {min_duration:.0f}〜{max_duration:.0f}秒）")
+    print(f"   {'大':>5} {'小':>5} | {'大セグ':>4} | {'小セグ':>4} | {short:>6} | {ok:>7} | {long:>6} | 中央値")
+    print("-" * 70)
+    for r in rows:
+        mark = '*' if r is best else ' '
+        print(f" {mark} {r['large_threshold']:5.2f} {r['small_threshold']:5.2f} | {r['large_segments']:6d} | "
+              f"{r['small_segments']:6d} | {r['too_short']:6d} | {r['in_range']:7d} | {r['too_long']:6d} | "
+              f"{r['median_duration']:5.0f}s")
 
 
 def main():
@@ -147,14 +151,50 @@ def main():
     parser.add_argument('input', help='ASR結果JSONファイル')
     parser.add_argument('-o', '--output', default='output', help='出力ディレクトリ')
     parser.add_argument('-m', '--model',
-                        default='./models/paraphrase-multilingual-MiniLM-L12-v2-mlx',
-                        help='MLX embeddingモデルパス')
+                        help=f"embeddingモデル (default: mlx={EMBEDDING_BACKENDS['mlx'].default_model}, "
+                             f"cpu={EMBEDDING_BACKENDS['cpu'].default_model})")
+    parser.add_argument('--embedding-backend', choices=list(EMBEDDING_BACKENDS), default=DEFAULT_EMBEDDING_BACKEND,
+                        help=f'embeddingバックエンド: mlx=Apple Silicon / cpu=sentence-transformers (default: {DEFAULT_EMBEDDING_BACKEND})')
     parser.add_argument('-t', '--threshold', type=float, default=0.3,
                         help='大セグメント検出の類似度閾値 (default: 0.3)')
     parser.add_argument('--small-threshold', type=float, default=0.6,
                         help='小セグメント検出の類似度閾値 (default: 0.6)')
-    parser.add_argument('-b', '--batch-size', type=int, default=4,
-                        help='バッチサイズ (default: 4)')
+    parser.add_argument('--similarity', choices=['adjacent', 'window'], default='adjacent',
+                        help='境界の判定: adjacent=隣接文の類似度 / window=前後の窓平均の類似度の谷（短い相槌に強い） (default: adjacent)')
+    parser.add_argument('--windows', type=int, nargs='+', default=list(DEFAULT_WINDOWS),
+                        help=f"windowで使う窓幅（文数） (default: {' '.join(map(str, DEFAULT_WINDOWS))})")
+    parser.add_argument('--min-depth', type=float, default=0.0,
+                        help='windowで境界候補にする谷の最小depth score (default: 0.0)')
+    parser.add_argument('--method', choices=['threshold', 'dp'], default='threshold',
+                        help='小セグメントの決め方: threshold=類似度閾値 / dp=長さ制約つき最適分割 (default: threshold)')
+    parser.add_argument('--penalty-scale', type=float, default=1.0,
+                        help='dp法の区間ペナルティの倍率。大きいほどセグメントが長くなる (default: 1.0)')
+    parser.add_argument('--sweep', action='store_true',
+                        help='閾値の組み合わせを一括評価して表を出力（embeddingは1回だけ）')
+    parser.add_argument('--sweep-large', type=float, nargs='+', default=[0.1, 0.2, 0.3, 0.4, 0.5],
+                        help='スイープする大セグメント閾値 (default: 0.1 0.2 0.3 0.4 0.5)')
+    parser.add_argument('--sweep-small', type=float, nargs='+', default=[0.4, 0.5, 0.6, 0.7, 0.8],
+                        help='スイープする小セグメント閾値 (default: 0.4 0.5 0.6 0.7 0.8)')
+    parser.add_argument('--min-duration', type=float, default=15,
+                        help='適正とみなす最短セグメント長（秒）。スイープの集計とdp法の制約 (default: 15)')
+    parser.add_argument('--max-duration', type=float, default=60,
+                        help='適正とみなす最長セグメント長（秒）。スイープの集計とdp法の制約 (default: 60)')
+    parser.add_argument('--sweep-write', action='store_true',
+                        help='スイープ後、-t / --small-threshold の組み合わせでセグメントJSONも出力')
+    parser.add_argument('--pack-chars', type=int, default=0,
+                        help='連続する短い文をこの文字数までまとめてembedding（0で無効） (default: 0)')
+    parser.add_argument('--pack-duration', type=float, default=10.0,
+                        help='まとめる窓の最大長（秒） (default: 10.0)')
+    parser.add_argument('--no-embedding-cache', action='store_true',
+                        help='embeddingキャッシュを使わない')
+    parser.add_argument('--embedding-cache-dir', type=Path, default=DEFAULT_EMBEDDING_CACHE_DIR,
+                        help=f'embeddingキャッシュの場所 (default: {DEFAULT_EMBEDDING_CACHE_DIR})')
+    parser.add_argument('--embedding-cache-max-mb', type=float, default=DEFAULT_MAX_MB,
+                        help=f'モデルごとのembeddingキャッシュ容量上限（MB） (default: {DEFAULT_MAX_MB})')
+    parser.add_argument('--token-budget', type=int, default=DEFAULT_TOKEN_BUDGET,
+                        help=f'embeddingの1バッチのトークン数上限（文数×最長トークン数） (default: {DEFAULT_TOKEN_BUDGET})')
+    parser.add_argument('--cache-limit-mb', type=float, default=DEFAULT_CACHE_LIMIT_MB,
+                        help=f'MLXキャッシュがこれを超えたらクリア（MB） (default: {DEFAULT_CACHE_LIMIT_MB})')
     args = parser.parse_args()
 
     input_path = Path(args.input)
@@ -162,48 +202,110 @@ def main():
     output_dir.mkdir(parents=True, exist_ok=True)
 
     # ASR結果読み込み
-    print(f"[1/4] ASR結果を読み込み: {input_path}")
-    with open(input_path) as f:
-        asr_data = json.load(f)
+    print(f"[1/3] ASR結果を読み込み: {input_path}")
+    transcript = load_asr(input_path)
 
-    sentences = asr_data['sentences']
+    sentences = transcript.sentence_dicts()
     print(f"  ASRセグメント数: {len(sentences)}")
 
-    # モデル読み込み
-    print(f"[2/4] モデルを読み込み: {args.model}")
-    model, tokenizer = load_model(args.model)
-
-    # embedding生成
-    print(f"[3/4] embedding生成中...")
-    texts = [s['text'] for s in sentences]
-    embeddings = encode_texts(model, tokenizer, texts, batch_size=args.batch_size)
+    # 短い文をまとめた窓を以降の単位にする（境界は最後に文インデックスへ戻す）
+    spans = None
+    units = sentences
+    if args.pack_chars > 0:
+        spans = pack_sentences(sentences, args.pack_chars, args.pack_duration)
+        units = packed_sentences(sentences, spans)
+        print(f"  窓にまとめた数: {len(units)}（{args.pack_chars}文字・{args.pack_duration:.0f}秒以内）")
+
+    # embedding生成（キャッシュにない文だけモデルで計算）
+    backend = create_embedding_backend(args.embedding_backend, args.model)
+    print(f"[2/3] embedding生成中: {backend.model_path} ({backend.name})")
+    texts = [s['text'] for s in units]
+    cache = None if args.no_embedding_cache else EmbeddingCache(
+        backend.model_path, args.embedding_cache_dir, args.embedding_cache_max_mb
+    )
+    embeddings = embed_sentences(
+        backend, texts,
+        token_budget=args.token_budget,
+        cache_limit_mb=args.cache_limit_mb,
+        cache=cache
+    )
     print(f"  Shape: {embeddings.shape}")
 
-    # モデル解放
-    del model, tokenizer
-    mx.clear_cache()
-    gc.collect()
-
-    # 階層的セグメント検出
-    print(f"[4/4] 階層的セグメント検出中...")
-    segments = hierarchical_segmentation(
-        embeddings, sentences,
-        large_threshold=args.threshold,
-        small_threshold=args.small_threshold
+    # 境界判定用の類似度（両方の閾値・スイープで共通）
+    similarities, depths = boundary_curve(
+        embeddings, args.similarity, windows=args.windows, min_depth=args.min_depth
     )
 
+    # 閾値スイープ
+    if args.sweep:
+        rows = sweep_thresholds(
+            similarities,
+            np.array([s['start'] for s in units]),
+            np.array([s['end'] for s in units]),
+            args.sweep_large, args.sweep_small,
+            min_duration=args.min_duration,
+            max_duration=args.max_duration
+        )
+        print_sweep(rows, args.min_duration, args.max_duration)
+        if not args.sweep_write:
+            return
+        print(f"\n-t {args.threshold} --small-threshold {args.small_threshold} でセグメントを出力")
+
+    if args.method == 'dp':
+        # 長さ制約つき最適分割
+        print(f"[3/3] 最適分割中（{args.min_duration:.0f}〜{args.max_duration:.0f}秒）...")
+        segments = dp_segmentation(
+            embeddings, units,
+            large_threshold=args.threshold,
+            min_duration=args.min_duration,
+            max_duration=args.max_duration,
+            penalty_scale=args.penalty_scale,
+            similarities=similarities
+        )
+    else:
+        # 階層的セグメント検出
+        print(f"[3/3] 階層的セグメント検出中...")
+        segments = hierarchical_segmentation(
+            embeddings, units,
+            large_threshold=args.threshold,
+            small_threshold=args.small_threshold,
+            similarities=similarities
+        )
+
+    # 各セグメント先頭の境界のdepth score（windowのみ）
+    if depths is not None:
+        for seg in segments:
+            i = seg['sentence_start_idx']
+            seg['boundary_depth'] = round(float(depths[i - 1]), 4) if i > 0 else None
+
+    # 窓インデックス → 文インデックス
+    if spans is not None:
+        for seg in segments:
+            seg['sentence_start_idx'] = spans[seg['sentence_start_idx']][0]
+            seg['sentence_end_idx'] = spans[seg['sentence_end_idx'] - 1][1]
+
     # 結果保存
     output_name = input_path.stem + '-segments'
     segments_path = output_dir / f"{output_name}.json"
 
     result = {
         'source': str(input_path),
+        'method': args.method,
+        'similarity': args.similarity,
         'large_threshold': args.threshold,
-        'small_threshold': args.small_threshold,
+        'small_threshold': args.small_threshold if args.method == 'threshold' else None,
         'total_asr_segments': len(sentences),
+        'pack_chars': args.pack_chars,
+        'total_embedding_units': len(units),
         'total_small_segments': len(segments),
         'segments': segments
     }
+    if args.similarity == 'window':
+        result['windows'] = args.windows
+        result['min_depth'] = args.min_depth
+    if args.method == 'dp':
+        result['min_duration'] = args.min_duration
+        result['max_duration'] = args.max_duration
 
     with open(segments_path, 'w', encoding='utf-8') as f:
         json.dump(result, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,265 @@
+"""
+話題区切りの共通処理（segment.py / segment-with-claude.py）
+埋め込み行列を一度だけ正規化し、隣接文（または前後の窓）の類似度ベクトルから境界をまとめて求める
+"""
+
+import numpy as np
+
+
+def normalize_embeddings(embeddings: np.ndarray) -> np.ndarray:
+    """
+    行ごとにL2正規化（ゼロベクトルはそのまま）
+    int8（embedding.quantize_rows の行列）もそのまま渡せる（行ごとのスケールは正規化で消える）
+    """
+    if embeddings.dtype == np.int8:
+        embeddings = embeddings.astype(np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.where(norms == 0, 1, norms)
+
+
+def adjacent_similarities(embeddings: np.ndarray) -> np.ndarray:
+    """
+    隣接文のコサイン類似度
+    戻り値[i] = cos(embeddings[i], embeddings[i + 1])（長さ n - 1）
+    int8行列は整数のまま内積・ノルムを取る（正規化した浮動小数の行列を作らない）
+    """
+    if embeddings.dtype == np.int8:
+        quantized = embeddings.astype(np.int32)
+        dots = np.einsum("ij,ij->i", quantized[:-1], quantized[1:])
+        norms = np.sqrt(np.einsum("ij,ij->i", quantized, quantized))
+        norm = norms[:-1] * norms[1:]
+        return dots / np.where(norm == 0, 1, norm)
+    normed = normalize_embeddings(embeddings)
+    return np.einsum("ij,ij->i", normed[:-1], normed[1:])
+
+
+# 窓つき類似度で使う窓幅（文数）
+DEFAULT_WINDOWS = (2, 4, 8)
+
+
+def window_similarities(embeddings: np.ndarray, windows=DEFAULT_WINDOWS) -> np.ndarray:
+    """
+    TextTiling風の窓つき類似度（複数の窓幅の平均）
+    境界iの前後w文ずつの平均ベクトルどうしのコサイン類似度。接頭辞和で全境界をO(n)で計算
+    戻り値[i] は文iと文i+1の間（adjacent_similaritiesと同じ並び）
+    """
+    n = len(embeddings)
+    normed = normalize_embeddings(embeddings)
+    prefix = np.zeros((n + 1, normed.shape[1]), dtype=np.float64)
+    np.cumsum(normed, axis=0, out=prefix[1:])
+    gaps = np.arange(1, n)
+
+    curves = []
+    for w in windows:
+        left = prefix[gaps] - prefix[np.maximum(gaps - w, 0)]
+        right = prefix[np.minimum(gaps + w, n)] - prefix[gaps]
+        dot = np.einsum("ij,ij->i", left, right)
+        norm = np.linalg.norm(left, axis=1) * np.linalg.norm(right, axis=1)
+        curves.append(dot / np.where(norm == 0, 1, norm))
+    return np.mean(curves, axis=0)
+
+
+def depth_scores(similarities: np.ndarray) -> np.ndarray:
+    """
+    TextTilingのdepth score: 各境界から左右それぞれ類似度が上がり続ける限り登った山の高さとの差の和
+    谷が深いほど大きい
+    """
+    n = len(similarities)
+    left_peak = similarities.copy()
+    right_peak = similarities.copy()
+    for i in range(1, n):
+        if similarities[i - 1] >= similarities[i]:
+            left_peak[i] = left_peak[i - 1]
+    for i in range(n - 2, -1, -1):
+        if similarities[i + 1] >= similarities[i]:
+            right_peak[i] = right_peak[i + 1]
+    return (left_peak - similarities) + (right_peak - similarities)
+
+
+def boundary_curve(
+    embeddings: np.ndarray,
+    similarity: str = "adjacent",
+    windows=DEFAULT_WINDOWS,
+    min_depth: float = 0.0
+) -> tuple[np.ndarray, np.ndarray | None]:
+    """
+    境界判定に使う類似度ベクトル（閾値未満の位置が境界）
+    similarity="adjacent": 隣接文の類似度
+    similarity="window": 窓つき類似度の谷底（depth >= min_depth の極小点）だけを候補にし、それ以外は境界にしない
+    戻り値: (類似度, depth score（windowのときのみ）)
+    """
+    if similarity == "adjacent":
+        return adjacent_similarities(embeddings), None
+
+    curve = window_similarities(embeddings, windows)
+    depths = depth_scores(curve)
+    previous = np.concatenate(([np.inf], curve[:-1]))
+    following = np.concatenate((curve[1:], [np.inf]))
+    valleys = (curve < previous) & (curve <= following) & (depths >= min_depth)
+    return np.where(valleys, curve, np.inf), depths
+
+
+def pack_sentences(sentences: list[dict], max_chars: int, max_duration: float) -> list[tuple[int, int]]:
+    """
+    連続する短い文を、文字数 max_chars・長さ max_duration 秒以内の窓にまとめる（embeddingの前処理）
+    1文で予算を超える場合はその文だけの窓にする
+    戻り値: 窓ごとの [開始, 終了) の文インデックス区間
+    """
+    spans = []
+    start = 0
+    chars = 0
+    for i, sentence in enumerate(sentences):
+        length = len(sentence["text"])
+        if i > start and (
+            chars + length > max_chars
+            or sentence["end"] - sentences[start]["start"] > max_duration
+        ):
+            spans.append((start, i))
+            start, chars = i, 0
+        chars += length
+    if sentences:
+        spans.append((start, len(sentences)))
+    return spans
+
+
+def packed_sentences(sentences: list[dict], spans: list[tuple[int, int]]) -> list[dict]:
+    """窓を1文として扱うための辞書（text / start / end）"""
+    return [
+        {
+            "text": "".join(s["text"] for s in sentences[start:end]),
+            "start": sentences[start]["start"],
+            "end": sentences[end - 1]["end"],
+        }
+        for start, end in spans
+    ]
+
+
+def threshold_boundaries(similarities: np.ndarray, threshold: float) -> np.ndarray:
+    """類似度が閾値未満の位置を境界（後ろ側の文インデックス）として返す"""
+    return np.flatnonzero(similarities < threshold) + 1
+
+
+def hierarchical_boundaries(
+    similarities: np.ndarray,
+    large_threshold: float,
+    small_threshold: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    大セグメント境界と小セグメント境界を同じ類似度ベクトルから求める
+    小セグメントは大セグメント内をさらに分割したものなので、大セグメント境界も含む
+    戻り値: (大セグメント境界, 小セグメント境界)。先頭0・末尾nは含まない
+    """
+    large_mask = similarities < large_threshold
+    small_mask = large_mask | (similarities < small_threshold)
+    return np.flatnonzero(large_mask) + 1, np.flatnonzero(small_mask) + 1
+
+
+def boundaries_to_spans(boundaries, n: int) -> list[tuple[int, int]]:
+    """境界インデックスを [開始, 終了) の区間リストに変換"""
+    edges = [0, *(int(b) for b in boundaries), n]
+    return [(edges[i], edges[i + 1]) for i in range(len(edges) - 1)]
+
+
+def sweep_thresholds(
+    similarities: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    large_values,
+    small_values,
+    min_duration: float = 15.0,
+    max_duration: float = 60.0
+) -> list[dict]:
+    """
+    (大, 小)閾値の全組み合わせについて、セグメント数と小セグメント長の分布を求める
+    小セグメント境界は max(大, 小) 未満の位置なので、実効閾値ごとのマスクを1つの行列でまとめて計算する
+    starts / ends: 文の開始・終了秒
+    """
+    n = len(starts)
+    large_values = np.asarray(large_values, dtype=float)
+    small_values = np.asarray(small_values, dtype=float)
+    grid_large, grid_small = np.meshgrid(large_values, small_values, indexing="ij")
+    effective, inverse = np.unique(np.maximum(grid_large, grid_small).ravel(), return_inverse=True)
+
+    small_masks = similarities[None, :] < effective[:, None]
+    large_counts = (similarities[None, :] < large_values[:, None]).sum(axis=1) + 1
+
+    # 実効閾値ごとの小セグメント長
+    distributions = []
+    for mask in small_masks:
+        boundaries = np.flatnonzero(mask) + 1
+        first = np.concatenate(([0], boundaries))
+        last = np.concatenate((boundaries - 1, [n - 1]))
+        durations = ends[last] - starts[first]
+        distributions.append({
+            "small_segments": len(durations),
+            "too_short": int((durations < min_duration).sum()),
+            "in_range": int(((durations >= min_duration) & (durations <= max_duration)).sum()),
+            "too_long": int((durations > max_duration).sum()),
+            "median_duration": float(np.median(durations)),
+        })
+
+    rows = []
+    for (i, j), k in zip(np.ndindex(grid_large.shape), inverse):
+        rows.append({
+            "large_threshold": float(large_values[i]),
+            "small_threshold": float(small_values[j]),
+            "large_segments": int(large_counts[i]),
+            **distributions[k],
+        })
+    return rows
+
+
+# 最短長を下回った区間への1秒あたりのペナルティ（制約をほぼ必ず満たすよう大きく取る）
+DP_SHORT_PENALTY = 10.0
+
+
+def optimal_boundaries(
+    embeddings: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    min_duration: float = 15.0,
+    max_duration: float = 60.0,
+    penalty_scale: float = 1.0
+) -> np.ndarray:
+    """
+    区間内のまとまりが最大になる分割を動的計画法で求める
+    区間 [i, j) のスコア = |Σ e|² / 長さ（正規化embeddingの接頭辞和から O(1)）から、区間ごとのペナルティを引いたもの
+    ペナルティ (1 - 全文の平均類似度) は、ランダムな並びなら分割しても得をしない大きさ。penalty_scaleで粒度を調整
+    長さ max_duration を超える区間は作らず（1文で超える場合を除く）、min_duration 未満の区間は短い分だけ減点
+    候補の開始位置は max_duration 以内に限られるので O(n・k)（k: max_duration 内の文数）
+    戻り値: 境界インデックス（先頭0・末尾nは含まない）
+    """
+    n = len(embeddings)
+    normed = normalize_embeddings(embeddings).astype(np.float64)
+    prefix = np.zeros((n + 1, normed.shape[1]))
+    np.cumsum(normed, axis=0, out=prefix[1:])
+    total = prefix[-1]
+    mean_similarity = (total @ total - n) / (n * (n - 1)) if n > 1 else 0.0
+    penalty = (1.0 - mean_similarity) * penalty_scale
+
+    best = np.full(n + 1, -np.inf)
+    best[0] = 0.0
+    back = np.zeros(n + 1, dtype=np.int64)
+    for j in range(1, n + 1):
+        end_time = ends[j - 1]
+        lo = min(int(np.searchsorted(starts, end_time - max_duration, side="left")), j - 1)
+        sums = prefix[j] - prefix[lo:j]
+        lengths = np.arange(j - lo, 0, -1)
+        shortfall = np.maximum(min_duration - (end_time - starts[lo:j]), 0.0)
+        scores = (
+            best[lo:j]
+            + np.einsum("ij,ij->i", sums, sums) / lengths
+            - penalty
+            - DP_SHORT_PENALTY * shortfall
+        )
+        k = int(np.argmax(scores))
+        best[j] = scores[k]
+        back[j] = lo + k
+
+    boundaries = []
+    j = n
+    while j > 0:
+        j = int(back[j])
+        if j > 0:
+            boundaries.append(j)
+    return np.array(boundaries[::-1], dtype=np.int64)
@@ -0,0 +1,175 @@
+"""
+ほぼ同じ内容のセグメント（CM明けの振り返り、毎回の提供読み・挨拶など）の検出
+文字n-gramのMinHash + LSHで候補ペアを作り、推定Jaccard係数と（あれば）embedding重心のコサイン類似度で確認する
+スコアリング（score.py / score-with-claude.py）は各クラスタの代表（最も早いもの）だけをLLMで評価し、
+重複側には代表の結果をコピーして duplicate_of で代表を指す
+"""
+
+import zlib
+
+import numpy as np
+
+from embedding import embed_sentences
+from segment_core import normalize_embeddings
+
+# 文字n-gramの長さ
+NGRAM = 3
+# MinHashの署名長と、LSHのバンド数（1バンド = NUM_PERM / LSH_BANDS 行）
+NUM_PERM = 64
+LSH_BANDS = 16
+DEFAULT_JACCARD = 0.6
+DEFAULT_COSINE = 0.9
+_PRIME = (1 << 31) - 1
+
+
+def char_ngrams(text: str, n: int = NGRAM) -> set[str]:
+    """空白を除いた文字n-gram（n文字未満のテキストは空）"""
+    text = "".join(text.split())
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def minhash_signatures(texts: list[str], num_perm: int = NUM_PERM, seed: int = 0) -> np.ndarray:
+    """
+    各テキストのMinHash署名（len(texts) × num_perm）
+    n-gramをcrc32で整数にし、(a・x + b) mod p の num_perm 通りのハッシュの最小値を取る
+    n-gramのないテキストは全列 p（他と一致しない扱いは find_representatives 側で行う）
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, _PRIME, size=num_perm, dtype=np.uint64)
+    signatures = np.full((len(texts), num_perm), _PRIME, dtype=np.uint64)
+    for i, text in enumerate(texts):
+        grams = char_ngrams(text)
+        if not grams:
+            continue
+        x = np.array([zlib.crc32(g.encode("utf-8")) for g in grams], dtype=np.uint64) % _PRIME
+        signatures[i] = ((x[:, None] * a[None, :] + b[None, :]) % _PRIME).min(axis=0)
+    return signatures
+
+
+def lsh_candidates(signatures: np.ndarray, bands: int = LSH_BANDS) -> set[tuple[int, int]]:
+    """署名をバンドに分け、どれかのバンドが完全一致するペア (i < j) を候補にする"""
+    rows = signatures.shape[1] // bands
+    candidates = set()
+    for band in range(bands):
+        buckets = {}
+        for i, key in enumerate(map(bytes, signatures[:, band * rows:(band + 1) * rows])):
+            buckets.setdefault(key, []).append(i)
+        for members in buckets.values():
+            for k, i in enumerate(members):
+                for j in members[k + 1:]:
+                    candidates.add((i, j))
+    return candidates
+
+
+def segment_centroids(
+    sentences: list[dict],
+    embeddings: np.ndarray,
+    starts,
+    ends
+) -> np.ndarray:
+    """
+    セグメントごとの重心（中点が [start, end) に入る文の正規化embeddingの平均、正規化済み）
+    接頭辞和で各セグメントO(1)。文のないセグメントはゼロベクトル
+    """
+    normed = normalize_embeddings(embeddings)
+    prefix = np.zeros((len(normed) + 1, normed.shape[1]))
+    np.cumsum(normed, axis=0, out=prefix[1:])
+    mids = np.array([(s["start"] + s["end"]) / 2 for s in sentences])
+    lo = np.searchsorted(mids, starts, side="left")
+    hi = np.searchsorted(mids, ends, side="left")
+    return normalize_embeddings(prefix[hi] - prefix[lo])
+
+
+def find_representatives(
+    texts: list[str],
+    centroids: np.ndarray | None = None,
+    jaccard_threshold: float = DEFAULT_JACCARD,
+    cosine_threshold: float = DEFAULT_COSINE
+) -> list[int]:
+    """
+    重複クラスタの代表を求める
+    LSH候補のうち、推定Jaccard係数 >= jaccard_threshold かつ
+    （centroidsがあれば）重心のコサイン類似度 >= cosine_threshold のペアを同じクラスタにする
+    戻り値[i]: セグメントiの代表のインデックス（クラスタ内で最小。代表自身はi）
+    """
+    signatures = minhash_signatures(texts)
+    empty = np.all(signatures == _PRIME, axis=1)
+    parent = list(range(len(texts)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in sorted(lsh_candidates(signatures)):
+        if empty[i] or empty[j]:
+            continue
+        if np.mean(signatures[i] == signatures[j]) < jaccard_threshold:
+            continue
+        if centroids is not None and float(centroids[i] @ centroids[j]) < cosine_threshold:
+            continue
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+    return [find(i) for i in range(len(texts))]
+
+
+def find_duplicate_segments(
+    segments: list[dict],
+    texts: list[str],
+    transcript=None,
+    jaccard_threshold: float = DEFAULT_JACCARD,
+    cosine_threshold: float = DEFAULT_COSINE,
+    embedding_backend=None,
+    cache=None
+) -> list[int]:
+    """
+    スコアリング対象のセグメントの重複クラスタの代表（find_representatives参照）
+    transcript（ASRTranscript）とembedding_backendがあり cosine_threshold > 0 なら、
+    ASRの文embeddingからセグメントの重心を作って確認に使う
+    cache: EmbeddingCache（segment.pyと同じ場所・モデルなら文embeddingを再利用）。Noneならキャッシュしない
+    """
+    centroids = None
+    if transcript is not None and embedding_backend is not None and cosine_threshold > 0:
+        sentences = transcript.sentence_dicts()
+        embeddings = embed_sentences(
+            embedding_backend, [s["text"] for s in sentences],
+            cache=cache
+        )
+        centroids = segment_centroids(
+            sentences, embeddings,
+            [seg["start"] for seg in segments],
+            [seg["end"] for seg in segments]
+        )
+    return find_representatives(texts, centroids, jaccard_threshold, cosine_threshold)
+
+
+def _format_time(seconds: float) -> str:
+    return f"{int(seconds // 60):02d}:{int(seconds % 60):02d}"
+
+
+def copy_duplicate_result(representative: dict, segment: dict) -> dict:
+    """
+    代表のスコア結果を重複セグメントに写す
+    切り抜き区間は代表のセグメント開始からのずれを保ったまま、このセグメントの時刻にずらす
+    """
+    result = {
+        **representative,
+        "large_segment_index": segment.get("large_segment_index", 0),
+        "segment_index": segment["index"],
+        "segment_start": segment["start"],
+        "segment_end": segment["end"],
+        "segment_duration": segment["duration"],
+        "duplicate_of": representative["segment_index"],
+    }
+    if "topic" in segment:
+        result["topic"] = segment["topic"]
+    if representative["clip_start_sec"] and representative["clip_end_sec"]:
+        offset = segment["start"] - representative["segment_start"]
+        result["clip_start_sec"] = representative["clip_start_sec"] + offset
+        result["clip_end_sec"] = representative["clip_end_sec"] + offset
+        result["clip_start"] = _format_time(result["clip_start_sec"])
+        result["clip_end"] = _format_time(result["clip_end_sec"])
+    return result
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+話題区切り検出スクリプト（オンライン版）
+transcribe.pyのチャンクジャーナル（{stem}.asr-journal.jsonl）を追いかけ、
+ASRの途中でも、右側の文脈が揃った境界から順にセグメントを確定して追記する
+
+  ASR:  [チャンク0][チャンク1][チャンク2]...
+  文:   チャンクの縫い合わせが確定した区間を文末記号で区切る
+  境界: 右側に --right-context 文が揃った位置から閾値で判定（segment.pyの階層的分割と同じ閾値）
+
+確定したセグメントは {stem}-segments-online.jsonl に1件ずつ追記し、
+ASR完了（ジャーナルのdoneレコード）後に segment.py と同じ形式の {stem}-segments.json を出力する
+（sourceはジャーナルと同じ場所のASR結果 {stem}.json）
+
+文はジャーナルのチャンクをここで縫い合わせて作るため、バックエンドのマージで作る {stem}.json の文とは
+区切りがずれることがある。sentence_start_idx / sentence_end_idx はこのスクリプト内の文番号なので、
+ASR結果と突き合わせるときは start / end（秒）を使う
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from asr_backends import DEDUP_TOLERANCE, SAMPLE_RATE, SENTENCE_END, Token, stitch_chunk_tokens, tokens_to_result_dict
+from embedding import (
+    DEFAULT_CACHE_LIMIT_MB,
+    DEFAULT_EMBEDDING_BACKEND,
+    DEFAULT_TOKEN_BUDGET,
+    EMBEDDING_BACKENDS,
+    create_embedding_backend,
+    embed_sentences,
+)
+from embedding_cache import DEFAULT_EMBEDDING_CACHE_DIR, DEFAULT_MAX_MB, EmbeddingCache
+from journal import Journal
+from segment_core import DEFAULT_WINDOWS, boundary_curve
+
+JOURNAL_SUFFIX = ".asr-journal.jsonl"
+
+
+class OnlineSegmenter:
+    """
+    ASRのチャンクを受け取りながら話題区切りを確定していく
+    add_chunk: チャンクを追加（完了順でよい）し、新しく確定したセグメントを返す
+    finish: 残りをすべて確定して返す
+
+    チャンクは番号が連続した分だけ使う。縫い合わせは直近3チャンクだけで行い、
+    最新チャンクの開始より前（次のチャンクの影響を受けない範囲）のトークンを確定させる
+    """
+
+    def __init__(
+        self,
+        backend,
+        cache: EmbeddingCache | None = None,
+        large_threshold: float = 0.3,
+        small_threshold: float = 0.6,
+        similarity: str = "adjacent",
+        windows=DEFAULT_WINDOWS,
+        min_depth: float = 0.0,
+        right_context: int | None = None,
+        token_budget: int = DEFAULT_TOKEN_BUDGET,
+        cache_limit_mb: float = DEFAULT_CACHE_LIMIT_MB,
+    ):
+        self.backend = backend
+        self.cache = cache
+        self.large_threshold = large_threshold
+        self.small_threshold = small_threshold
+        self.similarity = similarity
+        self.windows = windows
+        self.min_depth = min_depth
+        # 窓つき類似度は窓幅ぶんの右側の文が揃うまで値が変わる
+        if right_context is None:
+            right_context = max(windows) if similarity == "window" else 1
+        self.right_context = right_context
+        self.token_budget = token_budget
+        self.cache_limit_mb = cache_limit_mb
+
+        self.chunks = {}          # 番号 → (開始秒, 終了秒, トークン)。連続するまで待たせる
+        self.next_chunk = 0
+        self.context = []         # 縫い合わせに使う直近のチャンク
+        self.emitted_until = float("-inf")
+        self.pending_tokens = []  # 文末記号待ちのトークン
+        self.sentences = []
+        self.embeddings = np.zeros((0, 0), dtype=np.int8)
+        self.next_gap = 0         # 未確定の最初の境界（文iと文i+1の間）
+        self.segment_start = 0
+        self.large_index = 0
+        self.segments = []
+
+    def add_chunk(self, index: int, start: float, end: float, tokens: list) -> list[dict]:
+        """start / end は秒"""
+        self.chunks[index] = (start, end, tokens)
+        if self.next_chunk not in self.chunks:
+            return []
+        while self.next_chunk in self.chunks:
+            self._push(self.chunks.pop(self.next_chunk))
+            self.next_chunk += 1
+        return self._advance(done=False)
+
+    def finish(self) -> list[dict]:
+        # 欠番（短すぎて認識されなかった窓など）の後ろも番号順に使う
+        for index in sorted(self.chunks):
+            self._push(self.chunks.pop(index))
+        self._take_tokens(float("inf"), done=True)
+        return self._advance(done=True)
+
+    def _push(self, chunk: tuple[float, float, list]) -> None:
+        """チャンクを縫い合わせに加え、その開始より前のトークンを確定させる"""
+        self.context = [*self.context[-2:], chunk]
+        self._take_tokens(chunk[0] - DEDUP_TOLERANCE, done=False)
+
+    def _take_tokens(self, until: float, done: bool) -> None:
+        """縫い合わせが確定した [emitted_until, until) のトークンを文にする"""
+        tokens = stitch_chunk_tokens(self.context)
+        self.pending_tokens.extend(t for t in tokens if self.emitted_until <= t.start < until)
+        self.emitted_until = max(self.emitted_until, until)
+
+        # 文末記号まで揃った文だけ確定
+        last = len(self.pending_tokens) - 1
+        if not done:
+            while last >= 0 and not any(mark in self.pending_tokens[last].text for mark in SENTENCE_END):
+                last -= 1
+        if last < 0:
+            return
+        sentences = tokens_to_result_dict(self.pending_tokens[:last + 1])["sentences"]
+        del self.pending_tokens[:last + 1]
+        self._add_sentences([{k: v for k, v in s.items() if k != "tokens"} for s in sentences])
+
+    def _add_sentences(self, sentences: list[dict]) -> None:
+        if not sentences:
+            return
+        embeddings = embed_sentences(
+            self.backend, [s["text"] for s in sentences],
+            token_budget=self.token_budget,
+            cache_limit_mb=self.cache_limit_mb,
+            cache=self.cache,
+            unload=False
+        )
+        self.embeddings = embeddings if not self.sentences else np.concatenate([self.embeddings, embeddings])
+        self.sentences.extend(sentences)
+
+    def _advance(self, done: bool) -> list[dict]:
+        """右側の文脈が揃った境界を判定し、閉じたセグメントを返す"""
+        n = len(self.sentences)
+        final = n - 1 if done else n - 1 - self.right_context
+        new_segments = []
+        if final > self.next_gap:
+            similarities, _ = boundary_curve(
+                self.embeddings, self.similarity, windows=self.windows, min_depth=self.min_depth
+            )
+            small = max(self.large_threshold, self.small_threshold)
+            for gap in np.flatnonzero(similarities[self.next_gap:final] < small) + self.next_gap:
+                new_segments.append(self._close(int(gap) + 1))
+                if similarities[gap] < self.large_threshold:
+                    self.large_index += 1
+            self.next_gap = final
+        if done and self.segment_start < n:
+            new_segments.append(self._close(n))
+        return new_segments
+
+    def _close(self, end: int) -> dict:
+        segment_sentences = self.sentences[self.segment_start:end]
+        start_time = segment_sentences[0]["start"]
+        end_time = segment_sentences[-1]["end"]
+        segment = {
+            "large_segment_index": self.large_index,
+            "index": len(self.segments),
+            "start": start_time,
+            "end": end_time,
+            "duration": end_time - start_time,
+            "text": "".join(s["text"] for s in segment_sentences).strip(),
+            # オンラインで縫い合わせた文の番号（{stem}.jsonの文番号とは一致しないことがある）
+            "sentence_start_idx": self.segment_start,
+            "sentence_end_idx": end,
+        }
+        self.segments.append(segment)
+        self.segment_start = end
+        return segment
+
+
+def with_large_segment_times(segments: list[dict]) -> list[dict]:
+    """segment.pyの出力と同じく、各セグメントに所属する大セグメントの開始・終了秒を入れる"""
+    spans = {}
+    for seg in segments:
+        start, end = spans.get(seg["large_segment_index"], (seg["start"], seg["end"]))
+        spans[seg["large_segment_index"]] = (min(start, seg["start"]), max(end, seg["end"]))
+    result = []
+    for seg in segments:
+        start, end = spans[seg["large_segment_index"]]
+        result.append({
+            "large_segment_index": seg["large_segment_index"],
+            "large_segment_start": start,
+            "large_segment_end": end,
+            **{k: v for k, v in seg.items() if k != "large_segment_index"},
+        })
+    return result
+
+
+class ASRJournalReader:
+    """追記中のASRジャーナルを読み進める（ヘッダが変わったら作り直しとみなす）"""
+
+    def __init__(self, path: Path):
+        self.journal = Journal(path)
+        self.offset = 0
+        self.header = None
+
+    def poll(self) -> tuple[list[dict], bool]:
+        """戻り値: (新しいレコード（ヘッダ以外）, 作り直されたか)"""
+        restarted = False
+        if self.journal.path.exists() and self.journal.path.stat().st_size < self.offset:
+            self.offset = 0
+            self.header = None
+            restarted = True
+        records, self.offset = self.journal.read_from(self.offset)
+        if records and records[0].get('type') == 'header':
+            if self.header is not None and records[0] != self.header:
+                restarted = True
+            self.header = records[0]
+            records = records[1:]
+        return records, restarted
+
+
+def format_time(seconds: float) -> str:
+    return f"{int(seconds // 60):02d}:{int(seconds % 60):02d}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='話題区切り検出（オンライン版: ASRジャーナルを追いかけて逐次確定）')
+    parser.add_argument('journal', help=f'transcribe.pyのチャンクジャーナル（{{stem}}{JOURNAL_SUFFIX}）')
+    parser.add_argument('-o', '--output', default='output', help='出力ディレクトリ')
+    parser.add_argument('-m', '--model',
+                        help=f"embeddingモデル (default: mlx={EMBEDDING_BACKENDS['mlx'].default_model}, "
+                             f"cpu={EMBEDDING_BACKENDS['cpu'].default_model})")
+    parser.add_argument('--embedding-backend', choices=list(EMBEDDING_BACKENDS), default=DEFAULT_EMBEDDING_BACKEND,
+                        help=f'embeddingバックエンド: mlx=Apple Silicon / cpu=sentence-transformers (default: {DEFAULT_EMBEDDING_BACKEND})')
+    parser.add_argument('-t', '--threshold', type=float, default=0.3,
+                        help='大セグメント検出の類似度閾値 (default: 0.3)')
+    parser.add_argument('--small-threshold', type=float, default=0.6,
+                        help='小セグメント検出の類似度閾値 (default: 0.6)')
+    parser.add_argument('--similarity', choices=['adjacent', 'window'], default='adjacent',
+                        help='境界の判定: adjacent=隣接文の類似度 / window=前後の窓平均の類似度の谷（短い相槌に強い） (default: adjacent)')
+    parser.add_argument('--windows', type=int, nargs='+', default=list(DEFAULT_WINDOWS),
+                        help=f"windowで使う窓幅（文数） (default: {' '.join(map(str, DEFAULT_WINDOWS))})")
+    parser.add_argument('--min-depth', type=float, default=0.0,
+                        help='windowで境界候補にする谷の最小depth score (default: 0.0)')
+    parser.add_argument('--right-context', type=int, default=None,
+                        help='境界を確定するのに必要な右側の文数 (default: adjacent=1, window=最大の窓幅)')
+    parser.add_argument('--poll', type=float, default=2.0,
+                        help='ジャーナルの確認間隔（秒） (default: 2.0)')
+    parser.add_argument('--idle-timeout', type=float, default=1800.0,
+                        help='この秒数ジャーナルが更新されなければ終了（ASRの異常終了時） (default: 1800)')
+    parser.add_argument('--no-embedding-cache', action='store_true',
+                        help='embeddingキャッシュを使わない')
+    parser.add_argument('--embedding-cache-dir', type=Path, default=DEFAULT_EMBEDDING_CACHE_DIR,
+                        help=f'embeddingキャッシュの場所 (default: {DEFAULT_EMBEDDING_CACHE_DIR})')
+    parser.add_argument('--embedding-cache-max-mb', type=float, default=DEFAULT_MAX_MB,
+                        help=f'モデルごとのembeddingキャッシュ容量上限（MB） (default: {DEFAULT_MAX_MB})')
+    parser.add_argument('--token-budget', type=int, default=DEFAULT_TOKEN_BUDGET,
+                        help=f'embeddingの1バッチのトークン数上限（文数×最長トークン数） (default: {DEFAULT_TOKEN_BUDGET})')
+    parser.add_argument('--cache-limit-mb', type=float, default=DEFAULT_CACHE_LIMIT_MB,
+                        help=f'MLXキャッシュがこれを超えたらクリア（MB） (default: {DEFAULT_CACHE_LIMIT_MB})')
+    args = parser.parse_args()
+
+    journal_path = Path(args.journal)
+    output_dir = Path(args.output)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    stem = journal_path.name.removesuffix(JOURNAL_SUFFIX)
+    # transcribe.pyはジャーナルと同じディレクトリにASR結果を書き出す
+    asr_path = journal_path.with_name(f"{stem}.json")
+    online_path = output_dir / f"{stem}-segments-online.jsonl"
+    segments_path = output_dir / f"{stem}-segments.json"
+
+    backend = create_embedding_backend(args.embedding_backend, args.model)
+    cache = None if args.no_embedding_cache else EmbeddingCache(
+        backend.model_path, args.embedding_cache_dir, args.embedding_cache_max_mb
+    )
+
+    def new_segmenter() -> OnlineSegmenter:
+        return OnlineSegmenter(
+            backend, cache,
+            large_threshold=args.threshold,
+            small_threshold=args.small_threshold,
+            similarity=args.similarity,
+            windows=args.windows,
+            min_depth=args.min_depth,
+            right_context=args.right_context,
+            token_budget=args.token_budget,
+            cache_limit_mb=args.cache_limit_mb,
+        )
+
+    output = Journal(online_path)
+    output_header = {
+        'type': 'header',
+        'source': str(asr_path),
+        'similarity': args.similarity,
+        'large_threshold': args.threshold,
+        'small_threshold': args.small_threshold,
+    }
+
+    def emit(segments: list[dict]) -> None:
+        for seg in segments:
+            output.append({'type': 'segment', **seg})
+            print(f"  確定: {format_time(seg['start'])}-{format_time(seg['end'])} ({seg['duration']:.0f}s)")
+
+    print(f"=== ASRジャーナルを追跡: {journal_path} ===")
+    print(f"  出力: {online_path}")
+    source = ASRJournalReader(journal_path)
+    segmenter = new_segmenter()
+    output.reset(output_header)
+    last_update = time.time()
+    done = False
+
+    while not done:
+        records, restarted = source.poll()
+        if restarted:
+            # ASRがジャーナルを作り直した（--resumeなしの再実行など）
+            print("  ジャーナルが作り直されたため最初から処理")
+            segmenter = new_segmenter()
+            output.reset(output_header)
+        if records:
+            last_update = time.time()
+        for record in records:
+            if record['type'] == 'chunk':
+                segments = segmenter.add_chunk(
+                    record['index'],
+                    record['start'] / SAMPLE_RATE,
+                    record['end'] / SAMPLE_RATE,
+                    [Token(**t) for t in record['tokens']],
+                )
+                print(f"  チャンク{record['index']}: 文{len(segmenter.sentences)} / 確定セグメント{len(segmenter.segments)}")
+                emit(segments)
+            elif record['type'] == 'done':
+                emit(segmenter.finish())
+                done = True
+                break
+        if not done:
+            if time.time() - last_update > args.idle_timeout:
+                print(f"  {args.idle_timeout:.0f}秒間更新がないため終了（確定済み: {len(segmenter.segments)}件）")
+                backend.unload()
+                return
+            time.sleep(args.poll)
+
+    backend.unload()
+
+    # segment.pyと同じ形式で保存
+    result = {
+        'source': str(asr_path),
+        'method': 'online',
+        'similarity': args.similarity,
+        'large_threshold': args.threshold,
+        'small_threshold': args.small_threshold,
+        'total_asr_segments': len(segmenter.sentences),
+        'total_small_segments': len(segmenter.segments),
+        'segments': with_large_segment_times(segmenter.segments),
+    }
+    with open(segments_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\n保存: {segments_path}")
+
+
+if __name__ == '__main__':
+    main()
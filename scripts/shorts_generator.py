@@ -11,7 +11,6 @@ YouTube Shorts 向け縦型動画生成
 """
 
 import argparse
-import json
 import math
 from pathlib import Path
 
@@ -25,27 +24,26 @@ from PIL import Image, ImageDraw, ImageFont, ImageFilter
 import numpy as np
 import MeCab
 
+from asr_store import load_asr
+
 
 # ===== ASR/MeCab処理 =====
 
 def get_char_tokens(asr_path: str) -> list[dict]:
     """ASRデータから文字単位のトークンを取得"""
-    with open(asr_path) as f:
-        data = json.load(f)
+    transcript = load_asr(asr_path)
+    texts, starts, ends = transcript.tokens()
 
     tokens = []
-    for sent in data['sentences']:
-        if 'tokens' not in sent:
+    for text, start, end in zip(texts, starts.tolist(), ends.tolist()):
+        text = text.strip()
+        if not text:
             continue
-        for tok in sent['tokens']:
-            text = tok['text'].strip()
-            if not text:
-                continue
-            tokens.append({
-                'text': text,
-                'start': tok['start'],
-                'end': tok['end'],
-            })
+        tokens.append({
+            'text': text,
+            'start': start,
+            'end': end,
+        })
     return tokens
 
 
@@ -5,12 +5,24 @@
 """
 
 import argparse
+import glob
+import hashlib
 import json
+import os
 import subprocess
 import sys
+import threading
+import time
 from pathlib import Path
 
-import mlx.core as mx
+import numpy as np
+
+from asr_backends import BACKENDS, DEFAULT_BACKEND, create_backend, stitch_chunk_tokens, token_to_record
+from asr_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_GB, ASRCache, cache_key, hash_wav
+from asr_store import load_asr, save_asr
+from journal import Journal
+
+SAMPLE_RATE = 16000
 
 
 def extract_audio(video_path: Path, output_path: Path) -> None:
@@ -29,107 +41,952 @@ def extract_audio(video_path: Path, output_path: Path) -> None:
     print(f"音声抽出完了: {output_path}")
 
 
+def probe_duration(video_path: Path) -> float | None:
+    """ffprobeで動画の長さ（秒）を取得。取得できなければNone"""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        str(video_path)
+    ]
+    try:
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        return float(out.strip())
+    except (subprocess.CalledProcessError, ValueError):
+        return None
+
+
+# 並列抽出で1プロセスが受け持つ最短の長さ（秒）。これより短い動画は分割しない
+EXTRACT_MIN_SPLIT = 300.0
+
+
+def _extract_range(video_path: Path, start_sample: int, num_samples: int | None, part_path: Path) -> None:
+    """
+    start_sampleからnum_samplesサンプル分の音声を16kHzモノラルs16leで書き出す（Noneなら末尾まで）
+    入力側-ssは変換時にはフレーム単位で正確にシークされるので、
+    少し長めにデコードしてから必要なサンプル数ちょうどに切り詰める
+    """
+    cmd = [
+        "ffmpeg", "-nostdin", "-y",
+        "-ss", f"{start_sample / SAMPLE_RATE:.6f}",
+        "-i", str(video_path),
+        "-vn",
+        "-f", "s16le",
+        "-acodec", "pcm_s16le",
+        "-ar", str(SAMPLE_RATE),
+        "-ac", "1",
+    ]
+    if num_samples is not None:
+        cmd += ["-t", f"{num_samples / SAMPLE_RATE + 1.0:.6f}"]
+    cmd.append(str(part_path))
+    subprocess.run(cmd, check=True, capture_output=True)
+
+    if num_samples is None:
+        return
+    size = num_samples * 2
+    actual = part_path.stat().st_size
+    if actual > size:
+        os.truncate(part_path, size)
+    elif actual < size:
+        # 途中で音声が途切れていても後続区間の位置がずれないよう無音で埋める
+        with open(part_path, "ab") as f:
+            f.write(b"\0" * (size - actual))
+
+
+def extract_audio_parallel(video_path: Path, output_path: Path, jobs: int) -> None:
+    """
+    長尺動画の音声を区間に分け、複数のffmpegで同時に抽出して1つのWAVに連結
+    区間の境界はサンプル単位で決めるので、連結結果はサンプル位置がずれない
+    短い動画・長さが取れない動画はextract_audioと同じ1プロセス抽出
+    """
+    duration = probe_duration(video_path) if jobs > 1 else None
+    if not duration or duration < EXTRACT_MIN_SPLIT * 2:
+        extract_audio(video_path, output_path)
+        return
+
+    import wave
+    from concurrent.futures import ThreadPoolExecutor
+
+    jobs = min(jobs, int(duration // EXTRACT_MIN_SPLIT))
+    total = int(duration * SAMPLE_RATE)
+    bounds = [total * k // jobs for k in range(jobs)]
+    # 最後の区間は末尾まで（コンテナの長さと音声の長さの差を吸収）
+    ranges = [
+        (bounds[k], bounds[k + 1] - bounds[k] if k + 1 < jobs else None)
+        for k in range(jobs)
+    ]
+    parts = [output_path.with_name(f"{output_path.stem}.part{k}.pcm") for k in range(jobs)]
+
+    print(f"=== 音声抽出中: {video_path} ({jobs}並列) ===")
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = [
+                pool.submit(_extract_range, video_path, start, num, part)
+                for (start, num), part in zip(ranges, parts)
+            ]
+            for future in futures:
+                future.result()
+
+        with wave.open(str(output_path), "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(SAMPLE_RATE)
+            for part in parts:
+                with open(part, "rb") as f:
+                    while data := f.read(1 << 20):
+                        w.writeframes(data)
+    finally:
+        for part in parts:
+            part.unlink(missing_ok=True)
+    print(f"音声抽出完了: {output_path}")
+
+
+class PCMRingBuffer:
+    """
+    ffmpegのPCM出力を保持する固定長リングバッファ
+    書き込み側は空きができるまで待ち、読み出し側はサンプルが揃うまで待つ
+    位置はすべてストリーム先頭からの絶対サンプル数
+    """
+
+    def __init__(self, capacity: int):
+        self.buffer = np.zeros(capacity, dtype=np.float32)
+        self.capacity = capacity
+        self.written = 0    # 書き込み済みサンプル数
+        self.released = 0   # 上書き可能になった位置
+        self.closed = False
+        self.error: str | None = None
+        self.cond = threading.Condition()
+
+    def write(self, samples: np.ndarray) -> None:
+        pos = 0
+        while pos < len(samples):
+            with self.cond:
+                while self.capacity - (self.written - self.released) == 0 and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return  # 読み出し側が終了済み
+                space = self.capacity - (self.written - self.released)
+                n = min(space, len(samples) - pos)
+                offset = self.written % self.capacity
+                first = min(n, self.capacity - offset)
+                self.buffer[offset:offset + first] = samples[pos:pos + first]
+                self.buffer[:n - first] = samples[pos + first:pos + n]
+                self.written += n
+                pos += n
+                self.cond.notify_all()
+
+    def close(self, error: str | None = None) -> None:
+        with self.cond:
+            self.closed = True
+            self.error = self.error or error
+            self.cond.notify_all()
+
+    def read(self, start: int, end: int) -> np.ndarray:
+        """[start, end)を返す。ストリーム終端に達した場合は短い配列を返す"""
+        with self.cond:
+            while self.written < end and not self.closed:
+                self.cond.wait()
+            if self.error:
+                raise RuntimeError(self.error)
+            end = min(end, self.written)
+            out = np.empty(max(0, end - start), dtype=np.float32)
+            offset = start % self.capacity
+            first = min(len(out), self.capacity - offset)
+            out[:first] = self.buffer[offset:offset + first]
+            out[first:] = self.buffer[:len(out) - first]
+            return out
+
+    def release(self, upto: int) -> None:
+        """upto より前のサンプルを上書き可能にする"""
+        with self.cond:
+            self.released = max(self.released, upto)
+            self.cond.notify_all()
+
+
+def stream_audio_windows(
+    video_path: Path,
+    chunk_samples: int,
+    overlap_samples: int,
+    digest=None,
+):
+    """
+    ffmpegの出力をパイプで受け取り、チャンク単位の窓を順に返す
+    デコードは別スレッドで先行し、メモリはリングバッファ分（2チャンク）に抑える
+    digest: hashlibのハッシュ。渡すと受け取ったPCMで更新する（最後まで読めば抽出したWAVの asr_cache.hash_wav と同じ値）
+    yield: (開始サンプル位置, 音声float32配列)
+    """
+    cmd = [
+        "ffmpeg", "-nostdin",
+        "-i", str(video_path),
+        "-vn",
+        "-f", "s16le",
+        "-acodec", "pcm_s16le",
+        "-ar", str(SAMPLE_RATE),
+        "-ac", "1",
+        "-"
+    ]
+    ring = PCMRingBuffer(chunk_samples * 2)
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def reader():
+        # stderrが詰まらないよう別スレッドで読み捨てつつ保持
+        stderr_chunks = []
+        stderr_thread = threading.Thread(
+            target=lambda: stderr_chunks.append(proc.stderr.read()), daemon=True
+        )
+        stderr_thread.start()
+        pending = b""
+        while True:
+            data = proc.stdout.read(1 << 16)
+            if not data:
+                break
+            if digest is not None:
+                digest.update(data)
+            data = pending + data
+            usable = len(data) - len(data) % 2
+            pending = data[usable:]
+            samples = np.frombuffer(data[:usable], dtype=np.int16)
+            ring.write(samples.astype(np.float32) / 32768.0)
+        proc.wait()
+        stderr_thread.join()
+        if proc.returncode != 0:
+            message = b"".join(stderr_chunks).decode(errors="replace")
+            ring.close(error=f"ffmpeg failed: {message[-500:]}")
+        else:
+            ring.close()
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+
+    step = chunk_samples - overlap_samples
+    start = 0
+    try:
+        while True:
+            # 1サンプル先まで読み、窓の終わりでちょうど終わるストリームも最後の窓と分かるようにする
+            # （iter_audio_windowsと同じく、前の窓のオーバーラップに収まる窓は作らない）
+            window = ring.read(start, start + chunk_samples + 1)
+            if len(window) == 0:
+                break
+            last = len(window) <= chunk_samples
+            yield start, window[:chunk_samples]
+            if last:
+                break  # ストリーム終端
+            start += step
+            ring.release(start)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        ring.close()
+        thread.join()
+
+
+# VADパラメータ
+VAD_FRAME_MS = 30            # フレーム長
+VAD_ENERGY_MARGIN_DB = 12.0  # ノイズフロアからの閾値
+VAD_MIN_SPEECH = 0.3         # これより短い発話は無視（秒）
+VAD_MIN_SILENCE = 0.5        # これより短い無音は発話に含める（秒）
+VAD_PAD = 0.2                # 発話区間の前後に足す余白（秒）
+VAD_MAX_GAP = 2.0            # この長さ以上の無音はチャンクに含めない（秒）
+VAD_CUT_SEARCH = 15.0        # 長い発話区間を切る位置の探索幅（秒）
+
+
+def _runs(mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """真偽配列のTrueの連続区間を (開始, 終了) の配列で返す"""
+    padded = np.concatenate([[False], mask, [False]])
+    edges = np.flatnonzero(np.diff(padded.astype(np.int8)))
+    return edges[0::2], edges[1::2]
+
+
+def detect_speech(audio: np.ndarray, sample_rate: int = SAMPLE_RATE) -> list[tuple[int, int]]:
+    """
+    フレーム単位のエネルギーとゼロ交差率で発話区間を検出
+    閾値はノイズフロア（エネルギー下位10%）からの相対値
+    戻り値: 発話区間 (開始サンプル, 終了サンプル) のリスト
+    """
+    frame = int(sample_rate * VAD_FRAME_MS / 1000)
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return [(0, len(audio))] if len(audio) else []
+
+    frames = audio[:n_frames * frame].reshape(n_frames, frame)
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    signs = np.signbit(frames)
+    zcr = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+
+    floor = np.percentile(energy_db, 10)
+    threshold = floor + VAD_ENERGY_MARGIN_DB
+    # 有声音はエネルギー、無声子音はやや低いエネルギー＋高ゼロ交差率で拾う
+    speech = (energy_db > threshold) | (
+        (energy_db > threshold - VAD_ENERGY_MARGIN_DB / 2) & (zcr > 0.25)
+    )
+
+    frame_sec = frame / sample_rate
+
+    # 短い無音を埋める
+    starts, ends = _runs(~speech)
+    short = (ends - starts) * frame_sec < VAD_MIN_SILENCE
+    inner = (starts > 0) & (ends < n_frames)
+    for s, e in zip(starts[short & inner], ends[short & inner]):
+        speech[s:e] = True
+
+    # 短い発話を捨てる
+    starts, ends = _runs(speech)
+    keep = (ends - starts) * frame_sec >= VAD_MIN_SPEECH
+    starts, ends = starts[keep], ends[keep]
+
+    pad = int(VAD_PAD * sample_rate)
+    regions = []
+    for s, e in zip(starts * frame - pad, ends * frame + pad):
+        s, e = max(int(s), 0), min(int(e), len(audio))
+        if regions and s <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], e)
+        else:
+            regions.append((s, e))
+    return regions
+
+
+def find_pause(audio: np.ndarray, start: int, end: int, sample_rate: int = SAMPLE_RATE) -> int:
+    """[start, end) の中で最もエネルギーの低いフレームの中央位置を返す"""
+    frame = int(sample_rate * VAD_FRAME_MS / 1000)
+    n_frames = (end - start) // frame
+    if n_frames == 0:
+        return end
+    frames = audio[start:start + n_frames * frame].reshape(n_frames, frame)
+    quietest = int(np.argmin(np.mean(frames ** 2, axis=1)))
+    return start + quietest * frame + frame // 2
+
+
+def plan_vad_chunks(
+    audio: np.ndarray,
+    regions: list[tuple[int, int]],
+    chunk_samples: int,
+    sample_rate: int = SAMPLE_RATE,
+) -> list[tuple[int, int]]:
+    """
+    発話区間をチャンク長以内にまとめる
+    チャンクの切れ目は無音位置なのでオーバーラップ不要
+    チャンク長を超える発話区間は、末尾VAD_CUT_SEARCH秒の中で最も静かな位置で切る
+    """
+    max_gap = int(VAD_MAX_GAP * sample_rate)
+    search = min(int(VAD_CUT_SEARCH * sample_rate), chunk_samples // 2)
+    chunks: list[tuple[int, int]] = []
+    current: tuple[int, int] | None = None
+
+    for start, end in regions:
+        if current is not None:
+            gap = start - current[1]
+            if gap < max_gap and end - current[0] <= chunk_samples:
+                current = (current[0], end)
+                continue
+            chunks.append(current)
+            current = None
+
+        # 長い発話区間は息継ぎ位置で分割
+        pos = start
+        while end - pos > chunk_samples:
+            cut = find_pause(audio, pos + chunk_samples - search, pos + chunk_samples, sample_rate)
+            chunks.append((pos, cut))
+            pos = cut
+        current = (pos, end)
+
+    if current is not None:
+        chunks.append(current)
+    return chunks
+
+
+def load_wav(audio_path: Path) -> np.ndarray:
+    """extract_audioで書き出した16kHzモノラルWAVをfloat32配列で読み込み"""
+    import wave
+
+    with wave.open(str(audio_path), "rb") as w:
+        frames = w.readframes(w.getnframes())
+    return np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def iter_audio_windows(audio: np.ndarray, chunk_samples: int, overlap_samples: int):
+    """メモリ上の音声をstream_audio_windowsと同じ窓割りで返す"""
+    step = chunk_samples - overlap_samples
+    for start in range(0, len(audio), step):
+        window = audio[start:start + chunk_samples]
+        yield start, window
+        if start + chunk_samples >= len(audio):
+            break
+
+
+def transcribe_windows(
+    backend,
+    windows,
+    overlap_duration: float,
+    chunk_callback=None,
+    completed: dict | None = None,
+) -> dict:
+    """
+    音声窓を順に認識し、オーバーラップ部分をバックエンドのマージ方法でまとめる
+    chunk_callback: 窓ごとに (開始サンプル, 終了サンプル, トークン) で呼ばれる
+    completed: 再開時の処理済みチャンク {開始サンプル: トークン}。認識を省略してそのまま使う
+    """
+    completed = completed or {}
+    chunks = []
+
+    for start, window in windows:
+        if len(window) < backend.min_samples:
+            continue
+
+        if start in completed:
+            chunk_tokens = completed[start]
+        else:
+            chunk_tokens = backend.transcribe_chunk(window, start)
+            if chunk_callback is not None:
+                chunk_callback(start, start + len(window), chunk_tokens)
+
+        chunks.append((start / SAMPLE_RATE, (start + len(window)) / SAMPLE_RATE, chunk_tokens))
+
+    return backend.build_result(backend.merge_chunks(chunks, overlap_duration))
+
+
+# 並列ワーカー内で保持するバックエンド
+_worker_backend = None
+
+
+def _init_worker(backend_name: str, model_id: str, memory_limit_gb: float | None) -> None:
+    """ワーカープロセス初期化: メモリ上限設定とモデルロード"""
+    global _worker_backend
+    _worker_backend = create_backend(backend_name, model_id, memory_limit_gb=memory_limit_gb)
+    _worker_backend.load()
+
+
+def _transcribe_chunk_in_worker(start: int, window: np.ndarray) -> list:
+    if len(window) < _worker_backend.min_samples:
+        return []
+    tokens = _worker_backend.transcribe_chunk(window, start)
+    _worker_backend.clear_cache()
+    return tokens
+
+
+def transcribe_windows_parallel(
+    backend,
+    windows,
+    workers: int,
+    chunk_callback=None,
+    completed: dict | None = None,
+) -> dict:
+    """
+    音声窓をプロセスプールで並列に認識し、オーバーラップを縫い合わせる
+    窓の投入はワーカー数の2倍までに抑え、メモリ使用量を一定にする
+    backend: 各ワーカーで同じ設定のものを作ってロードする（このプロセスではロードしない）
+    chunk_callback, completed はtranscribe_windowsと同じ
+    """
+    import multiprocessing
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    completed = completed or {}
+    chunks = {}
+    pending = {}
+    # MLXはforkと相性が悪いためspawnで起動
+    context = multiprocessing.get_context("spawn")
+
+    def collect(done):
+        for future in done:
+            start, end = pending.pop(future)
+            tokens = future.result()
+            chunks[start] = (start / SAMPLE_RATE, end / SAMPLE_RATE, tokens)
+            if chunk_callback is not None:
+                chunk_callback(start, end, tokens)
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(backend.name, backend.model_id, backend.memory_limit_gb),
+    ) as pool:
+        for start, window in windows:
+            if start in completed:
+                chunks[start] = (start / SAMPLE_RATE, (start + len(window)) / SAMPLE_RATE, completed[start])
+                continue
+            while len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            future = pool.submit(_transcribe_chunk_in_worker, start, np.array(window))
+            pending[future] = (start, start + len(window))
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+
+    tokens = stitch_chunk_tokens([chunks[k] for k in sorted(chunks)])
+    return backend.build_result(tokens)
+
+
+def save_result(output_data: dict, output_path: Path, output_format: str = "both") -> None:
+    """
+    結果出力
+    output_format: "json"（{stem}.json）/ "asr"（列指向形式 {stem}.asr/）/ "both"
+    """
+    print(f"=== 完了 ===")
+    if output_format in ("json", "both"):
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(output_data, f, ensure_ascii=False, indent=2)
+        print(f"出力: {output_path}")
+    if output_format in ("asr", "both"):
+        print(f"出力: {save_asr(output_data, output_path)}")
+
+
+def source_fingerprint(path: Path) -> dict:
+    """ジャーナルのヘッダで同じ入力か確かめるための目印（同名・同じ長さで書き出し直した動画を区別する）"""
+    stat = Path(path).stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
 def transcribe_with_memory_clear(
     audio_path: Path,
     output_path: Path,
-    model_id: str = "mlx-community/parakeet-tdt_ctc-0.6b-ja",
+    model_id: str | None = None,
     chunk_duration: float = 180.0,
     overlap_duration: float = 15.0,
+    stream: bool = False,
+    workers: int = 1,
+    memory_limit_gb: float | None = None,
+    vad: bool = False,
+    backend_name: str = DEFAULT_BACKEND,
+    backend=None,
+    journal_path: Path | None = None,
+    resume: bool = False,
+    output_format: str = "both",
+    audio_digest=None,
+    input_path: Path | None = None,
 ) -> dict:
-    """メモリクリアしながらASR処理"""
-    from parakeet_mlx import from_pretrained, DecodingConfig
-    from parakeet_mlx.audio import load_audio
+    """
+    メモリクリアしながらチャンク単位でASR処理
+    stream=True: audio_pathは動画。WAVを書き出さずffmpegのPCMを受けながら認識
+      audio_digestを渡すと、認識しながらデコード後の音声のハッシュを計算する（ASRキャッシュ登録用）
+    workers>1: チャンクをワーカープロセスで並列に認識
+    vad=True: 無音区間を認識対象から外し、チャンクを無音位置で切る（オーバーラップなし）
+    backend_name: ASRバックエンド（asr_backends.BACKENDS）。model_id省略時はその既定モデル
+    backend: ロード済みバックエンド（常駐ワーカー用、逐次処理時のみ使用）。Noneならここで作ってロードし、終了時に解放
+    journal_path: 完了チャンクを追記するジャーナル。resume=Trueなら記録済みチャンクを再利用
+    input_path: 元動画（ジャーナルのヘッダに大きさ・更新時刻を入れる）。省略時はaudio_path
+    output_format: save_result参照
+    """
+    owns_backend = backend is None
+    if owns_backend:
+        backend = create_backend(backend_name, model_id, memory_limit_gb=memory_limit_gb)
+
+    chunk_samples = int(chunk_duration * SAMPLE_RATE)
+    overlap_samples = int(overlap_duration * SAMPLE_RATE)
+    # ジャーナルに書くチャンク番号（VADはチャンクの開始位置から引く）
+    chunk_index = None
+
+    if stream:
+        duration = probe_duration(audio_path)
+        total_samples = int(duration * SAMPLE_RATE) if duration else None
+        windows = stream_audio_windows(audio_path, chunk_samples, overlap_samples, digest=audio_digest)
+    else:
+        audio = load_wav(audio_path)
+        total_samples = len(audio)
+        if vad:
+            print("=== 音声区間検出中 (VAD) ===")
+            regions = detect_speech(audio)
+            chunks = plan_vad_chunks(audio, regions, chunk_samples)
+            used = sum(end - start for start, end in chunks)
+            skipped = total_samples - used
+            print(f"  発話区間: {len(regions)}個 → チャンク: {len(chunks)}個")
+            print(f"  スキップ: {skipped / SAMPLE_RATE:.1f}s / {total_samples / SAMPLE_RATE:.1f}s "
+                  f"({skipped / max(total_samples, 1) * 100:.1f}%)")
+            chunk_index = {start: i for i, (start, _) in enumerate(chunks)}
+            windows = ((start, audio[start:end]) for start, end in chunks)
+        else:
+            windows = iter_audio_windows(audio, chunk_samples, overlap_samples)
 
-    print(f"=== モデルロード中: {model_id} ===")
-    model = from_pretrained(model_id)
-    print("モデルロード完了")
+    # チャンクジャーナル（異常終了からの再開用）
+    journal = None
+    completed = {}
+    if journal_path is not None:
+        journal = Journal(journal_path)
+        header = {
+            "type": "header",
+            "source": str(audio_path),
+            "total_samples": total_samples,
+            "backend": backend.name,
+            "model": backend.model_id,
+            "chunk_duration": chunk_duration,
+            "overlap_duration": overlap_duration,
+            "vad": vad,
+            "input": source_fingerprint(input_path or audio_path),
+        }
+        records = journal.open(header, resume)
+        if records and records[-1]["type"] == "done":
+            # 完了済みの結果は再利用しない（再開は異常終了時だけ）
+            print(f"  前回の処理は完了済みのため最初から処理: {journal_path}")
+            journal.reset(header)
+            records = []
+        for record in records:
+            if record["type"] != "chunk":
+                continue
+            completed[record["start"]] = [backend.token_from_record(t) for t in record["tokens"]]
+        if completed:
+            print(f"  再開: 処理済みチャンク {len(completed)}個をジャーナルから復元")
 
-    print(f"=== ASR処理中 (chunk: {chunk_duration}s) ===")
+    mode = f"{backend.name}, " + ("streaming" if stream else "file")
+    if workers > 1:
+        mode += f", parallel: {workers} workers"
+    print(f"=== ASR処理中 ({mode}, chunk: {chunk_duration}s) ===")
 
-    # コールバックで進捗表示とメモリクリア
-    def chunk_callback(current_pos: int, total_pos: int):
-        progress = current_pos / total_pos * 100
-        print(f"  進捗: {progress:.1f}% ({current_pos}/{total_pos} samples)")
+    # コールバックで進捗表示・ジャーナル記録・メモリクリア
+    def chunk_callback(start: int, end: int, tokens: list):
+        if journal is not None:
+            if chunk_index is not None:
+                index = chunk_index[start]
+            else:
+                index = start // (chunk_samples - overlap_samples)
+            journal.append({
+                "type": "chunk",
+                "index": index,
+                "start": start,
+                "end": end,
+                "tokens": [token_to_record(t) for t in tokens],
+            })
+        if total_samples:
+            progress = min(end / total_samples * 100, 100.0)
+            print(f"  進捗: {progress:.1f}% ({end}/{total_samples} samples)")
+        else:
+            print(f"  進捗: {end / SAMPLE_RATE:.0f}s")
         # チャンク処理後にメモリクリア
-        mx.clear_cache()
+        backend.clear_cache()
 
-    result = model.transcribe(
-        str(audio_path),
-        chunk_duration=chunk_duration,
-        overlap_duration=overlap_duration,
-        chunk_callback=chunk_callback,
-    )
+    if workers > 1:
+        output_data = transcribe_windows_parallel(
+            backend, windows, workers,
+            chunk_callback=chunk_callback,
+            completed=completed,
+        )
+    else:
+        backend.load()
+        output_data = transcribe_windows(
+            backend, windows, overlap_duration, chunk_callback, completed=completed
+        )
+        # モデル解放
+        if owns_backend:
+            backend.unload()
 
     # 最終メモリクリア
-    mx.clear_cache()
-
-    # 結果を辞書に変換
-    output_data = {
-        "text": result.text,
-        "sentences": [
-            {
-                "text": s.text,
-                "start": s.start,
-                "end": s.end,
-                "duration": s.duration,
-                "confidence": round(s.confidence, 3) if hasattr(s, 'confidence') else None,
-                "tokens": [
-                    {
-                        "text": t.text,
-                        "start": t.start,
-                        "end": t.end,
-                        "duration": t.duration,
-                        "confidence": round(t.confidence, 3) if hasattr(t, 'confidence') else None,
-                    }
-                    for t in s.tokens
-                ] if hasattr(s, 'tokens') else []
-            }
-            for s in result.sentences
-        ]
-    }
-
-    # JSON出力
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(output_data, f, ensure_ascii=False, indent=2)
+    backend.clear_cache()
+    # 全チャンク完了（segment_online.pyが残りを確定する合図）
+    if journal is not None:
+        journal.append({"type": "done"})
 
-    print(f"=== 完了 ===")
-    print(f"出力: {output_path}")
+    # 結果出力
+    save_result(output_data, output_path, output_format)
+    return output_data
 
-    # モデル解放
-    del model
-    mx.clear_cache()
 
-    return output_data
+# 常駐ASRワーカー（asr_worker.py）の既定ソケット
+DEFAULT_WORKER_SOCKET = "/tmp/kirinuki-asr.sock"
+
+
+def request_worker(socket_path: str, job: dict) -> dict | None:
+    """
+    常駐ASRワーカーにジョブを送り、応答を返す
+    ワーカーが起動していなければNone
+    """
+    import socket
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+
+    with sock, sock.makefile("rwb") as f:
+        f.write(json.dumps(job, ensure_ascii=False).encode("utf-8") + b"\n")
+        f.flush()
+        # 進捗行を表示しつつ、最後の応答行を待つ
+        for line in f:
+            message = json.loads(line)
+            if "log" in message:
+                print(message["log"])
+                continue
+            return message
+    return {"ok": False, "error": "ワーカーとの接続が切断されました"}
+
+
+# バッチモードで対象にする拡張子（ディレクトリ指定時）
+VIDEO_EXTENSIONS = {".mp4", ".mkv", ".mov", ".webm", ".avi", ".m4v", ".ts"}
+
+
+def is_batch_input(path: Path) -> bool:
+    """
+    ディレクトリかグロブパターンならバッチモード
+    実在するファイルは名前に [...] などを含んでいても（yt-dlpの「タイトル [動画ID].mp4」など）1件として扱う
+    """
+    if path.is_dir():
+        return True
+    return not path.exists() and glob.has_magic(str(path))
+
+
+def collect_inputs(path: Path) -> list[Path]:
+    """ディレクトリなら中の動画、グロブなら一致するファイルを名前順に返す"""
+    if path.is_dir():
+        return sorted(p for p in path.iterdir() if p.suffix.lower() in VIDEO_EXTENSIONS)
+    return sorted(Path(p) for p in glob.glob(str(path)) if Path(p).is_file())
+
+
+def wav_duration(audio_path: Path) -> float:
+    import wave
+
+    with wave.open(str(audio_path), "rb") as w:
+        return w.getnframes() / w.getframerate()
+
+
+def transcribe_batch(videos: list[Path], args, model_id: str, cache: ASRCache | None) -> list[dict]:
+    """
+    複数動画を1回のモデルロードで順に処理
+    現在の動画を認識している間に、次の動画の音声抽出（とキャッシュ用ハッシュ計算）を別スレッドで進める
+    戻り値: 動画ごとの処理結果（長さ・処理時間・RTF）
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def prepare(video: Path):
+        audio_path = args.output_dir / f"{video.stem}.wav"
+        extract_audio_parallel(video, audio_path, args.extract_jobs)
+        audio_hash = hash_wav(audio_path) if cache is not None else None
+        return audio_path, audio_hash
+
+    backend = create_backend(args.backend, model_id)
+    backend.load()
+
+    summary = []
+    with ThreadPoolExecutor(max_workers=1) as extractor:
+        next_job = extractor.submit(prepare, videos[0])
+        for i, video in enumerate(videos):
+            job = next_job
+            next_job = extractor.submit(prepare, videos[i + 1]) if i + 1 < len(videos) else None
+
+            print(f"\n##### [{i + 1}/{len(videos)}] {video} #####")
+            json_path = args.output_dir / f"{video.stem}.json"
+            journal_path = args.output_dir / f"{video.stem}.asr-journal.jsonl"
+            entry = {"input": str(video), "output": str(json_path), "duration": None}
+            started = time.time()
+            try:
+                audio_path, audio_hash = job.result()
+                entry["duration"] = wav_duration(audio_path)
+
+                key = None
+                cached = None
+                if cache is not None:
+                    key = cache_key(audio_hash, model_id, args.chunk_duration, args.overlap,
+                                    vad=args.vad, backend=args.backend)
+                    cached = cache.get(key)
+
+                if cached is not None:
+                    print(f"=== キャッシュヒット: {cached} ===")
+                    with open(cached, encoding="utf-8") as f:
+                        save_result(json.load(f), json_path, args.format)
+                    entry["status"] = "cache"
+                else:
+                    output_data = transcribe_with_memory_clear(
+                        audio_path, json_path,
+                        model_id=model_id,
+                        chunk_duration=args.chunk_duration,
+                        overlap_duration=args.overlap,
+                        vad=args.vad,
+                        backend=backend,
+                        journal_path=journal_path,
+                        resume=args.resume,
+                        output_format=args.format,
+                        input_path=video,
+                    )
+                    if cache is not None:
+                        cache.put(key, output_data)
+                    entry["status"] = "ok"
+            except Exception as e:
+                print(f"  [ERROR] {video}: {e}", file=sys.stderr)
+                entry["status"] = "error"
+                entry["error"] = str(e)
+
+            entry["elapsed"] = time.time() - started
+            entry["rtf"] = entry["elapsed"] / entry["duration"] if entry["duration"] else None
+            summary.append(entry)
+            backend.clear_cache()
+
+    backend.unload()
+    return summary
+
+
+def print_batch_summary(summary: list[dict]) -> None:
+    """バッチ処理のRTF（処理時間 / 音声長）一覧"""
+    counts = {status: sum(e["status"] == status for e in summary) for status in ("ok", "cache", "error")}
+    print(f"\n=== バッチ完了: {len(summary)}件（処理{counts['ok']} / キャッシュ{counts['cache']} / 失敗{counts['error']}） ===")
+    print(f"{'状態':<6} | {'長さ':>8} | {'処理時間':>8} | {'RTF':>6} | ファイル")
+    print("-" * 70)
+    for e in summary:
+        duration = f"{e['duration']:.0f}s" if e["duration"] else "-"
+        rtf = f"{e['rtf']:.3f}" if e["rtf"] is not None else "-"
+        print(f"{e['status']:<6} | {duration:>8} | {e['elapsed']:>7.1f}s | {rtf:>6} | {Path(e['input']).name}")
+
+    processed = [e for e in summary if e["status"] == "ok" and e["duration"]]
+    if processed:
+        total_duration = sum(e["duration"] for e in processed)
+        total_elapsed = sum(e["elapsed"] for e in processed)
+        print(f"全体RTF（キャッシュ・失敗を除く）: {total_elapsed / total_duration:.3f}")
 
 
 def main():
     parser = argparse.ArgumentParser(description="動画からASRでタイムスタンプ付きテキストを抽出")
-    parser.add_argument("input", type=Path, help="入力動画ファイル")
+    parser.add_argument("input", type=Path,
+                        help="入力動画ファイル。ディレクトリまたはグロブ（'videos/*.mp4'）ならバッチモード")
     parser.add_argument("-o", "--output-dir", type=Path, default=Path("output"), help="出力ディレクトリ")
     parser.add_argument("-c", "--chunk-duration", type=float, default=180.0, help="チャンク長（秒）")
     parser.add_argument("--overlap", type=float, default=15.0, help="オーバーラップ長（秒）")
-    parser.add_argument("--model", type=str, default="mlx-community/parakeet-tdt_ctc-0.6b-ja", help="モデルID")
+    parser.add_argument("--backend", choices=list(BACKENDS), default=DEFAULT_BACKEND,
+                        help=f"ASRバックエンド: mlx=Parakeet MLX / cpu=faster-whisper / "
+                             f"fixture=既存のASR結果を再生 (default: {DEFAULT_BACKEND})")
+    parser.add_argument("--model", type=str, default=None,
+                        help="モデルID（省略時はバックエンドの既定。fixtureでは再生するASR結果のパス）")
+    parser.add_argument("--extract-jobs", type=int, default=1,
+                        help=f"音声抽出のffmpeg並列数。長尺動画を区間に分けて同時にデコード"
+                             f"（{EXTRACT_MIN_SPLIT * 2:.0f}秒未満の動画は分割しない）")
+    parser.add_argument("--stream", action="store_true",
+                        help="WAVを書き出さずffmpegのPCMを直接ASRに流す（デコードと認識を並行）")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="並列ASRのワーカープロセス数（1なら逐次処理）")
+    parser.add_argument("--worker-memory-gb", type=float, default=None,
+                        help="ワーカー1つあたりのMLXメモリ上限（GB）")
+    parser.add_argument("--vad", action="store_true",
+                        help="無音区間をスキップし、チャンクを無音位置で区切る（--streamとは併用不可）")
+    parser.add_argument("--use-worker", action="store_true",
+                        help="常駐ASRワーカー（asr_worker.py）が起動していればそちらで処理")
+    parser.add_argument("--worker-socket", default=DEFAULT_WORKER_SOCKET,
+                        help=f"常駐ASRワーカーのソケット (default: {DEFAULT_WORKER_SOCKET})")
+    parser.add_argument("--format", choices=["both", "json", "asr"], default="both",
+                        help="出力形式: json={stem}.json / asr=列指向形式{stem}.asr/ / both (default: both)")
+    parser.add_argument("--resume", action="store_true",
+                        help="前回中断した処理をジャーナル（{stem}.asr-journal.jsonl）から再開（入力動画と設定が同じ場合のみ）")
+    parser.add_argument("--no-cache", action="store_true", help="ASR結果キャッシュを使わない")
+    parser.add_argument("--cache-dir", type=Path, default=DEFAULT_CACHE_DIR,
+                        help=f"ASR結果キャッシュの場所 (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--cache-max-gb", type=float, default=DEFAULT_MAX_GB,
+                        help=f"キャッシュ容量上限（GB）。超えたら古いものから削除 (default: {DEFAULT_MAX_GB})")
     args = parser.parse_args()
 
+    if args.vad and args.stream:
+        parser.error("--vad は --stream と併用できません")
+    if args.backend == "fixture" and not args.model:
+        parser.error("--backend fixture には --model で再生するASR結果を指定してください")
+    model_id = args.model or BACKENDS[args.backend].default_model
+
     # 出力ディレクトリ作成
     args.output_dir.mkdir(parents=True, exist_ok=True)
 
+    # バッチモード（モデルは1回だけロード）
+    if is_batch_input(args.input):
+        if args.stream or args.workers > 1 or args.use_worker:
+            parser.error("バッチモードでは --stream / --workers / --use-worker は使えません")
+        videos = collect_inputs(args.input)
+        if not videos:
+            parser.error(f"対象の動画がありません: {args.input}")
+        print(f"=== バッチモード: {len(videos)}件 ===")
+        cache = None if args.no_cache else ASRCache(args.cache_dir, args.cache_max_gb)
+        summary = transcribe_batch(videos, args, model_id, cache)
+        print_batch_summary(summary)
+        summary_path = args.output_dir / "batch-summary.json"
+        with open(summary_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"サマリー: {summary_path}")
+        if any(e["status"] == "error" for e in summary):
+            sys.exit(1)
+        return
+
     # ファイル名
     basename = args.input.stem
     audio_path = args.output_dir / f"{basename}.wav"
     json_path = args.output_dir / f"{basename}.json"
+    journal_path = args.output_dir / f"{basename}.asr-journal.jsonl"
 
-    # 音声抽出
-    extract_audio(args.input, audio_path)
+    extracted = False
 
-    # ASR処理
-    transcribe_with_memory_clear(
-        audio_path,
-        json_path,
-        model_id=args.model,
-        chunk_duration=args.chunk_duration,
-        overlap_duration=args.overlap,
-    )
+    # ASRキャッシュ確認（デコード後の音声 + 設定が同じなら再利用）
+    # --streamでは先に全体をデコードして待たないよう確認はせず、認識しながらハッシュを計算して終了時に登録する
+    cache = None
+    audio_digest = None
+    if not args.no_cache:
+        cache = ASRCache(args.cache_dir, args.cache_max_gb)
+        if args.stream:
+            audio_digest = hashlib.sha256()
+        else:
+            extract_audio_parallel(args.input, audio_path, args.extract_jobs)
+            extracted = True
+            audio_hash = hash_wav(audio_path)
+            key = cache_key(audio_hash, model_id, args.chunk_duration, args.overlap,
+                            vad=args.vad, backend=args.backend)
+            cached = cache.get(key)
+            if cached is not None:
+                print(f"=== キャッシュヒット: {cached} ===")
+                with open(cached, encoding="utf-8") as f:
+                    save_result(json.load(f), json_path, args.format)
+                return
+
+    done = False
+    if args.use_worker and args.workers == 1:
+        if not args.stream and not extracted:
+            extract_audio_parallel(args.input, audio_path, args.extract_jobs)
+            extracted = True
+        job = {
+            "source": str((args.input if args.stream else audio_path).resolve()),
+            "output": str(json_path.resolve()),
+            "backend": args.backend,
+            "model": model_id,
+            "chunk_duration": args.chunk_duration,
+            "overlap_duration": args.overlap,
+            "stream": args.stream,
+            "vad": args.vad,
+            "journal": str(journal_path.resolve()),
+            "input": str(args.input.resolve()),
+            "resume": args.resume,
+            "format": args.format,
+        }
+        response = request_worker(args.worker_socket, job)
+        if response is None:
+            print(f"常駐ワーカーが見つかりません（{args.worker_socket}）。ローカルで処理します")
+        elif not response.get("ok"):
+            print(f"常駐ワーカーでエラー: {response.get('error')}。ローカルで処理します")
+        else:
+            print(f"=== 完了（常駐ワーカー, {response['elapsed']:.1f}s） ===")
+            print(f"出力: {json_path}")
+            output_data = load_asr(json_path).to_dict() if cache is not None else None
+            done = True
+
+    if not done:
+        # 音声抽出
+        if not args.stream and not extracted:
+            extract_audio_parallel(args.input, audio_path, args.extract_jobs)
+
+        # ASR処理
+        output_data = transcribe_with_memory_clear(
+            args.input if args.stream else audio_path,
+            json_path,
+            model_id=model_id,
+            chunk_duration=args.chunk_duration,
+            overlap_duration=args.overlap,
+            stream=args.stream,
+            workers=args.workers,
+            memory_limit_gb=args.worker_memory_gb,
+            vad=args.vad,
+            backend_name=args.backend,
+            journal_path=journal_path,
+            resume=args.resume,
+            output_format=args.format,
+            audio_digest=audio_digest,
+            input_path=args.input,
+        )
+
+    if cache is not None:
+        if args.stream:
+            # 常駐ワーカーで処理した場合はハッシュがないので登録しない
+            key = None if done else cache_key(audio_digest.hexdigest(), model_id, args.chunk_duration,
+                                              args.overlap, vad=args.vad, backend=args.backend)
+        if key is not None:
+            cache.put(key, output_data)
+            print(f"キャッシュ登録: {cache.cache_dir}")
 
 
 if __name__ == "__main__":